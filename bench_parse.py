@@ -0,0 +1,74 @@
+"""
+解析消费记录页面的性能测试：比较在线程池与进程池中解析的吞吐量（页面/秒）随工作者数量的变化。
+
+BeautifulSoup 的解析是 CPU 密集的，在线程中执行时受 GIL 限制，吞吐量不随线程数增加；
+在进程池中执行时，吞吐量应随 CPU 核心数近似线性地增加。页面由 FakeCampusServer 生成，与压力测试所用的相同。
+
+用法示例：
+    python bench_parse.py --pages 200 --rows 150
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, List
+
+from bupt_card_alert_bot import *
+
+argp = argparse.ArgumentParser(description='Benchmark parsing consume-info pages in threads vs. processes.')
+argp.add_argument('--pages', type=int, default=200, help='Pages parsed per run. Default: %(default)s')
+argp.add_argument('--rows', type=int, default=150, help='Transactions in each page. Default: %(default)s')
+argp.add_argument('--max-workers', type=int, default=os.cpu_count() or 1,
+                  help='Largest pool size to try. Default: number of CPUs (%(default)s)')
+
+
+def make_pages(count: int, rows: int) -> List[str]:
+    # 用足够高的消费频率，使最近一天内恰有约 rows 条记录；每个页面属于不同的账号，内容互不相同
+    generator = FakeTransactionGenerator(rate_per_hour=rows / 24, keep_days=1)
+    campus = FakeCampusServer(generator=generator)
+    pages = []
+    for i in range(count):
+        trans = sorted(generator.transactions(f'bench{i}'), key=lambda x: x.op_timestamp, reverse=True)
+        __, __, body = campus.render_consume_info(trans, {'desc': True}, '2000-01-01', '2000-01-01')
+        pages.append(body.decode(UNIFIED_ENCODING))
+    return pages
+
+
+def run(make_pool: Callable[[int], Executor], workers: int, pages: List[str]) -> float:
+    """
+    :return: 吞吐量（页面/秒）
+    """
+    with make_pool(workers) as pool:
+        # 预热：启动工作进程、导入模块，不计入时间
+        list(pool.map(parse_consume_page, pages[:workers]))
+
+        begin = time.perf_counter()
+        parsed = list(pool.map(parse_consume_page, pages, chunksize=1))
+        elapsed = time.perf_counter() - begin
+
+    assert all(len(x.transactions) > 0 for x in parsed)
+    return len(pages) / elapsed
+
+
+def main() -> None:
+    args = argp.parse_args()
+    pages = make_pages(args.pages, args.rows)
+    print(f'{len(pages)} pages, {sum(len(x) for x in pages) // len(pages)} characters on average, '
+          f'{args.rows} rows per page')
+
+    begin = time.perf_counter()
+    for x in pages:
+        parse_consume_page(x)
+    print(f'in-process: {len(pages) / (time.perf_counter() - begin):8.1f} pages/s')
+
+    workers = 1
+    while workers <= args.max_workers:
+        threads = run(ThreadPoolExecutor, workers, pages)
+        processes = run(ProcessPoolExecutor, workers, pages)
+        print(f'{workers:3d} workers: threads {threads:8.1f} pages/s, processes {processes:8.1f} pages/s')
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
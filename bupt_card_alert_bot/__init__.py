@@ -2,6 +2,7 @@ from .client import *
 from .constant import *
 from .dao import *
 from .exceptions import *
+from .fake_server import *
 from .popo import *
 from .service import *
 from .util import *
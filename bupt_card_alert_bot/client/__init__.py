@@ -1,3 +1,10 @@
 from .tg_bot_client import *
 from .ecard_client import *
 from .vpn_client import *
+from .tg_webhook_server import *
+from .account_client import *
+from .ecard_parser import *
+from .shared_vpn_client import *
+from .event_stream_server import *
+from .query_api_server import *
+from .transaction_notifier import *
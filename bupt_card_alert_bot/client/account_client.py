@@ -0,0 +1,160 @@
+"""
+本文件提供 AccountClient 类。
+该类将某个账号所用的 Session、VpnClient 和 EcardClient 组合在一起。
+"""
+
+__all__ = ('AccountClient',)
+
+import logging as pym_logging
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import requests
+
+from ..constant import *
+from ..exceptions import AppVpnSessionError
+from ..popo import AccountConfig, SessionKeeper, Transaction
+from ..util import RetrySession, HostRateLimiter, get_begin_end_date, stage_timer
+from .ecard_client import EcardClient
+from .shared_vpn_client import SharedVpnSession
+from .vpn_client import VpnClient
+
+logger = pym_logging.getLogger(__name__)
+
+
+class AccountClient:
+    """
+    单个校园卡账号的客户端。
+    每个实例拥有独立的 Session（Cookie），因此同一进程中可以同时登录多个账号。
+    提供 shared_vpn 时，不再用该账号自己的 vpn 账号登录，而是共用 SharedVpnSession 的 VPN 登录。
+    """
+    __slots__ = ('account', 'sess_keep', 'vpc', 'ecc', 'logged_in', 'shared_vpn', 'vpn_generation', 'vpn_stale')
+
+    def __init__(self, account: AccountConfig, sess: Optional[requests.Session] = None,
+                 limiter: Optional[HostRateLimiter] = None, vpn_base: str = DEFAULT_VPN_BASE,
+                 parser_pool: Optional[Executor] = None,
+                 shared_vpn: Optional[SharedVpnSession] = None) -> None:
+        """
+        :param account: 账号配置
+        :param sess: 该账号所用的 Session，不提供则新建一个
+        :param limiter: 限流器，同一进程中的所有账号应共享同一个
+        :param vpn_base: WebVPN 的地址
+        :param parser_pool: 解析消费记录页面的进程池，同一进程中的所有账号应共享同一个；为 None 时在当前线程中解析
+        :param shared_vpn: 共用的 VPN 登录；为 None 时使用 account 中的 vpn 账号单独登录
+        """
+        self.account = account
+        self.shared_vpn = shared_vpn
+        # 最近一次从 shared_vpn 同步的 VPN 登录的 generation
+        self.vpn_generation: Optional[int] = None
+        # 本账号的请求是否因 VPN 会话失效而失败；只有此时才需要重新登录共用的 VPN
+        self.vpn_stale = False
+
+        if sess is None:
+            sess = shared_vpn.new_session() if shared_vpn is not None else requests.Session()
+        self.sess_keep = SessionKeeper(RetrySession(sess, limiter))
+        self.vpc = VpnClient(self.sess_keep, vpn_base)
+        self.ecc = EcardClient(self.sess_keep, vpn_base, parser_pool)
+
+        # 是否（认为自己）处于已登录状态；请求失败后应将其设为 False，以便下次重新登录
+        self.logged_in = False
+
+    def login(self) -> None:
+        """
+        登录 vpn 和 ecard。
+        :return: None
+        """
+        logger.debug(f'登录账号 {self.account.name}')
+        with stage_timer.stage('login'):
+            if self.shared_vpn is None:
+                self.vpc.login(
+                    username=self.account.vpn_username,
+                    password=self.account.vpn_password,
+                )
+            else:
+                # 此前的请求因 VPN 会话失效而失败时，若其它账号尚未因此重新登录 VPN，则由本账号重新登录；
+                # 其它错误（如 ecard 密码错误、页面解析失败）与 VPN 无关，只需同步 Cookie 后重新登录 ecard
+                self.shared_vpn.ensure_login(self.vpn_generation if self.vpn_stale else None)
+                self.vpn_generation = self.shared_vpn.sync_cookies(self.sess_keep.sess.sess)
+                self.vpn_stale = False
+
+            try:
+                self.ecc.goto_login_page()
+                self.ecc.login(
+                    username=self.account.ecard_username,
+                    password=self.account.ecard_password,
+                )
+            except AppVpnSessionError:
+                self.vpn_stale = True
+                raise
+            finally:
+                self.ecc.release_page()
+        self.logged_in = True
+
+    def fetch_transactions(self, skip_if_unchanged: bool = False,
+                           lookup_date: Optional[Tuple[str, str]] = None,
+                           since_timestamp: Optional[int] = None) -> Optional[Set[Transaction]]:
+        """
+        查询并解析最近的消费记录。若尚未登录，则先登录。
+        请求失败时抛出 AppError，并将 logged_in 设为 False。
+        :param skip_if_unchanged: 参见 EcardClient.lookup_consume_info；处理完返回的记录后应调用 commit_digest
+        :param lookup_date: 查询的 (起始日期, 截止日期)，形如 2000-01-01；默认为最近几天
+        :param since_timestamp: 只需要不早于该时间戳的消费记录，参见 EcardClient.parse_consume_info
+        :return: set 容器，元素为 Transaction 对象；消费记录未变化且 skip_if_unchanged 时返回 None
+        """
+        if not self.logged_in:
+            self.login()
+        elif self.shared_vpn is not None and self.vpn_generation != self.shared_vpn.generation:
+            # 其它账号重新登录了共用的 VPN，换用新的 VPN Cookie
+            self.vpn_generation = self.shared_vpn.sync_cookies(self.sess_keep.sess.sess)
+
+        ecc = self.ecc
+        try:
+            ecc.goto_consume_info_page()
+            changed = ecc.lookup_consume_info(
+                lookup_date=lookup_date if lookup_date is not None else get_begin_end_date(),
+                skip_if_unchanged=skip_if_unchanged,
+            )
+            return ecc.parse_consume_info(since_timestamp) if changed else None
+        except Exception as e:
+            self.logged_in = False
+            if isinstance(e, AppVpnSessionError):
+                self.vpn_stale = True
+            raise
+        finally:
+            ecc.release_page()
+
+    def commit_digest(self) -> None:
+        """
+        fetch_transactions 返回的消费记录都已处理完毕后调用，参见 EcardClient.commit_digest。
+        :return: None
+        """
+        self.ecc.commit_digest()
+
+    def export_cookies(self) -> List[Dict[str, Any]]:
+        """
+        将 Session 中的 Cookie 导出为可以被 JSON 序列化的 list，以便交给其它进程继续使用该会话。
+        :return: list，元素为 dict
+        """
+        return [
+            {
+                'name': c.name,
+                'value': c.value,
+                'domain': c.domain,
+                'path': c.path,
+                'secure': c.secure,
+                'expires': c.expires,
+            }
+            for c in self.sess_keep.sess.cookies()
+        ]
+
+    def import_cookies(self, cookies: List[Dict[str, Any]]) -> None:
+        """
+        导入 export_cookies 导出的 Cookie。导入后认为已登录；若会话实际已失效，下次请求失败时会重新登录。
+        :param cookies: export_cookies 的返回值
+        :return: None
+        """
+        jar = self.sess_keep.sess.cookies()
+        for c in cookies:
+            jar.set(c['name'], c['value'], domain=c['domain'], path=c['path'],
+                    secure=c['secure'], expires=c['expires'])
+        self.logged_in = len(cookies) != 0
@@ -4,25 +4,80 @@
 
 __all__ = ('EcardClient',)
 
+import hashlib
 import logging as pym_logging
 import re
-from typing import Optional, Tuple, Set, Dict
+from concurrent.futures import BrokenExecutor, Executor
+from typing import Optional, Sequence, Tuple, Set, Dict
 
 import requests
 from bs4 import BeautifulSoup
 
-from ..exceptions import AppError
+from ..constant import *
+from ..exceptions import AppError, AppAuthError, AppNetworkError, AppVpnSessionError, AppParseError
 from ..popo import SessionKeeper, EcardUserInfo, Transaction
-from ..util import get_begin_end_date, parse_ecard_date
+from ..util import get_begin_end_date, read_text_until, stage_timer
 from ..service import log_resp
+from .ecard_parser import parse_consume_page
 
 logger = pym_logging.getLogger('bupt_card_alert_bot.client.ecard_client')
 
-# 匹配 HTML 的标签（tag），及其周围的空白符；将多个标签视为一个，以方便替换
-RE_HTML_TAG = re.compile(r'(<[^>]*>(\s|&nbsp;?)*)+')
+# 用于验证是否成功进入了“消费信息查询”页面的文字
+CONSUME_INFO_VALIDATION = '''User/ConsumeInfo.aspx'>消费信息查询</a>'''
 
-# 消费记录表格应该有 7 列
-TR_DATA_EXPECTED_LENGTH = 7
+# 消费记录表格在原始 HTML 中的起止标记
+GRID_VIEW_BEGIN = 'id="ContentPlaceHolder1_gridView"'
+GRID_VIEW_END = '</table>'
+
+# 排序按钮（“操作时间”上的箭头）的 id、按下时提交的 __EVENTTARGET，以及在原始 HTML 中匹配该按钮的正则
+SORT_BUTTON_ID = 'ContentPlaceHolder1_gridView_SortBt'
+SORT_BUTTON_TARGET = 'ctl00$ContentPlaceHolder1$gridView$ctl01$SortBt'
+RE_SORT_BUTTON = re.compile(r'<input[^>]*\bid="' + SORT_BUTTON_ID + r'"[^>]*>')
+
+# VPN 会话失效时，经 WebVPN 的请求会被重定向到该页面
+VPN_LOGIN_PAGE = '/global-protect/login.esp'
+
+
+def check_vpn_session(resp: requests.Response) -> None:
+    """
+    若请求被重定向到了 VPN 登录页，则抛出 AppVpnSessionError。
+    :param resp: 经 WebVPN 访问 ecard 网站的请求结果
+    :return: None
+    """
+    if VPN_LOGIN_PAGE in resp.url:
+        log_resp(logger, resp)
+        raise AppVpnSessionError(f'VPN 会话已失效（被重定向到 {resp.url}）')
+
+
+def grid_view_digest(content: str) -> Optional[bytes]:
+    """
+    计算原始 HTML 中消费记录表格所在区间的摘要，用于在解析前判断消费记录是否变化。
+    只截取表格本身，因为页面其余部分（如 __VIEWSTATE）每次请求都可能不同。
+    表格的行序与排序按钮的 class 都随排序方向变化，因此只有各次查询的排序方向相同时摘要才可能相同，
+    这由 EcardClient.lookup_consume_info 的 sort_desc 参数保证。
+    :param content: 原始 HTML
+    :return: 摘要；找不到表格时返回 None
+    """
+    begin = content.find(GRID_VIEW_BEGIN)
+    if begin == -1:
+        return None
+    end = content.find(GRID_VIEW_END, begin)
+    if end == -1:
+        return None
+    return hashlib.blake2b(content[begin:end].encode(UNIFIED_ENCODING), digest_size=16).digest()
+
+
+def sort_desc_of_classes(classes: Sequence[str]) -> Optional[bool]:
+    """
+    根据排序按钮的 class 判断是否处于降序状态。
+    :param classes: class 属性中的各个类名（BeautifulSoup 将 class 解析为 list）
+    :return: True 表示降序，False 表示升序；class 异常时返回 None
+    """
+    if 'SortBt_Desc' in classes:
+        return True
+    if 'SortBt_Asc' in classes:
+        return False
+    return None
 
 
 class EcardClient:
@@ -34,18 +89,55 @@ class EcardClient:
 
     在获取某个页面上的信息时，需先调用以 goto/lookup 开头的方法（这类方法改变类的状态），
     再调用 parse 开头的方法。
+
+    消费记录表格的排序方向保存在页面的 __VIEWSTATE 中，按下排序按钮会使其反转。
+    本类将 last_soup 中表格的排序方向记在 sort_desc 中，查询时据此决定是否按下排序按钮，
+    因此只需一次 POST 即可得到所需的顺序。
     """
-    __slots__ = ('sess_keep', 'last_soup')
+    __slots__ = ('sess_keep', 'vpn_base', 'parser_pool', 'last_soup', 'sort_desc',
+                 '__grid_digest', '__pending_digest', '__pending_text')
 
-    def __init__(self, sess_keep: SessionKeeper) -> None:
+    def __init__(self, sess_keep: SessionKeeper, vpn_base: str = DEFAULT_VPN_BASE,
+                 parser_pool: Optional[Executor] = None) -> None:
         """
         初始化 EcardClient 类。
         :param sess_keep: 存有 RetrySession 实例的 POPO，最好与 VpnClient 使用同一个。
+        :param vpn_base: WebVPN 的地址，结尾不含“/”，应与 VpnClient 的相同
+        :param parser_pool: 用于解析消费记录页面的进程池，多个 EcardClient 可以共享同一个；
+                            为 None 时在当前线程中解析
         """
         if sess_keep.sess is None:
             raise ValueError('sess_keep 内必须有已初始化的 Session。')
 
         self.sess_keep = sess_keep
+        self.vpn_base = vpn_base
+        self.parser_pool = parser_pool
+
+        # 最近一次获取到的页面的 DOM 树，由 goto/lookup 开头的方法设置
+        self.last_soup: Optional[BeautifulSoup] = None
+
+        # last_soup 中的消费记录表格是否按操作时间降序排列；页面上没有排序按钮时为 None
+        self.sort_desc: Optional[bool] = None
+
+        # 最近一次成功解析的消费记录表格的摘要，以及最近一次查询到、尚未解析的表格的摘要
+        self.__grid_digest: Optional[bytes] = None
+        self.__pending_digest: Optional[bytes] = None
+
+        # 最近一次查询到、尚未解析的消费记录页面的 HTML
+        self.__pending_text: Optional[str] = None
+
+    def release_page(self) -> None:
+        """
+        释放最近一次获取到的页面的 DOM 树。
+        parse 开头的方法返回的结果不引用 DOM 树，因此解析完毕后即可调用本方法，
+        避免整棵树在主循环休眠期间一直占用内存。
+        :return: None
+        """
+        if self.last_soup is not None:
+            # decompose 会拆除树中的循环引用，使其无需等待 GC 即可被回收
+            self.last_soup.decompose()
+            self.last_soup = None
+        self.__pending_text = None
 
     def goto(self, url: str, validation: Optional[str] = None) -> requests.Response:
         """
@@ -60,25 +152,35 @@ class EcardClient:
 
         sess = self.sess_keep.sess
         resp = sess.get(url)
+        check_vpn_session(resp)
         if resp.status_code != 200:
             log_resp(logger, resp)
-            raise AppError(f'无法获取 URL {url}')
+            raise AppNetworkError(f'无法获取 URL {url}')
         if validation is not None and validation not in resp.text:
             log_resp(logger, resp)
             raise AppError(f'指定的内容「{validation}」无法在 {url} 中找到。')
 
-        self.last_soup = BeautifulSoup(resp.text, 'html.parser')
+        with stage_timer.stage('soup'):
+            self.last_soup = BeautifulSoup(resp.text, 'html.parser')
+        self.sort_desc = self.__parse_sort_desc()
         return resp
 
+    def url(self, page: str) -> str:
+        """
+        返回经 WebVPN 访问 ecard 网站上某个页面的 URL。
+        :param page: 页面的路径，如 User/ConsumeInfo.aspx
+        :return: URL
+        """
+        return f'{self.vpn_base}/http/ecard.bupt.edu.cn/{page}'
+
     def goto_login_page(self) -> None:
-        self.goto('https://vpn.bupt.edu.cn/http/ecard.bupt.edu.cn/Login.aspx', '用户登录</a>')
+        self.goto(self.url('Login.aspx'), '用户登录</a>')
 
     def goto_consume_info_page(self) -> None:
-        self.goto('https://vpn.bupt.edu.cn/http/ecard.bupt.edu.cn/User/ConsumeInfo.aspx',
-                  '''User/ConsumeInfo.aspx'>消费信息查询</a>''')
+        self.goto(self.url('User/ConsumeInfo.aspx'), CONSUME_INFO_VALIDATION)
 
     def goto_personal_info_page(self) -> None:
-        self.goto('https://vpn.bupt.edu.cn/http/ecard.bupt.edu.cn/User/baseinfo.aspx', '个 人 基 本 信 息')
+        self.goto(self.url('User/baseinfo.aspx'), '个 人 基 本 信 息')
 
     def login(self, username: str, password: str) -> None:
         """
@@ -97,18 +199,19 @@ class EcardClient:
         form['txtPassword'] = password
         form['__EVENTTARGET'] = 'btnLogin'
 
-        resp = sess.post(
-            'https://vpn.bupt.edu.cn/http/ecard.bupt.edu.cn/Login.aspx',
-            data=form)
+        resp = sess.post(self.url('Login.aspx'), data=form)
+        check_vpn_session(resp)
 
         if '账户或密码错误' in resp.text:
-            raise AppError('用户提供的 Ecard 用户名或密码错误，无法登录 Ecard 网站。')
+            raise AppAuthError('用户提供的 Ecard 用户名或密码错误，无法登录 Ecard 网站。')
 
         if not resp.url.endswith('Index.aspx'):
             log_resp(logger, resp)
             raise AppError('无法登录 Ecard 网站。')
 
-        self.last_soup = BeautifulSoup(resp.text, 'html.parser')
+        with stage_timer.stage('soup'):
+            self.last_soup = BeautifulSoup(resp.text, 'html.parser')
+        self.sort_desc = self.__parse_sort_desc()
 
     def parse_personal_info(self) -> EcardUserInfo:
         """
@@ -116,24 +219,34 @@ class EcardClient:
         :return: EcardUserInfo 对象
         """
         soup = self.last_soup
+
+        # .string 返回的 NavigableString 引用着整棵 DOM 树，需转换为 str 才能与树分离
         ecard_info = EcardUserInfo(
-            id=soup.find(id='ContentPlaceHolder1_txtOutID').string,
-            name=soup.find(id='ContentPlaceHolder1_txtUserName').string,
-            role=soup.find(id='ContentPlaceHolder1_txtCardSF').string,
+            id=str(soup.find(id='ContentPlaceHolder1_txtOutID').string),
+            name=str(soup.find(id='ContentPlaceHolder1_txtUserName').string),
+            role=str(soup.find(id='ContentPlaceHolder1_txtCardSF').string),
         )
 
         return ecard_info
 
-    def lookup_consume_info(self, with_sort_button: bool = False,
-                            lookup_date: Optional[Tuple[str, str]] = None) -> None:
+    def lookup_consume_info(self, sort_desc: Optional[bool] = True,
+                            lookup_date: Optional[Tuple[str, str]] = None,
+                            skip_if_unchanged: bool = False) -> bool:
         """
         向查询消费记录的接口发送 POST 请求，以获取含消费记录的页面。
-        获取到的 HTML 将在解析后存入本类中。
+        获取到的 HTML 将存入本类中，由 parse_consume_info 解析。
 
-        :param with_sort_button: 该网站按下“箭头”按钮时会发出 POST 请求。如果为 True，将在 POST 同时模拟按下该按钮。
+        :param sort_desc: 所需的排序方向：True 为按操作时间降序（最新的在前），False 为升序，None 表示不关心。
+                          该网站按下“箭头”按钮时会发出 POST 请求并反转排序方向，因此只有当前方向（self.sort_desc）
+                          与所需方向不同时，才在 POST 的同时模拟按下该按钮
         :param lookup_date: 网站上的参数“起始日期”和“截止日期”，形如 2000-01-01
-        :return: None
+        :param skip_if_unchanged: 如果为 True，且消费记录表格与上次 commit_digest 时完全相同，则不解析 HTML
+        :return: 是否获取到了（需要解析的）新页面；为 False 时不应调用 parse_consume_info
         """
+        if sort_desc is not None and self.sort_desc is None:
+            # 当前方向未知时，按下按钮的结果也是未知的，因此只做普通的查询
+            logger.debug('当前页面的排序方向未知，不使用排序按钮')
+        with_sort_button = sort_desc is not None and self.sort_desc is not None and self.sort_desc != sort_desc
         logger.debug(f'lookup_consume_info(使用排序按钮={with_sort_button}, 查询日期={lookup_date})')
 
         # 填写查询表单（以下内容为通过抓包获取）
@@ -142,7 +255,7 @@ class EcardClient:
 
         # 当 with_sort_button 时，只需略微修改表单
         if with_sort_button:
-            form['__EVENTTARGET'] = 'ctl00$ContentPlaceHolder1$gridView$ctl01$SortBt'
+            form['__EVENTTARGET'] = SORT_BUTTON_TARGET
             if 'ctl00$ContentPlaceHolder1$btnSearch' in form:
                 del form['ctl00$ContentPlaceHolder1$btnSearch']
         else:
@@ -156,76 +269,96 @@ class EcardClient:
         form['ctl00$ContentPlaceHolder1$rbtnType'] = '0'
 
         sess = self.sess_keep.sess
-        resp = sess.post('https://vpn.bupt.edu.cn/http/ecard.bupt.edu.cn/User/ConsumeInfo.aspx',
-                         data=form)
-        if '''User/ConsumeInfo.aspx'>消费信息查询</a>''' not in resp.text:
+        resp = sess.post(self.url('User/ConsumeInfo.aspx'), data=form, stream=True)
+        check_vpn_session(resp)
+        if resp.status_code != 200:
             log_resp(logger, resp)
-            raise AppError('消费信息查询失败')
+            raise AppNetworkError('消费信息查询失败')
 
-        self.last_soup = BeautifulSoup(resp.text, 'html.parser')
-
-    def parse_consume_info(self) -> Set[Transaction]:
+        # 查询结果只用于解析消费记录，其中的表单不会再被提交，因此读完消费记录表格即可停止下载，
+        # 不必等待表格之后的大段内容（如分页、页脚）
+        text, complete = read_text_until(resp, (CONSUME_INFO_VALIDATION, GRID_VIEW_BEGIN, GRID_VIEW_END))
+        if CONSUME_INFO_VALIDATION not in text:
+            logger.debug(f'resp.url = {resp.url}, text = {text}')
+            raise AppError('消费信息查询失败')
+        logger.debug(f'读取了 {len(text)} 个字符，{"已" if complete else "未"}提前结束')
+
+        if sort_desc is not None:
+            btn = RE_SORT_BUTTON.search(text)
+            got = sort_desc_of_classes(re.split(r'[\s"]', btn.group())) if btn is not None else None
+            if got != sort_desc:
+                logger.debug(f'查询结果的排序方向为 {got}，与所需的 {sort_desc} 不同')
+
+        # 大多数轮询都没有新的消费记录，此时对原始文本做一次哈希，比解析整个 DOM 树便宜得多；
+        # 排序方向不一致的查询结果的摘要必然不同，因此只有每次都按同一方向查询时才能跳过解析
+        digest = grid_view_digest(text)
+        if skip_if_unchanged and digest is not None and digest == self.__grid_digest:
+            logger.debug('消费记录表格未变化，跳过解析')
+            self.release_page()
+            return False
+
+        self.__pending_digest = digest
+        self.__pending_text = text
+        return True
+
+    def parse_consume_info(self, since_timestamp: Optional[int] = None) -> Set[Transaction]:
         """
-        从本类的状态中解析个学号、姓名等个人信息。
+        解析 lookup_consume_info 获取到的消费记录。
+        若提供了 parser_pool，则在进程池中解析：只有 HTML 文本与解析出的消费记录需要跨进程传递，
+        解析期间当前进程的其它线程不受 GIL 的影响。
+        若进程池已损坏（如子进程被 OOM killer 杀死），则记录日志、不再使用该进程池，并在当前进程中解析。
+        此时不重新创建进程池：服务运行中其它线程可能正持有锁，此时 fork 出的子进程可能死锁。
+        :param since_timestamp: 参见 parse_consume_page；只有表格确实按降序排列时才会提前结束
         :return: set 容器，元素为 Transaction 对象
         """
-
-        form1 = self.last_soup.find(id='form1')
-        info_table = form1.find(id='ContentPlaceHolder1_gridView')
-        if info_table is None:
-            logger.debug(f'form1 的 HTML: {str(info_table)}')
-            raise AppError('找不到存放消费记录的 <table>。')
-        if 'class="gvNoRecords"' in str(info_table):
-            # 网页弹出了提示“未查询到记录！”
-            return set()
-
-        res = set()
-        # 遍历存放消费记录的 <table> 的每一个 <tr>
-        for tr in info_table.select('tr:not(.HeaderStyle)'):
-            # 将多余的 HTML 标签替换为换行符，再将头尾换行符去掉，最后按行分割为字符串数组
-            tr_data = RE_HTML_TAG.sub('\n', str(tr)).strip().split('\n')
-            if tr_data == [''] or len(tr_data) == 0:
-                # 空行则跳过
-                continue
-
-            if len(tr_data) != TR_DATA_EXPECTED_LENGTH:
-                logger.debug(f'消费记录爆炸。res = {res}\ninfo_table = {str(info_table)}\ntr_data = {tr_data}')
-                raise AppError(f'消费记录的列数为 {len(tr_data)}，'
-                               f'与预设值 {TR_DATA_EXPECTED_LENGTH} 不同，可能是解析代码出错。')
-
-            # 将原始数据存入 Transaction 对象，以方便使用
-            # 此处将对应关系一行行写出，灵活性更强
-            transaction = Transaction(
-                op_datetime=tr_data[0],
-                category=tr_data[1],
-                trans_amount=float(tr_data[2]),
-                balance=float(tr_data[3]),
-                location=tr_data[6],
-                # 将日期解析成时间戳保存
-                op_timestamp=parse_ecard_date(tr_data[0]),
-            )
-
-            res.add(transaction)
-
-        return res
+        if self.__pending_text is None:
+            raise AppError('尚未查询消费记录，或查询结果已被释放。')
+
+        page = None
+        if self.parser_pool is not None:
+            try:
+                page = self.parser_pool.submit(parse_consume_page, self.__pending_text, since_timestamp).result()
+            except BrokenExecutor as e:
+                logger.warning(f'解析消费记录的进程池已损坏，此后改为在当前进程中解析：{e!r}')
+                self.parser_pool.shutdown(wait=False)
+                self.parser_pool = None
+        if page is None:
+            page = parse_consume_page(self.__pending_text, since_timestamp)
+
+        return set(page.transactions)
+
+    def commit_digest(self) -> None:
+        """
+        记下最近一次由 parse_consume_info 解析的表格的摘要，此后内容相同的表格会被 lookup_consume_info 跳过。
+        调用者应在解析出的消费记录都已处理完毕（如通知都已发送）后才调用本方法，
+        否则处理失败的记录会因表格“未变化”而在之后的轮询中被跳过，直到有新的消费记录为止。
+        :return: None
+        """
+        self.__grid_digest = self.__pending_digest
+        self.__pending_digest = None
 
     def is_sort_button_desc(self) -> bool:
         """
         在已进入“xx信息查询”页面的状态下，判断“操作时间”上的按钮是否处于降序状态。
         :return: True 表示当前操作时间按降序排列
         """
+        if self.sort_desc is None:
+            raise AppParseError('没找到箭头按钮（SortBt），或其 class 属性异常。')
+        return self.sort_desc
 
-        btn = self.last_soup.find(id='ContentPlaceHolder1_gridView_SortBt')
+    def __parse_sort_desc(self) -> Optional[bool]:
+        """
+        从 self.last_soup 中解析“操作时间”上的按钮的排序方向。
+        :return: True 表示降序，False 表示升序；页面上没有该按钮或其 class 异常时返回 None
+        """
+        btn = self.last_soup.find(id=SORT_BUTTON_ID)
         if btn is None:
-            logger.debug(f'无法找到箭头按钮。self.last_soup = {str(self.last_soup)}')
-            raise AppError('没找到箭头按钮（SortBt）。')
+            return None
 
-        class_name = btn.attrs['class'][0]
-        if class_name != 'SortBt_Desc' and class_name != 'SortBt_Asc':
-            logger.debug(f'btn = {str(btn)}\nclass_name = {class_name}')
-            raise AppError('箭头按钮（SortBt）的 class 属性异常。')
-
-        return btn.attrs['class'] == 'SortBt_Desc'
+        res = sort_desc_of_classes(btn.attrs.get('class', ()))
+        if res is None:
+            logger.debug(f'箭头按钮（SortBt）的 class 属性异常：btn = {str(btn)}')
+        return res
 
     def __get_post_body_of_form(self) -> Dict[str, str]:
         """
@@ -0,0 +1,86 @@
+"""
+本文件提供解析 ecard 网站页面的纯函数。
+这些函数只依赖传入的 HTML 文本，不访问网络、不修改任何状态，因此可以放到进程池中执行，
+避免在多账号部署时，CPU 密集的 BeautifulSoup 解析持有 GIL、阻塞其它账号的网络 I/O。
+"""
+
+__all__ = ('parse_consume_page',)
+
+import re
+from typing import Optional
+
+from bs4 import BeautifulSoup
+
+from ..exceptions import AppParseError
+from ..popo import ConsumePage, Transaction
+from ..util import parse_ecard_date, stage_timer
+
+# 匹配 HTML 的标签（tag），及其周围的空白符；将多个标签视为一个，以方便替换
+RE_HTML_TAG = re.compile(r'(<[^>]*>(\s|&nbsp;?)*)+')
+
+# 消费记录表格应该有 7 列
+TR_DATA_EXPECTED_LENGTH = 7
+
+
+def parse_consume_page(content: str, since_timestamp: Optional[int] = None) -> ConsumePage:
+    """
+    解析“消费信息查询”页面中的消费记录表格。
+    :param content: 页面的 HTML，至少要包含完整的消费记录表格
+    :param since_timestamp: 表格按操作时间降序排列时，遇到早于该时间戳的记录即停止，其后的记录都不会返回；
+                            为 None 或表格不是降序时，解析全部记录
+    :return: ConsumePage 对象
+    """
+    with stage_timer.stage('soup'):
+        soup = BeautifulSoup(content, 'html.parser')
+
+    try:
+        form1 = soup.find(id='form1')
+        info_table = form1.find(id='ContentPlaceHolder1_gridView') if form1 is not None else None
+        if info_table is None:
+            raise AppParseError('找不到存放消费记录的 <table>。')
+
+        btn = info_table.find(id='ContentPlaceHolder1_gridView_SortBt')
+        sort_desc = 'SortBt_Desc' in btn.attrs.get('class', ()) if btn is not None else None
+        if not sort_desc:
+            since_timestamp = None
+
+        if 'class="gvNoRecords"' in str(info_table):
+            # 网页弹出了提示“未查询到记录！”
+            return ConsumePage(transactions=(), sort_desc=sort_desc)
+
+        res = []
+        # 遍历存放消费记录的 <table> 的每一个 <tr>
+        for tr in info_table.select('tr:not(.HeaderStyle)'):
+            # 将多余的 HTML 标签替换为换行符，再将头尾换行符去掉，最后按行分割为字符串数组
+            with stage_timer.stage('regex'):
+                tr_data = RE_HTML_TAG.sub('\n', str(tr)).strip().split('\n')
+            if tr_data == [''] or len(tr_data) == 0:
+                # 空行则跳过
+                continue
+
+            if len(tr_data) != TR_DATA_EXPECTED_LENGTH:
+                raise AppParseError(f'消费记录的列数为 {len(tr_data)}，'
+                                    f'与预设值 {TR_DATA_EXPECTED_LENGTH} 不同，可能是解析代码出错。'
+                                    f'tr_data = {tr_data}')
+
+            # 将日期解析成时间戳保存
+            op_timestamp = parse_ecard_date(tr_data[0])
+            if since_timestamp is not None and op_timestamp < since_timestamp:
+                # 最新的记录在前，其后的记录都更早
+                break
+
+            # 将原始数据存入 Transaction 对象，以方便使用
+            # 此处将对应关系一行行写出，灵活性更强
+            res.append(Transaction(
+                op_datetime=tr_data[0],
+                category=tr_data[1],
+                trans_amount=float(tr_data[2]),
+                balance=float(tr_data[3]),
+                location=tr_data[6],
+                op_timestamp=op_timestamp,
+            ))
+
+        return ConsumePage(transactions=tuple(res), sort_desc=sort_desc)
+    finally:
+        # 拆除树中的循环引用，使其无需等待 GC 即可被回收
+        soup.decompose()
@@ -0,0 +1,226 @@
+"""
+本文件提供 EventStreamServer 类。
+该类在本地 Unix 域套接字上推送新的消费记录，供其它程序订阅，而不必解析日志或 JSON 文件。
+"""
+
+__all__ = ('EventStreamServer',)
+
+import json
+import logging as pym_logging
+import os
+import queue
+import socket
+import stat
+import threading
+import time
+from collections import deque
+from socketserver import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+
+from ..constant import *
+from ..exceptions import AppError
+from ..popo import Transaction
+
+logger = pym_logging.getLogger(__name__)
+
+
+class _ThreadingUnixStreamServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class _Subscriber:
+    __slots__ = ('queue',)
+
+    def __init__(self, max_queue_size: int) -> None:
+        # 元素为一行 NDJSON（bytes）；None 表示应断开连接
+        self.queue: 'queue.Queue[Optional[bytes]]' = queue.Queue(maxsize=max_queue_size)
+
+
+class EventStreamServer:
+    """
+    在 Unix 域套接字上以 NDJSON（每行一个 JSON 对象）推送事件的服务器，可以有多个订阅者。
+
+    订阅者连接后，须先发送一行 JSON：{"since": N} 表示从序号 N 之后的事件开始接收（用于断线后续传），
+    {} 表示只接收之后的新事件。之后服务器逐行推送事件：
+        {"seq": 序号, "type": "raw" 或 "combined", "account": 账号, "time": 发布时的 Unix 时间戳,
+         "transaction": {Transaction 的各字段}}
+    序号从 1 开始严格递增。服务器只保留最近 backlog 个事件；续传时若请求的事件已被丢弃，
+    会先推送 {"type": "gap", "from": 首个丢失的序号, "to": 最后一个丢失的序号}。
+
+    publish 从不阻塞：每个订阅者有一个有界队列，队列满时（订阅者读得太慢）断开该订阅者，
+    它可以重新连接并从收到的最后一个序号续传。因此慢的订阅者不会拖慢轮询。
+    """
+    __slots__ = ('path', 'seq', '__backlog', '__max_queue_size', '__subscribers', '__lock', '__server', '__thread')
+
+    def __init__(self, path: str, seq: int = 0, backlog: int = EVENT_STREAM_BACKLOG,
+                 max_queue_size: int = EVENT_STREAM_QUEUE_SIZE) -> None:
+        """
+        初始化服务器（不会立即开始监听）。
+        :param path: Unix 域套接字的路径
+        :param seq: 上一个已发布事件的序号，用于在重启后继续递增
+        :param backlog: 保留多少个最近的事件用于续传
+        :param max_queue_size: 每个订阅者最多积压多少个事件
+        """
+        self.path = path
+        self.seq = seq
+        self.__backlog: Deque[Tuple[int, bytes]] = deque(maxlen=backlog)
+        self.__max_queue_size = max_queue_size
+        self.__subscribers: Set[_Subscriber] = set()
+        self.__lock = threading.Lock()
+        self.__server: Optional[_ThreadingUnixStreamServer] = None
+        self.__thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.__server is not None
+
+    def start(self) -> None:
+        """
+        在后台线程中开始监听。若 path 处有上次运行遗留的套接字文件，将其删除；
+        若 path 处是其它文件（如配置错误地指向了普通文件），则不删除，而是抛出 AppError。
+        :return: None
+        """
+        if self.__server is not None:
+            return
+
+        try:
+            if os.path.lexists(self.path):
+                if not stat.S_ISSOCK(os.lstat(self.path).st_mode):
+                    raise AppError(f'{self.path} 已存在且不是套接字文件，事件推送服务器不会删除它')
+                os.unlink(self.path)
+            self.__server = _ThreadingUnixStreamServer(self.path, self.__make_handler())
+        except OSError as e:
+            raise AppError(f'事件推送服务器无法监听 {self.path}') from e
+
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         name='event-stream-server', daemon=True)
+        self.__thread.start()
+        logger.debug(f'事件推送服务器开始监听 {self.path}')
+
+    def stop(self) -> None:
+        """
+        停止监听，断开所有订阅者。
+        :return: None
+        """
+        if self.__server is None:
+            return
+
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+        self.__server = None
+        self.__thread = None
+
+        with self.__lock:
+            for sub in self.__subscribers:
+                self.__close(sub)
+            self.__subscribers.clear()
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def publish(self, event_type: str, account: str, trans: Transaction) -> int:
+        """
+        发布一个事件。不会阻塞。
+        :param event_type: raw（原始消费记录）或 combined（合并后发送给用户的消费记录）
+        :param account: 消费记录所属的账号
+        :param trans: Transaction 对象
+        :return: 事件的序号
+        """
+        with self.__lock:
+            self.seq += 1
+            line = self.__encode({
+                'seq': self.seq,
+                'type': event_type,
+                'account': account,
+                'time': time.time(),
+                'transaction': trans._asdict(),
+            })
+            self.__backlog.append((self.seq, line))
+
+            for sub in list(self.__subscribers):
+                try:
+                    sub.queue.put_nowait(line)
+                except queue.Full:
+                    logger.warning('事件推送：订阅者读取过慢，已断开')
+                    self.__subscribers.discard(sub)
+                    self.__close(sub)
+            return self.seq
+
+    @staticmethod
+    def __encode(event: Dict[str, Any]) -> bytes:
+        return json.dumps(event, ensure_ascii=False).encode(UNIFIED_ENCODING) + b'\n'
+
+    @staticmethod
+    def __close(sub: _Subscriber) -> None:
+        # 清空队列后放入 None，使写线程立即结束，而不是先发完积压的事件
+        try:
+            while True:
+                sub.queue.get_nowait()
+        except queue.Empty:
+            pass
+        sub.queue.put_nowait(None)
+
+    def __subscribe(self, since: Optional[int]) -> _Subscriber:
+        """
+        注册一个订阅者，并将需要续传的事件放入其队列。
+        """
+        sub = _Subscriber(self.__max_queue_size)
+        with self.__lock:
+            if since is not None:
+                missed = [x for x in self.__backlog if x[0] > since]
+                first = missed[0][0] if missed else self.seq + 1
+                if first > since + 1:
+                    missed.insert(0, (0, self.__encode({'type': 'gap', 'from': since + 1, 'to': first - 1})))
+
+                # 积压的事件超出队列的容量时，只续传最近的部分，其余的通过 gap 告知
+                if len(missed) > self.__max_queue_size:
+                    missed = missed[-self.__max_queue_size + 1:]
+                    missed.insert(0, (0, self.__encode({
+                        'type': 'gap', 'from': since + 1, 'to': missed[0][0] - 1})))
+
+                for __, line in missed:
+                    sub.queue.put_nowait(line)
+            self.__subscribers.add(sub)
+        return sub
+
+    def __unsubscribe(self, sub: _Subscriber) -> None:
+        with self.__lock:
+            self.__subscribers.discard(sub)
+
+    def __make_handler(self) -> type:
+        # Handler 中的 self.__xxx 会被改写为 self._Handler__xxx，因此通过闭包访问本类的私有方法
+        subscribe, unsubscribe = self.__subscribe, self.__unsubscribe
+
+        class Handler(StreamRequestHandler):
+            def handle(self) -> None:
+                # 第一行为订阅请求
+                self.connection.settimeout(EVENT_STREAM_HELLO_TIMEOUT)
+                try:
+                    hello = json.loads(self.rfile.readline().decode(UNIFIED_ENCODING) or '{}')
+                    since = int(hello['since']) if 'since' in hello else None
+                except (OSError, ValueError, TypeError):
+                    logger.debug('事件推送：无效的订阅请求')
+                    return
+                self.connection.settimeout(None)
+
+                sub = subscribe(since)
+                try:
+                    while True:
+                        line = sub.queue.get()
+                        if line is None:
+                            return
+                        self.wfile.write(line)
+                except OSError:
+                    # 订阅者断开了连接
+                    pass
+                finally:
+                    unsubscribe(sub)
+                    try:
+                        self.connection.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+        return Handler
@@ -0,0 +1,190 @@
+"""
+本文件提供 QueryApiServer 类。
+该类是一个内嵌的只读 HTTP API，供仪表盘等程序查询历史记录。
+"""
+
+__all__ = ('QueryApiServer',)
+
+import hashlib
+import json
+import logging as pym_logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from ..constant import *
+from ..dao import HistoryReader
+from ..exceptions import AppError
+from ..service import split_tags
+
+logger = pym_logging.getLogger(__name__)
+
+# 查询参数 -> 将其转换为 HistoryReader.query 的参数的函数
+QUERY_PARAMS = {
+    'account': str,
+    'since': int,
+    'until': int,
+    'category': str,
+    'location': str,
+    'tag': str,
+    'min_amount': float,
+    'max_amount': float,
+}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # Python 3.6 中没有 http.server.ThreadingHTTPServer
+    daemon_threads = True
+
+
+def encode_cursor(op_timestamp: int, rowid: int) -> str:
+    return f'{op_timestamp}-{rowid}'
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    op_timestamp, rowid = cursor.split('-')
+    return int(op_timestamp), int(rowid)
+
+
+class QueryApiServer:
+    """
+    只读的历史记录查询 API，在后台线程中运行，默认不启用（参见配置 api.listen）。
+
+    GET /transactions 按时间顺序返回一页历史记录，可用的查询参数：
+        account、category、location：完全匹配；
+        tag：带有该标签（参见 TagEngine）；
+        since、until：Unix 时间戳，返回 [since, until) 之间的记录；
+        min_amount、max_amount：交易金额的范围（含两端）；
+        limit：每页的条数，默认 QUERY_API_DEFAULT_LIMIT，最多 QUERY_API_MAX_LIMIT；
+        cursor：上一页返回的 next_cursor，用于翻页。
+    返回 {"items": [...], "next_cursor": 字符串或 null}。
+
+    查询通过 HistoryReader 在 SQLite 的索引上进行，不读取 __transactions.json，也不与主循环争用连接。
+    响应带有 ETag（由数据库的版本号与查询参数得出）；请求带有相同的 If-None-Match 时返回 304，且不执行查询，
+    因此仪表盘可以频繁地轮询。
+    """
+    __slots__ = ('listen', 'reader', '__server', '__thread')
+
+    def __init__(self, listen: Tuple[str, int], reader: HistoryReader) -> None:
+        """
+        初始化查询 API 服务器（不会立即开始监听）。
+        :param listen: 监听的 (主机, 端口)；端口为 0 时由系统分配
+        :param reader: 历史记录的只读查询对象
+        """
+        self.listen = listen
+        self.reader = reader
+        self.__server: Optional[_ThreadingHTTPServer] = None
+        self.__thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        在后台线程中开始监听。
+        :return: None
+        """
+        if self.__server is not None:
+            return
+
+        try:
+            self.__server = _ThreadingHTTPServer(self.listen, self.__make_handler())
+        except OSError as e:
+            raise AppError(f'查询 API 服务器无法监听 {self.listen}') from e
+
+        # 端口为 0 时，记录实际分配的端口
+        self.listen = self.__server.server_address[:2]
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         name='query-api-server', daemon=True)
+        self.__thread.start()
+        logger.debug(f'查询 API 服务器开始监听 {self.listen}')
+
+    def stop(self) -> None:
+        """
+        停止监听并关闭服务器。
+        :return: None
+        """
+        if self.__server is None:
+            return
+
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+        self.__server = self.__thread = None
+
+    def query(self, query_string: str) -> Dict[str, Any]:
+        """
+        执行一次查询。参数错误时抛出 ValueError。
+        :param query_string: URL 中的查询字符串
+        :return: 可以被 JSON 序列化的 dict
+        """
+        args = {k: v[-1] for k, v in parse_qs(query_string).items()}
+        unknown = args.keys() - QUERY_PARAMS.keys() - {'limit', 'cursor'}
+        if unknown:
+            raise ValueError(f'未知的参数：{", ".join(sorted(unknown))}')
+
+        params = {k: QUERY_PARAMS[k](v) for k, v in args.items() if k in QUERY_PARAMS}
+        limit = int(args.get('limit', QUERY_API_DEFAULT_LIMIT))
+        if not 0 < limit <= QUERY_API_MAX_LIMIT:
+            raise ValueError(f'limit 应在 1 到 {QUERY_API_MAX_LIMIT} 之间')
+        after = decode_cursor(args['cursor']) if 'cursor' in args else None
+
+        rows = self.reader.query(
+            account=params.get('account'),
+            since_timestamp=params.get('since'),
+            until_timestamp=params.get('until'),
+            category=params.get('category'),
+            location=params.get('location'),
+            tag=params.get('tag'),
+            min_amount=params.get('min_amount'),
+            max_amount=params.get('max_amount'),
+            after=after,
+            limit=limit,
+        )
+        return {
+            'items': [dict(trans._asdict(), id=rowid, account=account, tags=list(split_tags(tags)))
+                      for rowid, account, trans, tags in rows],
+            # 不足一页时说明已经没有更多记录
+            'next_cursor': encode_cursor(rows[-1][2].op_timestamp, rows[-1][0]) if len(rows) == limit else None,
+        }
+
+    def __make_handler(self) -> type:
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                url = urlsplit(self.path)
+                if url.path != '/transactions':
+                    self.__reply(404, {'error': 'Not Found'})
+                    return
+
+                # 数据库的版本号与查询参数都相同时，结果一定相同
+                etag = '"{}-{}"'.format(api.reader.version(), hashlib.blake2b(
+                    url.query.encode(UNIFIED_ENCODING), digest_size=8).hexdigest())
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    self.end_headers()
+                    return
+
+                try:
+                    content = api.query(url.query)
+                except ValueError as e:
+                    self.__reply(400, {'error': str(e)})
+                    return
+                self.__reply(200, content, etag)
+
+            def __reply(self, status: int, content: Dict[str, Any], etag: Optional[str] = None) -> None:
+                body = json.dumps(content, ensure_ascii=False).encode(UNIFIED_ENCODING)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                if etag is not None:
+                    self.send_header('ETag', etag)
+                    self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt: str, *args: Any) -> None:
+                logger.debug('Query API: ' + fmt % args)
+
+        return Handler
@@ -0,0 +1,100 @@
+"""
+本文件提供 SharedVpnSession 类。
+该类使多个账号共用同一个 WebVPN 登录：VPN 只是通往 ecard 网站的隧道，没有必要为每个学生各登录一次。
+"""
+
+__all__ = ('SharedVpnSession',)
+
+import logging as pym_logging
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ..constant import *
+from ..popo import SessionKeeper
+from ..util import RetrySession, HostRateLimiter
+from .vpn_client import VpnClient
+
+logger = pym_logging.getLogger(__name__)
+
+
+class SharedVpnSession:
+    """
+    用一个服务账号登录 WebVPN，并让多个 ecard 账号共用该登录。
+
+    每个 ecard 账号通过 new_session 获得独立的 requests.Session，因此各自的 ecard Cookie（ASP.NET_SessionId）互不干扰；
+    这些 Session 挂载同一个 HTTPAdapter，共用连接池，从而共用 TCP/TLS 连接。
+    VPN 的 Cookie 由 sync_cookies 复制到各个 Session 中。
+
+    每次登录 VPN 后 generation 加一。多个账号同时发现 VPN 会话失效时，只有第一个会重新登录，
+    其余账号通过 generation 得知已有人重新登录过，只需同步 Cookie。本类的方法是线程安全的。
+    """
+    __slots__ = ('vpn_username', 'vpn_password', 'generation', 'adapter', '__sess_keep', '__vpc', '__lock')
+
+    def __init__(self, vpn_username: str, vpn_password: str,
+                 limiter: Optional[HostRateLimiter] = None, vpn_base: str = DEFAULT_VPN_BASE,
+                 pool_size: int = SHARED_VPN_POOL_SIZE) -> None:
+        """
+        :param vpn_username: 服务账号的用户名
+        :param vpn_password: 服务账号的密码
+        :param limiter: 限流器，应与各 ecard 账号的相同
+        :param vpn_base: WebVPN 的地址
+        :param pool_size: 共用的连接池中，最多保持多少个连接
+        """
+        self.vpn_username = vpn_username
+        self.vpn_password = vpn_password
+        # 登录 VPN 的次数；为 0 表示尚未登录
+        self.generation = 0
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+        self.__sess_keep = SessionKeeper(RetrySession(self.__mount(requests.Session()), limiter))
+        self.__vpc = VpnClient(self.__sess_keep, vpn_base)
+        self.__lock = threading.Lock()
+
+    @property
+    def vpn_base(self) -> str:
+        return self.__vpc.vpn_base
+
+    @vpn_base.setter
+    def vpn_base(self, value: str) -> None:
+        self.__vpc.vpn_base = value
+
+    def __mount(self, sess: requests.Session) -> requests.Session:
+        sess.mount('http://', self.adapter)
+        sess.mount('https://', self.adapter)
+        return sess
+
+    def new_session(self) -> requests.Session:
+        """
+        新建一个共用连接池、但 Cookie 独立的 Session，供一个 ecard 账号使用。
+        :return: requests.Session
+        """
+        return self.__mount(requests.Session())
+
+    def ensure_login(self, stale_generation: Optional[int] = None) -> int:
+        """
+        确保 VPN 已登录。
+        :param stale_generation: 调用者认为已经失效的登录的 generation；
+                                 若自那以后还没有人重新登录过，则重新登录。为 None 时只在尚未登录时登录
+        :return: 当前的 generation
+        """
+        with self.__lock:
+            if self.generation == 0 or stale_generation == self.generation:
+                logger.debug(f'共享 VPN：以 {self.vpn_username} 登录（第 {self.generation + 1} 次）')
+                self.__sess_keep.sess.cookies().clear()
+                self.__vpc.login(username=self.vpn_username, password=self.vpn_password)
+                self.generation += 1
+            return self.generation
+
+    def sync_cookies(self, sess: requests.Session) -> int:
+        """
+        将当前 VPN 登录的 Cookie 复制到 sess 中，sess 中的其它 Cookie（如 ecard 的）保持不变。
+        :param sess: new_session 返回的 Session
+        :return: 复制的 Cookie 所属的 generation
+        """
+        with self.__lock:
+            for c in self.__sess_keep.sess.cookies():
+                sess.cookies.set_cookie(c)
+            return self.generation
@@ -2,43 +2,108 @@ __all__ = ('TgBotClient',)
 
 import logging as pym_logging
 import math
+import threading
 import time
-from typing import Optional, Dict, Any, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, Tuple, List, Iterable, Callable, Union
 
-from ..constant import DEFAULT_TG_POLL_TIMEOUT
-from ..exceptions import AppError
-from ..util import retry_post
+import requests
+
+from ..constant import *
+from ..dao import MessageIndexDao
+from ..exceptions import AppError, AppNetworkError
+from ..util import retry_post, RetrySession, TokenBucket, ProxyPool, mask_proxy_url, stage_timer
+from .tg_webhook_server import TgWebhookServer
 
 logger = pym_logging.getLogger(__name__)
 
+# 这些方法会向某个 chat 发送（或修改）消息，受 Telegram 对单个 chat 的限速约束
+CHAT_LIMITED_METHODS = frozenset(('sendMessage', 'editMessageText'))
+
 
 class TgBotClient:
     """
     Telegram Bot 客户端类。
     提供接收消息、发送消息等功能。
     """
-    __slots__ = ('token', 'proxies')
+    __slots__ = ('token', 'proxies', 'proxy_pool', 'probing', 'msg_index', 'api_base', 'webhook', 'sess',
+                 '__global_bucket', '__chat_buckets', '__chat_buckets_lock')
 
-    def __init__(self, bot_token: str, proxy_url: Optional[str] = None) -> None:
+    def __init__(self, bot_token: str, proxy_url: Union[str, List[str], None] = None,
+                 msg_index: Optional[MessageIndexDao] = None,
+                 api_base: str = DEFAULT_TG_API_BASE, sess: Optional[RetrySession] = None) -> None:
         """
         初始化 Telegram Bot 客户端类。
         :param bot_token: Bot 的 API Token，可以通过 @BotFather 获取
-        :param proxy_url: 如果要使用代理，可以从此参数传入
+        :param proxy_url: 如果要使用代理，可以从此参数传入；传入多个代理时，自动选择最快且可用的一个
+        :param msg_index: 最近发送的消息的索引，用于原地编辑消息；不提供则无法使用 *_group_message 方法
+        :param api_base: Bot API 的地址，本地测试时可指向模拟的 API 服务器
+        :param sess: 发送请求所用的 RetrySession，如故障注入测试中的 FaultInjectingSession；
+                     为 None 时使用 requests 的模块级函数
+        """
+        self.msg_index = msg_index
+        self.sess = sess
+        self.proxy_pool: Optional[ProxyPool] = None
+        # 是否在后台探测各代理，参见 start_proxy_probe
+        self.probing = False
+        self.update_transport(bot_token, proxy_url, api_base)
+
+        # 不为 None 时，通过 Webhook 接收消息，而不是长轮询 getUpdates
+        self.webhook: Optional[TgWebhookServer] = None
+
+        # 全局限速与每个 chat 的限速，所有发往 Telegram 的请求都要先取得令牌
+        self.__global_bucket = TokenBucket(TG_GLOBAL_RATE, TG_GLOBAL_BURST)
+        self.__chat_buckets: Dict[int, TokenBucket] = dict()
+        self.__chat_buckets_lock = threading.Lock()
+
+    def update_transport(self, bot_token: str, proxy_url: Union[str, List[str], None] = None,
+                         api_base: str = DEFAULT_TG_API_BASE) -> None:
+        """
+        设置（或在运行时替换）访问 Telegram 所用的 token、代理与 API 地址。
+        消息索引、Webhook、限速状态等均不受影响。
+        :param bot_token: Bot 的 API Token
+        :param proxy_url: 代理地址，None 表示不使用代理；
+                          为多个代理的 list 时，根据各代理的往返时间与错误率（参见 start_proxy_probe），
+                          每次请求使用最好的代理，失败时换用下一个
+        :param api_base: Bot API 的地址
+        :return: None
         """
         self.token = bot_token
-        if proxy_url is None:
+        self.api_base = api_base.rstrip('/')
+
+        if self.proxy_pool is not None:
+            self.proxy_pool.stop()
+            self.proxy_pool = None
+
+        proxy_urls = [proxy_url] if isinstance(proxy_url, str) else list(proxy_url or ())
+        if len(proxy_urls) > 1:
             self.proxies = None
-        else:
+            self.proxy_pool = ProxyPool(proxy_urls, probe_url=self.api_base)
+            if self.probing:
+                self.proxy_pool.start()
+        elif len(proxy_urls) == 1:
             self.proxies = {
-                'http': proxy_url,
-                'https': proxy_url
+                'http': proxy_urls[0],
+                'https': proxy_urls[0]
             }
+        else:
+            self.proxies = None
+
+    def start_proxy_probe(self) -> None:
+        """
+        开始在后台探测各代理；此后 update_transport 换用的代理也会被探测。未使用多个代理时不启动线程。
+        构造时不启动探测，以免只发送几条消息（如 --deploy）的进程也创建后台线程；未探测时，代理的状态只来自实际的请求。
+        :return: None
+        """
+        self.probing = True
+        if self.proxy_pool is not None:
+            self.proxy_pool.start()
 
     def wait_for_specific_message(self, wait_msg: str,
                                   timeout: int = DEFAULT_TG_POLL_TIMEOUT,
                                   strip_msg: bool = True) -> Optional[int]:
         """
-        通过 getUpdates 方法获取新消息，直到获取到某条特定的消息才返回。
+        通过 getUpdates 方法（或 Webhook）获取新消息，直到获取到某条特定的消息才返回。
         返回该消息的 chat id；如果超时，返回 None。
 
         :param timeout: 超时时间（单位：秒），超过该时间则返回 None。
@@ -59,17 +124,69 @@ class TgBotClient:
 
         # 通过超时时间为 0 的短查询，将所收到的 wait_msg 这条消息及之前的消息标记为已收到
         # 避免再次使用本类时重复收到同一条消息
-        self.call('getUpdates', {
-            'timeout': 0,
-            'offset': update_id + 1,
-        })
+        # Webhook 模式下，Telegram 在推送成功后即认为消息已收到，无需此步骤
+        if self.webhook is None:
+            self.call('getUpdates', {
+                'timeout': 0,
+                'offset': update_id + 1,
+            })
 
         return chat_id
 
+    def enable_webhook(self, webhook: TgWebhookServer, url: str) -> None:
+        """
+        切换到 Webhook 接收模式：启动内嵌 HTTP 服务器，并调用 setWebhook 让 Telegram 推送 Update。
+        setWebhook 失败时停止该服务器，并抛出原来的异常。
+        :param webhook: 尚未启动或已启动的 TgWebhookServer
+        :param url: Telegram 推送时访问的公网 URL（不含路径，路径由 webhook.path 决定）
+        :return: None
+        """
+        webhook.start()
+        try:
+            self.call('setWebhook', {
+                'url': url.rstrip('/') + webhook.path,
+                'secret_token': webhook.secret_token,
+                'allowed_updates': ['message'],
+            })
+        except BaseException:
+            webhook.stop()
+            raise
+        self.webhook = webhook
+        logger.debug(f'已切换到 Webhook 模式：{url}')
+
+    def disable_webhook(self) -> None:
+        """
+        调用 deleteWebhook，并停止内嵌 HTTP 服务器，回到 getUpdates 长轮询模式。
+        deleteWebhook 失败时也会停止该服务器，然后抛出原来的异常。
+        :return: None
+        """
+        try:
+            self.call('deleteWebhook')
+        finally:
+            if self.webhook is not None:
+                self.webhook.stop()
+                self.webhook = None
+
+    def __fetch_updates(self, timeout: float, offset: Optional[int]) -> List[Dict[str, Any]]:
+        """
+        获取新的 Update 对象：Webhook 模式下从内嵌服务器的队列中取出，否则长轮询 getUpdates。
+        :param timeout: 最长等待时间（秒）
+        :param offset: getUpdates 的 offset 参数，Webhook 模式下不使用
+        :return: Update 对象的 list
+        """
+        if self.webhook is not None:
+            return self.webhook.get_updates(timeout)
+
+        return self.call('getUpdates', {
+            'timeout': timeout,
+            'offset': offset,
+        })
+
     def __msg_polling_loop(self, wait_msg: str, timeout: int, strip_msg: bool) -> Optional[Tuple[int, int]]:
         """
         通过 Bot API 获取消息的循环。
-        该函数调用 Telegram 的 getUpdates 方法，如果发现收到的消息并不是 wait_msg，就循环再次获取。
+        该函数调用 Telegram 的 getUpdates 方法（或从 Webhook 队列中取出 Update），
+        如果发现收到的消息并不是 wait_msg，就循环再次获取。
 
         :param wait_msg: 见 wait_for_specific_message 方法
         :param timeout: 见 wait_for_specific_message 方法
@@ -93,12 +210,8 @@ class TgBotClient:
             if used_time >= timeout:
                 return None
 
-            # 调用 getUpdates，获取到 Update 对象
-            updates = self.call('getUpdates', {
-                # 将最大超时参数设为剩下的时间
-                'timeout': timeout - used_time,
-                'offset': offset,
-            })
+            # 获取 Update 对象，将最大超时参数设为剩下的时间
+            updates = self.__fetch_updates(timeout - used_time, offset)
 
             for update in updates:
                 update_id = update.get('update_id', None)
@@ -123,7 +236,7 @@ class TgBotClient:
             # 根据 API 文档，offset 参数需比所收到最大的 update_id 大 1
             offset = max_update_id + 1
 
-    def send_message(self, chat_id: int, msg: str, html: bool = True, silent: bool = False) -> None:
+    def send_message(self, chat_id: int, msg: str, html: bool = True, silent: bool = False) -> Optional[int]:
         """
         通过该 Telegram Bot，在指定的 chat_id 内发送一条消息。
         当 html 参数为 True 时，方法调用者可以使用简单的 HTML 语法来发送粗体、斜体、等宽字体等格式。
@@ -132,7 +245,7 @@ class TgBotClient:
         :param msg: 消息内容
         :param silent: 是否发送无声消息
         :param html: 消息是否解析为 HTML
-        :return: None
+        :return: 所发送消息的 message_id
         """
         param = {
             'chat_id': chat_id,
@@ -144,7 +257,171 @@ class TgBotClient:
         if html:
             param['parse_mode'] = 'HTML'
 
-        self.call('sendMessage', param)
+        res = self.call('sendMessage', param)
+        return res.get('message_id', None)
+
+    def edit_message_text(self, chat_id: int, message_id: int, msg: str, html: bool = True) -> None:
+        """
+        原地编辑该 Bot 已发送的一条消息的内容。
+        若新内容与原内容相同，Telegram 会返回错误，本方法将其视为成功。
+        :param chat_id: Chat 的 chat_id
+        :param message_id: 要编辑的消息的 message_id
+        :param msg: 新的消息内容
+        :param html: 消息是否解析为 HTML
+        :return: None
+        """
+        param = {
+            'chat_id': chat_id,
+            'message_id': message_id,
+            'text': msg,
+            'disable_web_page_preview': True,
+        }
+
+        if html:
+            param['parse_mode'] = 'HTML'
+
+        try:
+            self.call('editMessageText', param)
+        except AppError as e:
+            if 'message is not modified' not in str(e):
+                raise
+
+    def get_group_message(self, chat_id: int, group: str) -> Optional[Tuple[int, Any]]:
+        """
+        从消息索引中查询某个分组最近发送的消息。
+        :param chat_id: Chat 的 chat_id
+        :param group: 分组名，由调用者决定，如「消费类别 + 位置」
+        :return: (message_id, 附加数据)，或 None
+        """
+        return self.__get_msg_index().get(chat_id, group)
+
+    def restore_group_message(self, chat_id: int, group: str, entry: Optional[Tuple[int, Any]]) -> None:
+        """
+        将某个分组在消息索引中的记录恢复为此前 get_group_message 的返回值，不调用 Telegram 的 API。
+        :param chat_id: Chat 的 chat_id
+        :param group: 分组名
+        :param entry: get_group_message 的返回值；为 None 时删除该分组的记录
+        :return: None
+        """
+        msg_index = self.__get_msg_index()
+        if entry is None:
+            msg_index.remove(chat_id, group)
+        else:
+            msg_index.put(chat_id, group, entry[0], entry[1])
+
+    def send_group_message(self, chat_id: int, group: str, msg: str, payload: Any = None,
+                           html: bool = True, silent: bool = False) -> Optional[int]:
+        """
+        发送一条新消息，并将其记入消息索引，作为该分组最近发送的消息。
+        :param chat_id: Chat 的 chat_id
+        :param group: 分组名
+        :param msg: 消息内容
+        :param payload: 与消息一同记录的附加数据，必须可以被 JSON 序列化
+        :param html: 消息是否解析为 HTML
+        :param silent: 是否发送无声消息
+        :return: 所发送消息的 message_id
+        """
+        message_id = self.send_message(chat_id, msg, html=html, silent=silent)
+        if message_id is not None:
+            self.__get_msg_index().put(chat_id, group, message_id, payload)
+        return message_id
+
+    def edit_group_message(self, chat_id: int, group: str, msg: str, payload: Any = None,
+                           html: bool = True) -> bool:
+        """
+        原地编辑某个分组最近发送的消息，并更新其附加数据。
+        如果该分组没有记录，或消息已无法编辑（如被删除），则删除该记录并返回 False。
+        :param chat_id: Chat 的 chat_id
+        :param group: 分组名
+        :param msg: 新的消息内容
+        :param payload: 新的附加数据
+        :param html: 消息是否解析为 HTML
+        :return: 是否编辑成功
+        """
+        msg_index = self.__get_msg_index()
+        entry = msg_index.get(chat_id, group)
+        if entry is None:
+            return False
+
+        message_id = entry[0]
+        try:
+            self.edit_message_text(chat_id, message_id, msg, html=html)
+        except AppError:
+            logger.debug(f'无法编辑消息 {message_id}，将删除其索引')
+            msg_index.remove(chat_id, group)
+            return False
+
+        msg_index.put(chat_id, group, message_id, payload)
+        return True
+
+    def __get_msg_index(self) -> MessageIndexDao:
+        if self.msg_index is None:
+            raise ValueError('未提供 msg_index，无法使用消息索引。')
+        return self.msg_index
+
+    def fan_out(self, chat_ids: Iterable[int], tasks: List[Callable[[int], Any]],
+                retry_times: int = TG_FANOUT_RETRY_TIMES) -> Dict[int, List[Any]]:
+        """
+        将同一组任务并发地发往多个 chat。
+        每个 chat 在各自的线程中按顺序执行 tasks，因此某个 chat 较慢或出错时不会拖慢其它 chat。
+        每个任务在每个 chat 上独立重试，最终仍失败的任务记为 None，并继续执行该 chat 的下一个任务。
+        网络错误（AppNetworkError）已由底层的 retry_post 或代理池重试过，因此不再重试，以免一条消息被尝试数倍次。
+        任务成功时应返回非 None 的值，以便调用者区分成功与失败。
+        限速由 call 方法统一处理，任务中无需关心。
+
+        :param chat_ids: 要发往的 chat_id
+        :param tasks: 任务列表，每个任务接受 chat_id 作为参数，如 lambda chat_id: self.send_message(chat_id, '...')
+        :param retry_times: 每个任务在每个 chat 上最多尝试多少次
+        :return: dict，键为 chat_id，值为各任务的返回值列表（失败的任务为 None）
+        """
+        chat_ids = list(dict.fromkeys(chat_ids))
+        if len(chat_ids) == 0:
+            return dict()
+
+        def run_for_chat(chat_id: int) -> List[Any]:
+            return [self.__run_with_retry(task, chat_id, retry_times) for task in tasks]
+
+        # 只有一个 chat 时无需开线程
+        if len(chat_ids) == 1:
+            return {chat_ids[0]: run_for_chat(chat_ids[0])}
+
+        with ThreadPoolExecutor(max_workers=min(len(chat_ids), TG_FANOUT_MAX_WORKERS)) as executor:
+            futures = {x: executor.submit(run_for_chat, x) for x in chat_ids}
+            return {k: v.result() for k, v in futures.items()}
+
+    @staticmethod
+    def __run_with_retry(task: Callable[[int], Any], chat_id: int, retry_times: int) -> Any:
+        for retry_count in range(retry_times):
+            try:
+                return task(chat_id)
+            except AppNetworkError as e:
+                logger.debug(f'向 chat {chat_id} 发送消息失败，传输层已重试过：{e}')
+                break
+            except AppError as e:
+                logger.debug(f'向 chat {chat_id} 发送消息第 {retry_count + 1} 次失败：{e}')
+                if retry_count + 1 < retry_times:
+                    time.sleep(TG_FANOUT_RETRY_DELAY * (retry_count + 1))
+
+        logger.warning(f'Failed to deliver a message to chat {chat_id}.')
+        return None
+
+    def __acquire_rate_limit(self, method: str, param: Optional[Dict[str, Any]]) -> None:
+        """
+        调用 Telegram API 前，先从对应 chat 的令牌桶、再从全局令牌桶中取得令牌。
+        getUpdates 等长轮询请求不受限速约束。
+        """
+        if method == 'getUpdates':
+            return
+
+        if method in CHAT_LIMITED_METHODS and param is not None and 'chat_id' in param:
+            chat_id = param['chat_id']
+            with self.__chat_buckets_lock:
+                bucket = self.__chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = self.__chat_buckets[chat_id] = TokenBucket(TG_PER_CHAT_RATE, TG_PER_CHAT_BURST)
+            bucket.acquire()
+
+        self.__global_bucket.acquire()
 
     def get_bot_name(self) -> Optional[str]:
         """
@@ -167,13 +444,16 @@ class TgBotClient:
         :return: API 返回值，使用 Python 的类 JSON 格式
         """
         logger.debug(f'Telegram API call: {method}({param})')
+        self.__acquire_rate_limit(method, param)
 
-        req_resp = retry_post(
-            f'https://api.telegram.org/bot{self.token}/{method}',
-            proxies=self.proxies,
-            json=param,
-        )
-        res = req_resp.json()
+        with stage_timer.stage('telegram'):
+            req_resp = self.__post(f'{self.api_base}/bot{self.token}/{method}', param,
+                                   long_poll=method == 'getUpdates')
+            try:
+                res = req_resp.json()
+            except ValueError as e:
+                # 如反向代理返回的 502 页面；抛出 AppError，以便 fan_out 等调用者按网络错误重试
+                raise AppNetworkError(f'Telegram API 返回的内容不是 JSON（HTTP {req_resp.status_code}）。') from e
 
         # 无论 ok 值为 False，还是不存在 ok 值，都可以当成 False 处理
         if res.get('ok', False):
@@ -184,3 +464,43 @@ class TgBotClient:
         else:
             logger.debug(f'res 不 OK。res = {res}')
             raise AppError('Telegram API 调用错误：' + res.get('description', ''))
+
+    def __post(self, url: str, param: Optional[Dict[str, Any]], long_poll: bool) -> requests.Response:
+        """
+        发送 API 请求。配置了多个代理时，按代理池的排名依次尝试，每个代理只尝试一次，
+        连接失败或代理返回 5xx 时立即换用下一个代理，并将结果报告给代理池。
+        :param url: API 的 URL
+        :param param: API 的参数
+        :param long_poll: 是否为长轮询请求；其耗时不代表代理的往返时间
+        :return: requests.Response
+        """
+        post = retry_post if self.sess is None else self.sess.post
+        pool = self.proxy_pool
+        if pool is None:
+            return post(url, proxies=self.proxies, json=param)
+
+        candidates = pool.ranked()
+        err, last_resp = None, None
+        for i in range(max(RETRY_TIMES, len(candidates))):
+            proxy_url = candidates[i % len(candidates)]
+            begin = time.perf_counter()
+            try:
+                resp = post(url, retry_times=1, proxies={'http': proxy_url, 'https': proxy_url}, json=param)
+            except AppNetworkError as e:
+                err = e
+                pool.record(proxy_url, ok=False)
+                logger.debug(f'经由代理 {mask_proxy_url(proxy_url)} 调用 Telegram API 失败，换用下一个代理')
+                continue
+
+            if resp.status_code >= 500:
+                # 多为代理无法连接到 Telegram 时返回的 502、504
+                last_resp = resp
+                pool.record(proxy_url, ok=False)
+                continue
+
+            pool.record(proxy_url, ok=True, rtt=None if long_poll else time.perf_counter() - begin)
+            return resp
+
+        if last_resp is not None:
+            return last_resp
+        raise AppNetworkError('经由所有代理调用 Telegram API 均失败。') from err
@@ -0,0 +1,153 @@
+"""
+本文件提供 TgWebhookServer 类。
+该类是一个内嵌的小型 HTTP 服务器，以 Webhook 方式接收 Telegram 推送的 Update。
+"""
+
+__all__ = ('TgWebhookServer',)
+
+import hmac
+import json
+import logging as pym_logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, List, Tuple
+
+from ..constant import *
+from ..exceptions import AppError
+
+logger = pym_logging.getLogger(__name__)
+
+# Telegram 在推送 Update 时，会把 setWebhook 所设置的 secret_token 放在该请求头中
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # Python 3.6 中没有 http.server.ThreadingHTTPServer
+    daemon_threads = True
+
+
+class TgWebhookServer:
+    """
+    接收 Telegram Webhook 推送的内嵌 HTTP 服务器。
+
+    服务器在后台线程中运行，收到的 Update 存入队列，由 get_updates 方法取出。
+    只有请求路径与 path 一致、且请求头中的 secret token 正确的请求才会被接受。
+
+    该类不依赖真实的 Telegram 服务器：在本地测试时，可以直接向监听地址 POST Update 的 JSON。
+    """
+    __slots__ = ('listen', 'path', 'secret_token', '__queue', '__server', '__thread')
+
+    def __init__(self, listen: Tuple[str, int], secret_token: str,
+                 path: str = DEFAULT_TG_WEBHOOK_PATH,
+                 max_queue_size: int = TG_WEBHOOK_QUEUE_SIZE) -> None:
+        """
+        初始化 Webhook 服务器（不会立即开始监听）。
+        :param listen: 监听的 (主机, 端口)；端口为 0 时由系统分配
+        :param secret_token: 与 setWebhook 的 secret_token 参数一致的密钥
+        :param path: 接收推送的 URL 路径
+        :param max_queue_size: 最多缓存多少条未取出的 Update
+        """
+        if not secret_token:
+            raise ValueError('secret_token 不能为空')
+
+        self.listen = listen
+        self.path = path
+        self.secret_token = secret_token
+        self.__queue = queue.Queue(maxsize=max_queue_size)
+        self.__server = None
+        self.__thread = None
+
+    def start(self) -> None:
+        """
+        在后台线程中开始监听。
+        :return: None
+        """
+        if self.__server is not None:
+            return
+
+        try:
+            self.__server = _ThreadingHTTPServer(self.listen, self.__make_handler())
+        except OSError as e:
+            raise AppError(f'Webhook 服务器无法监听 {self.listen}') from e
+
+        # 端口为 0 时，记录实际分配的端口
+        self.listen = self.__server.server_address[:2]
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         name='tg-webhook-server', daemon=True)
+        self.__thread.start()
+        logger.debug(f'Webhook 服务器开始监听 {self.listen}')
+
+    def stop(self) -> None:
+        """
+        停止监听并关闭服务器。
+        :return: None
+        """
+        if self.__server is None:
+            return
+
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+        self.__server = self.__thread = None
+
+    def get_updates(self, timeout: float) -> List[Dict[str, Any]]:
+        """
+        取出已收到的 Update。若当前没有 Update，最多阻塞等待 timeout 秒。
+        :param timeout: 最长等待时间（秒）
+        :return: Update 对象的 list，超时则为空 list
+        """
+        res = []
+        try:
+            res.append(self.__queue.get(timeout=max(timeout, 0)))
+        except queue.Empty:
+            return res
+
+        # 已有 Update 到达，将队列中剩余的 Update 一并取出
+        while True:
+            try:
+                res.append(self.__queue.get_nowait())
+            except queue.Empty:
+                return res
+
+    def __make_handler(self) -> type:
+        webhook = self
+        update_queue = self.__queue
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:
+                if self.path != webhook.path:
+                    self.send_error(404)
+                    return
+
+                token = self.headers.get(SECRET_TOKEN_HEADER, '')
+                if not hmac.compare_digest(token.encode(UNIFIED_ENCODING),
+                                           webhook.secret_token.encode(UNIFIED_ENCODING)):
+                    logger.debug(f'Webhook 收到了 secret token 错误的请求：{self.client_address}')
+                    self.send_error(403)
+                    return
+
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    update = json.loads(self.rfile.read(length).decode(UNIFIED_ENCODING))
+                except ValueError:
+                    self.send_error(400)
+                    return
+
+                try:
+                    update_queue.put_nowait(update)
+                except queue.Full:
+                    # 返回错误，Telegram 会稍后重新推送该 Update
+                    self.send_error(503)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, fmt: str, *args: Any) -> None:
+                logger.debug('Webhook: ' + fmt % args)
+
+        return Handler
+
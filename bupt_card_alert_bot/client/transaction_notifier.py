@@ -0,0 +1,160 @@
+"""
+本文件提供 TransactionNotifier 类。
+该类从每次获取到的消费记录中找出新记录，合并后发送给用户、检查提醒规则，并记入历史记录。
+"""
+
+__all__ = ('TransactionNotifier',)
+
+import logging as pym_logging
+from functools import partial
+from typing import List, Optional, Set
+
+from ..constant import *
+from ..dao import HistoryDao, StateDao
+from ..exceptions import AppNetworkError
+from ..popo import Transaction, TransactionLog
+from ..service import AlertEngine, StreamingCombiner, TagEngine, combine_2_transactions, format_transaction_alert
+from .event_stream_server import EventStreamServer
+from .tg_bot_client import TgBotClient
+
+logger = pym_logging.getLogger(__name__)
+
+
+def _alert_group(trans: Transaction) -> str:
+    """
+    消费通知在消息索引中的分组名：同一 chat 中同类别、同位置的小额消费通知属于同一组。
+    """
+    return f'{trans.category}\n{trans.location}'
+
+
+class TransactionNotifier:
+    """
+    发送消费通知。main.py 与故障注入测试（fault_test.py）共用本类，因此测试的就是实际的发送逻辑。
+    每个账号的合并器、提醒规则引擎与已发送的记录由调用者持有，在调用 deliver 时传入。
+    """
+    __slots__ = ('tgbot', 'tag_engine', 'history_dao', 'state_dao', 'event_stream')
+
+    def __init__(self, tgbot: TgBotClient, tag_engine: TagEngine, history_dao: HistoryDao,
+                 state_dao: Optional[StateDao] = None, event_stream: Optional[EventStreamServer] = None) -> None:
+        """
+        :param tgbot: 发送通知的 Bot，须提供 msg_index，以便原地编辑小额消费的通知
+        :param tag_engine: 计算提醒规则所需的标签
+        :param history_dao: 新获取的原始消费记录会追加到其中
+        :param state_dao: 用于保存事件流的序号；event_stream 为 None 时可以不提供
+        :param event_stream: 向本地的其它程序推送新的消费记录；为 None 时不推送
+        """
+        self.tgbot = tgbot
+        self.tag_engine = tag_engine
+        self.history_dao = history_dao
+        self.state_dao = state_dao
+        self.event_stream = event_stream
+
+    def send_transaction_alert(self, chat_id: int, trans: Transaction, small: bool) -> bool:
+        """
+        将一条（合并后的）消费记录发送给用户。
+        如果该记录由小额消费组成，且同一 chat 中同类别、同位置的上一条小额消费通知仍在编辑窗口内，
+        则原地编辑那条通知，显示累计金额，而不是发送新通知。
+        :param chat_id: Chat 的 chat_id
+        :param trans: 要发送的 Transaction
+        :param small: 该记录是否由小额（可合并的）消费组成
+        :return: True；发送失败时抛出 AppError
+        """
+        tgbot = self.tgbot
+        group = _alert_group(trans)
+
+        if small:
+            entry = tgbot.get_group_message(chat_id, group)
+            if entry is not None and entry[1] is not None:
+                # 附加数据为上一条通知中的累计消费记录
+                total = Transaction._make(entry[1])
+                if 0 <= trans.op_timestamp - total.op_timestamp <= DEFAULT_EDIT_WINDOW_SECONDS:
+                    total = combine_2_transactions(total, trans)
+                    if tgbot.edit_group_message(chat_id, group, format_transaction_alert(total), list(total)):
+                        logger.debug(f'原地编辑了 {total.op_datetime} 的消费通知')
+                        return True
+
+        logger.debug(f'发送 {trans.op_datetime} 的消费记录')
+        tgbot.send_group_message(chat_id, group, format_transaction_alert(trans),
+                                 list(trans) if small else None)
+        return True
+
+    def send_rule_alert(self, chat_id: int, text: str) -> bool:
+        """
+        将一条由提醒规则产生的提醒发送给用户。提醒总是作为新消息发送，不会编辑已有的通知。
+        :param chat_id: Chat 的 chat_id
+        :param text: 提醒的文本，由 AlertEngine.feed 产生
+        :return: True；发送失败时抛出 AppError
+        """
+        self.tgbot.send_message(chat_id, text)
+        return True
+
+    def deliver(self, account_name: str, current_trans: Set[Transaction], known: TransactionLog,
+                combiner: StreamingCombiner, engine: AlertEngine, chat_ids: List[int]) -> None:
+        """
+        从本次获取到的消费记录中找出新记录，合并后发送给 chat_ids 中的所有接收者，并检查提醒规则，
+        然后将本次获取到的原始记录记入 known 集合（原地修改）和历史记录中。
+
+        若第一个接收者（部署时绑定的 chat 或账号的第一个 chat）有通知最终发送失败，则将 combiner、engine
+        与本次涉及的消息索引记录回退到本次调用之前的状态、不修改 known，并抛出 AppNetworkError，
+        使下次轮询重新发送本次的全部通知。回退消息索引保证重发时原地编辑的累计金额不会重复计入本次的消费。
+        因此通知至少送达一次：其它接收者，以及本次已成功的通知，在重发时可能收到重复的消息；事件流中的事件同理。
+        :param account_name: 消费记录所属的账号
+        :param current_trans: 本次获取到的消费记录
+        :param known: 已经发送过通知的消费记录，会被原地修改
+        :param combiner: 该账号的小额消费合并器
+        :param engine: 该账号的提醒规则引擎
+        :param chat_ids: 接收通知的 chat id
+        :return: None
+        """
+        # 计算哪些是新产生的消费记录
+        new_trans = sorted(
+            # 过滤掉已经发送过通知的消费记录，known 的成员判断为 O(1)
+            (x for x in current_trans if x not in known),
+
+            # 按照消费时间排序，如果一样，则余额大的在前
+            key=lambda x: (x.op_timestamp, -x.balance))
+        logger.debug(f'获得了 {len(current_trans)} 条消费记录, 其中 {len(new_trans)} 条为新记录')
+
+        # 为了防止洗澡等小额记录过多，合并细小的消费记录
+        # 为了不影响排重逻辑，应在服务器端存储原始消费记录，但是将合并的消费记录发送给用户
+        # 小额消费会被暂扣一段时间，以便与下一次轮询中的同类消费合并
+        combiner_state = combiner.dump()
+        engine_state = engine.dump()
+        combined_trans = combiner.feed(new_trans)
+
+        # 提醒规则按原始消费记录逐笔增量地统计，不受合并与暂扣的影响
+        rule_alerts = [text for trans in new_trans for text in engine.feed(trans, self.tag_engine.tags(trans))]
+
+        # 在发送 Telegram 消息之前推送事件，订阅者不必等待较慢的 Telegram 请求
+        event_stream = self.event_stream
+        if event_stream is not None and (new_trans or combined_trans):
+            for trans in new_trans:
+                event_stream.publish('raw', account_name, trans)
+            for trans in combined_trans:
+                event_stream.publish('combined', account_name, trans)
+            self.state_dao['event_stream_seq'] = event_stream.seq
+
+        # 将多条新的消费记录并发地发送给所有接收者，每个 chat 各自按顺序发送、各自重试
+        # 大额消费从不被合并或暂扣，因此不在本次 new_trans 中、或金额较小的，都由小额消费组成
+        raw_new_trans = set(new_trans)
+        groups = {_alert_group(x) for x in combined_trans}
+        index_state = [(chat_id, group, self.tgbot.get_group_message(chat_id, group))
+                       for chat_id in chat_ids for group in groups]
+        results = self.tgbot.fan_out(chat_ids, [
+            partial(self.send_transaction_alert, trans=trans,
+                    small=trans.trans_amount < combiner.threshold or trans not in raw_new_trans)
+            for trans in combined_trans
+        ] + [partial(self.send_rule_alert, text=text) for text in rule_alerts])
+
+        if chat_ids and any(x is None for x in results.get(chat_ids[0], ())):
+            combiner.load(combiner_state)
+            engine.load(engine_state)
+            for chat_id, group, entry in index_state:
+                self.tgbot.restore_group_message(chat_id, group, entry)
+            raise AppNetworkError(f'向 chat {chat_ids[0]} 发送 {account_name} 的通知失败，将在下次轮询时重新发送。')
+
+        # 将新获取的 Transaction 记入 known 中
+        known.update(current_trans)
+
+        # 将原始消费记录追加到历史记录中，已存在的记录会被忽略
+        self.history_dao.append(account_name, current_trans)
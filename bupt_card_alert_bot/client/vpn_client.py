@@ -6,8 +6,10 @@
 __all__ = ('VpnClient',)
 
 import logging as pym_logging
+from urllib.parse import urlsplit
 
-from ..exceptions import AppError
+from ..constant import *
+from ..exceptions import AppError, AppAuthError
 from ..popo import SessionKeeper
 from ..util import fix_response_encoding
 from ..service import log_resp
@@ -21,13 +23,18 @@ class VpnClient:
     该类应该通过保存 Session 的方式来实现，使该类的使用方式符合人类直觉。
     """
 
-    __slots__ = ('sess_keep',)
+    __slots__ = ('sess_keep', 'vpn_base')
 
-    def __init__(self, session_keeper: SessionKeeper) -> None:
+    def __init__(self, session_keeper: SessionKeeper, vpn_base: str = DEFAULT_VPN_BASE) -> None:
+        """
+        :param session_keeper: 存有 RetrySession 实例的 POPO
+        :param vpn_base: WebVPN 的地址，结尾不含“/”
+        """
         if session_keeper.sess is None:
             raise ValueError('SessionKeeper 中必须有已初始化的 requests.Session 对象')
 
         self.sess_keep = session_keeper
+        self.vpn_base = vpn_base
 
     def obtain_sessid(self) -> None:
         """
@@ -39,7 +46,7 @@ class VpnClient:
 
         # 获取 PHPSESSID
         # --- 吐槽：这个网站会返回十一个 Set-Cookie 头，重要的 Cookie 要设 11 遍 ---（划掉）
-        sess.get('https://vpn.bupt.edu.cn/global-protect/login.esp')
+        sess.get(f'{self.vpn_base}/global-protect/login.esp')
         logger.debug(f'sess.cookies() = {str(sess.cookies())}')
 
         if sess.cookies() is None:
@@ -51,9 +58,9 @@ class VpnClient:
         logger.debug('登录 webvpn')
         sess = self.sess_keep.sess
 
-        resp = sess.post('https://vpn.bupt.edu.cn/global-protect/login.esp', data={
+        resp = sess.post(f'{self.vpn_base}/global-protect/login.esp', data={
             'prot': 'https:',
-            'server': 'vpn.bupt.edu.cn',
+            'server': urlsplit(self.vpn_base).hostname,
             'inputStr': '',
             'action': 'getsoftware',
             'user': username,
@@ -65,9 +72,9 @@ class VpnClient:
         # 检测 GP_SESSION_CK 是否在 cookies 中，如果存在说明登录成功
         if 'GP_SESSION_CK' not in sess.cookies():
             logger.debug(f'sess.cookies() = {str(sess.cookies())}, resp.url = {resp.url}')
-            raise AppError('登录失败（未获取到 GP_SESSION_CK），可能是用户名或密码错误。')
+            raise AppAuthError('登录失败（未获取到 GP_SESSION_CK），可能是用户名或密码错误。')
 
         if username not in resp.text or '客户端下载' not in resp.text:
             logger.debug(f'sess.cookies() = {str(sess.cookies())}, resp.url = {resp.url}')
             log_resp(logger, resp)
-            raise AppError('登录失败（未成功进入登录后页面），可能是用户名或密码错误。')
+            raise AppAuthError('登录失败（未成功进入登录后页面），可能是用户名或密码错误。')
@@ -12,12 +12,64 @@ CONFIG_VALID_PROPS = frozenset((
     'ecard.username',
     'ecard.password',
 
+    # WebVPN 的地址，默认为 https://vpn.bupt.edu.cn；本地测试时可指向模拟的服务器
+    'vpn.base-url',
+
     # Telegram Bot 的 API Token
     'bot.api-token',
 
-    # 连接 Telegram 服务器所使用的代理
+    # 连接 Telegram 服务器所使用的代理；可以是多个代理的列表，此时自动选择最快且可用的代理，失败时换用下一个
     # 注：访问 webvpn 和 ecard 不支持使用代理
     'proxy.url',
+
+    # 除部署时绑定的 chat 以外，额外接收消费通知的 chat id 列表（如家长、审计群组）
+    'bot.extra-chat-ids',
+
+    # Telegram Bot API 的地址，默认为官方地址；本地测试时可指向模拟的 API 服务器
+    'bot.api-base',
+
+    # Webhook 模式：Telegram 推送 Update 时访问的公网 HTTPS URL；不填则使用 getUpdates 长轮询
+    'bot.webhook-url',
+
+    # Webhook 模式：内嵌 HTTP 服务器的监听地址，形如 127.0.0.1:8443
+    'bot.webhook-listen',
+
+    # Webhook 模式：校验推送请求的密钥；不填则每次运行时随机生成
+    'bot.webhook-secret',
+
+    # 要监控的多个账号；不填则只监控上面的 vpn/ecard 账号。每个账号可单独指定 vpn 账号与接收通知的 chat
+    'accounts',
+
+    # 多节点部署：各节点共享的租约数据库（SQLite 文件）路径
+    'cluster.store',
+
+    # 多节点部署：账号租约的有效期（秒）
+    'cluster.lease-seconds',
+
+    # 访问学校网站时，每个主机的持续速率（请求/秒）与允许的突发请求数；同一进程中的所有账号共享
+    'ratelimit.rate',
+    'ratelimit.burst',
+
+    # 流式合并小额消费时，最多暂扣多久（秒）；为 0 时退化为只在单次轮询内合并
+    'combine.hold-seconds',
+
+    # 提醒规则，如“今天消费超过 50 元”、“余额低于 20 元”，参见 AlertEngine
+    'alerts.rules',
+
+    # 标签规则，如终端名称匹配“食堂”的消费记录加上 canteen；提醒规则可以按标签统计，参见 TagEngine
+    'tags.rules',
+
+    # 为 true 时，accounts 中的所有账号共用上面的 vpn 账号的一个 VPN 登录，各账号的 vpn 账号将被忽略
+    'vpn.shared',
+
+    # 本地 Unix 域套接字的路径；设置后，新的消费记录会以 NDJSON 的形式推送给连接到该套接字的程序，参见 EventStreamServer
+    'events.socket',
+
+    # 只读的历史记录查询 API 的监听地址，形如 127.0.0.1:8080；不填则不启用，参见 QueryApiServer
+    'api.listen',
+
+    # 解析消费记录页面的进程数；不填或为 0 时在主进程中解析。同一进程监控很多账号时，可设为 CPU 核心数
+    'parse.processes',
 ))
 
 CONFIG_SCHEMA = {
@@ -28,8 +80,76 @@ CONFIG_SCHEMA = {
         'vpn.password': {'type': 'string', 'minLength': 1},
         'ecard.username': {'type': 'string', 'minLength': 1},
         'ecard.password': {'type': 'string', 'minLength': 1},
+        'vpn.base-url': {'type': 'string', 'pattern': '^https?://.*[^/]$'},
         'bot.api-token': {'type': 'string', 'minLength': 1},
-        'proxy.url': {'type': 'string', 'minLength': 1},
+        'proxy.url': {'anyOf': [
+            {'type': 'string', 'minLength': 1},
+            {'type': 'array', 'items': {'type': 'string', 'minLength': 1}, 'minItems': 1},
+        ]},
+        'bot.extra-chat-ids': {'type': 'array', 'items': {'type': 'integer'}, 'uniqueItems': True},
+        'bot.api-base': {'type': 'string', 'minLength': 1},
+        'bot.webhook-url': {'type': 'string', 'pattern': '^https?://'},
+        'bot.webhook-listen': {'type': 'string', 'pattern': '^[^:]*:[0-9]+$'},
+        'bot.webhook-secret': {'type': 'string', 'pattern': '^[A-Za-z0-9_-]{1,256}$'},
+        'accounts': {
+            'type': 'array',
+            'minItems': 1,
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string', 'minLength': 1},
+                    'vpn.username': {'type': 'string', 'minLength': 1},
+                    'vpn.password': {'type': 'string', 'minLength': 1},
+                    'ecard.username': {'type': 'string', 'minLength': 1},
+                    'ecard.password': {'type': 'string', 'minLength': 1},
+                    'chat-ids': {'type': 'array', 'items': {'type': 'integer'}, 'uniqueItems': True},
+                },
+                'required': ['ecard.username', 'ecard.password'],
+                'additionalProperties': False,
+            },
+        },
+        'cluster.store': {'type': 'string', 'minLength': 1},
+        'cluster.lease-seconds': {'type': 'integer', 'minimum': 3},
+        'ratelimit.rate': {'type': 'number', 'exclusiveMinimum': 0},
+        'ratelimit.burst': {'type': 'integer', 'minimum': 1},
+        'combine.hold-seconds': {'type': 'integer', 'minimum': 0},
+        'parse.processes': {'type': 'integer', 'minimum': 0},
+        'vpn.shared': {'type': 'boolean'},
+        'events.socket': {'type': 'string', 'minLength': 1},
+        'api.listen': {'type': 'string', 'pattern': '^[^:]*:[0-9]+$'},
+        'alerts.rules': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'name': {'type': 'string', 'minLength': 1},
+                    'type': {'enum': ['daily-spend', 'weekly-spend', 'low-balance']},
+                    'threshold': {'type': 'number', 'minimum': 0},
+                    'location': {'type': 'string', 'minLength': 1},
+                    'tag': {'type': 'string', 'minLength': 1},
+                    'rearm': {'type': 'number', 'minimum': 0},
+                },
+                'required': ['name', 'type', 'threshold'],
+                'not': {'required': ['location', 'tag']},
+                'additionalProperties': False,
+            },
+        },
+        'tags.rules': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'tag': {'type': 'string', 'pattern': '^[^,]+$'},
+                    'pattern': {'type': 'string', 'minLength': 1},
+                    'field': {'enum': ['location', 'category', 'any']},
+                },
+                'required': ['tag', 'pattern'],
+                'additionalProperties': False,
+            },
+        },
+    },
+    'dependencies': {
+        'bot.webhook-url': ['bot.webhook-listen'],
     },
     'required': [
         'vpn.username',
@@ -19,6 +19,18 @@ Transaction 使用 JSON 格式来保存。
 """
 DEFAULT_TRANSACTION_FILE_PATH = '__transactions.json'
 
+"""
+默认的历史记录数据库（SQLite）的路径。
+该数据库保存全部的原始消费记录，只追加、不删除。
+"""
+DEFAULT_HISTORY_FILE_PATH = '__history.sqlite3'
+
+"""
+默认的消息索引文件的路径。
+消息索引记录最近发送的消费通知的 message_id，以便原地编辑该通知。
+"""
+DEFAULT_MSG_INDEX_FILE_PATH = '__msg_index.json'
+
 """
 默认日志文件路径。
 """
@@ -49,6 +61,44 @@ Telegram 客户端中，「等待某条消息」的默认超时时间（秒）
 """
 DEFAULT_TG_POLL_TIMEOUT = 300
 
+"""
+Telegram Bot API 的默认地址。本地测试时，可以在配置中将其替换为模拟的 API 服务器。
+"""
+DEFAULT_TG_API_BASE = 'https://api.telegram.org'
+
+"""
+Webhook 模式下，内嵌 HTTP 服务器接收 Telegram 推送的默认 URL 路径。
+"""
+DEFAULT_TG_WEBHOOK_PATH = '/telegram-webhook'
+
+"""
+Webhook 模式下，最多缓存多少条尚未处理的 Update。
+"""
+TG_WEBHOOK_QUEUE_SIZE = 1024
+
+"""
+Telegram 对同一个 chat 发送消息的限速：持续速率（条/秒）与允许的突发条数。
+"""
+TG_PER_CHAT_RATE = 1.0
+TG_PER_CHAT_BURST = 1
+
+"""
+Telegram 对同一个 Bot 的全局限速：持续速率（次/秒）与允许的突发次数。
+"""
+TG_GLOBAL_RATE = 30.0
+TG_GLOBAL_BURST = 30
+
+"""
+向多个 chat 并发发送消息时，最多使用多少个线程。
+"""
+TG_FANOUT_MAX_WORKERS = 8
+
+"""
+向多个 chat 并发发送消息时，每条消息在单个 chat 上最多尝试多少次，以及重试前等待的基础时间（秒）。
+"""
+TG_FANOUT_RETRY_TIMES = 3
+TG_FANOUT_RETRY_DELAY = 2.0
+
 """
 程序每隔多久（单位：秒）查询一次消费记录。
 """
@@ -60,11 +110,32 @@ DEFAULT_MAIN_LOOP_INTERVAL = {
     'night': 600,
 }
 
+"""
+主循环休眠期间，每隔多久（秒）检查一次配置文件是否被修改。
+"""
+CONFIG_WATCH_INTERVAL = 10
+
 """
 在“合并连续小消费”工具函数中，默认的 threshold 参数
 """
 COMBINE_AMOUNT: float = 1.0
 
+"""
+流式合并小额消费时，一组小额消费最多被暂扣（不发送）多久（秒）。
+若超过该时间没有新的同类小额消费到达，该组就会被合并发送。
+"""
+DEFAULT_COMBINE_HOLD_SECONDS = 360
+
+"""
+消息索引中最多记录多少条消息，超出时淘汰最久未使用的条目。
+"""
+MSG_INDEX_MAX_SIZE = 256
+
+"""
+同类的小额消费在第一笔之后的多长时间（秒）内到达，会原地编辑已发送的通知，而不是发送新通知。
+"""
+DEFAULT_EDIT_WINDOW_SECONDS = 1800
+
 """
 某个请求在彻底失败之前，应当重试多少次。
 """
@@ -80,3 +151,170 @@ TRIGGER_CMD_ALPHABET: str = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXY
 详情参考 requests v2.22.0 的文档。
 """
 DEFAULT_REQ_TIMEOUT = (3.6, 30.0)
+
+"""
+内存统计：主循环每执行多少次，在日志中记录一次内存占用；以及 tracemalloc 统计时记录前多少个代码行。
+"""
+MEMORY_REPORT_EVERY = 20
+MEMORY_REPORT_TOP_N = 10
+
+"""
+启动完成后设置的 GC 阈值（参考 gc.set_threshold）。
+主循环每次都会产生大量短命的 DOM 对象，调高第 0 代阈值可减少无谓的 GC 次数。
+"""
+GC_THRESHOLD = (10000, 20, 20)
+
+"""
+从历史记录数据库中逐批读取记录时，每批的条数。
+"""
+HISTORY_FETCH_BATCH_SIZE = 500
+
+"""
+导出列式文件（如 Parquet）时，每个 row group 的记录条数。
+"""
+EXPORT_BATCH_SIZE = 10000
+
+"""
+多节点部署时，账号租约的默认有效期（秒）。节点宕机后，最多经过这么久其账号就会被其它节点接管。
+持有者每隔有效期的 1/3 续约一次。
+"""
+DEFAULT_LEASE_SECONDS = 60
+
+"""
+多节点部署时，租约数据库被其它节点锁住时最多等待多久（秒）。
+"""
+LEASE_DB_LOCK_TIMEOUT = 10.0
+
+"""
+一致性哈希环中，每个节点的虚拟节点数。
+"""
+HASH_RING_REPLICAS = 64
+
+"""
+访问学校网站时，每个主机（限流键）的默认持续速率（请求/秒）与允许的突发请求数。
+"""
+DEFAULT_HOST_RATE = 0.5
+DEFAULT_HOST_BURST = 5
+
+"""
+请求的优先级，数字越小越优先：交互式查询（如用户主动查询余额）优先于后台轮询。
+"""
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+"""
+--profile 模式下，采样式性能分析器的采样间隔（秒）；以及输出文件的默认前缀。
+"""
+PROFILE_SAMPLE_INTERVAL = 0.005
+DEFAULT_PROFILE_OUTPUT_PREFIX = 'profile'
+
+"""
+run_server_forever 的退避策略：各类错误的 (首次退避时间, 最长退避时间)，单位为秒。
+同类错误每多发生一次，退避时间翻倍，直到最长退避时间。
+认证错误需要用户修改配置才能恢复，频繁重试可能导致账号被锁定，因此退避得最久。
+"""
+SUPERVISOR_BACKOFF = {
+    'auth': (900, 6 * 3600),
+    'network': (10, 900),
+    'parse': (300, 3600),
+    'unknown': (30, 1800),
+}
+
+"""
+server 函数连续正常运行超过这么久（秒）后才出错，则认为此前已经恢复，重置退避状态。
+"""
+SUPERVISOR_HEALTHY_SECONDS = 600
+
+"""
+CRASH_LOOP_WINDOW 秒内出错达到 CRASH_LOOP_THRESHOLD 次，则认为陷入了崩溃循环，改用最长退避时间并通知用户。
+"""
+CRASH_LOOP_WINDOW = 1800
+CRASH_LOOP_THRESHOLD = 5
+
+"""
+出错时通知用户的最小间隔（秒）。
+"""
+SUPERVISOR_ALERT_INTERVAL = 6 * 3600
+
+"""
+提醒规则中，按天统计消费金额的环形缓冲区的长度（天），即 weekly-spend 的窗口长度。
+"""
+ALERT_WINDOW_DAYS = 7
+
+"""
+以流的方式读取网页时，每次读取的字节数。
+"""
+STREAM_CHUNK_SIZE = 16 * 1024
+
+"""
+WebVPN 的地址。ecard 等校内网站经由 {DEFAULT_VPN_BASE}/http/<校内主机名>/ 访问。
+本地测试时可通过配置 vpn.base-url 指向模拟的服务器（参见 fake_server 包）。
+"""
+DEFAULT_VPN_BASE = 'https://vpn.bupt.edu.cn'
+
+"""
+默认的补录（--backfill）进度文件的路径。
+记录每个账号已完成的日期区间，中断后再次运行时跳过这些区间。
+"""
+DEFAULT_BACKFILL_CHECKPOINT_PATH = '__backfill.json'
+
+"""
+补录时默认同时登录的会话数，以及每个会话一次查询的天数。
+单次查询的日期区间越短，返回的页面越小；所有会话共享 host_limiter 的限流。
+"""
+DEFAULT_BACKFILL_SESSIONS = 4
+DEFAULT_BACKFILL_CHUNK_DAYS = 7
+
+"""
+补录时每个日期区间最多尝试的次数，超过后放弃该区间，留待下次运行。
+"""
+BACKFILL_MAX_ATTEMPTS = 3
+
+"""
+多个账号共用一个 VPN 登录（vpn.shared）时，共用的连接池最多保持的连接数。
+"""
+SHARED_VPN_POOL_SIZE = 10
+
+"""
+事件推送服务器（events.socket）保留多少个最近的事件用于续传，以及每个订阅者最多积压多少个事件。
+积压超过上限的订阅者会被断开，以免拖慢轮询；它可以重新连接并续传。
+"""
+EVENT_STREAM_BACKLOG = 1000
+EVENT_STREAM_QUEUE_SIZE = 256
+
+"""
+订阅者连接事件推送服务器后，须在多少秒内发送订阅请求。
+"""
+EVENT_STREAM_HELLO_TIMEOUT = 5.0
+
+"""
+查询 API（api.listen）每页默认返回的条数，以及每页最多返回的条数。
+"""
+QUERY_API_DEFAULT_LIMIT = 100
+QUERY_API_MAX_LIMIT = 1000
+
+"""
+配置了多个 Telegram 代理（proxy.url 为列表）时，探测各代理的间隔（秒）与探测请求的超时时间（秒）。
+"""
+PROXY_PROBE_INTERVAL = 30.0
+PROXY_PROBE_TIMEOUT = 5.0
+
+"""
+代理的往返时间与错误率按指数加权移动平均统计，新样本的权重为 PROXY_EWMA_ALPHA。
+选择代理时，得分为 往返时间 * (1 + PROXY_ERROR_PENALTY * 错误率)，越低越好；尚未测得往返时间的代理按 PROXY_DEFAULT_RTT 计。
+"""
+PROXY_EWMA_ALPHA = 0.3
+PROXY_ERROR_PENALTY = 10.0
+PROXY_DEFAULT_RTT = 1.0
+
+"""
+代理连续失败多少次后视为不可用，排在所有可用的代理之后，直到再次成功。
+"""
+PROXY_DOWN_AFTER_FAILURES = 2
+
+"""
+标签规则编译后的缓存个数（规则不变时不会重新编译），
+以及每个 TagEngine 缓存多少种 (科目描述, 终端名称) 组合的标签。
+"""
+TAG_COMPILE_CACHE_SIZE = 8
+TAG_MEMO_SIZE = 4096
@@ -1,3 +1,7 @@
 from .transaction_dao import *
 from .state_dao import *
 from .config_dao import *
+from .message_index_dao import *
+from .history_dao import *
+from .lease_dao import *
+from .backfill_dao import *
@@ -0,0 +1,45 @@
+"""
+提供 BackfillCheckpointDao 类。
+"""
+
+__all__ = ('BackfillCheckpointDao',)
+
+import json
+from typing import Dict, List, Set, Tuple
+
+from ..constant import *
+from ..exceptions import AppError
+from ..util import PathStatus, get_path_status, stage_timer
+
+
+class BackfillCheckpointDao:
+    """
+    负责持久化读写补录的进度：每个账号已经完成（已存入历史记录）的日期区间。
+    每完成一个区间就持久化一次，因此补录中断后，再次运行时只需查询剩余的区间。
+    """
+    __slots__ = ('__path', '__done')
+
+    def __init__(self, file_path: str = DEFAULT_BACKFILL_CHECKPOINT_PATH) -> None:
+        self.__path = file_path
+        # 账号名 -> 已完成的 (起始日期, 截止日期)
+        self.__done: Dict[str, Set[Tuple[str, str]]] = dict()
+
+        ps = get_path_status(file_path)
+        if ps == PathStatus.READABLE:
+            with open(file_path, 'r', encoding=UNIFIED_ENCODING) as f:
+                content = json.load(f)
+            self.__done = {k: set(tuple(x) for x in v) for k, v in content.items()}
+        elif ps == PathStatus.UNREADABLE:
+            raise AppError(f'{file_path} 不是文件，无法覆盖或读取。')
+
+    def is_done(self, account: str, chunk: Tuple[str, str]) -> bool:
+        return chunk in self.__done.get(account, ())
+
+    def mark_done(self, account: str, chunk: Tuple[str, str]) -> None:
+        self.__done.setdefault(account, set()).add(chunk)
+        self.__persist()
+
+    def __persist(self) -> None:
+        content: Dict[str, List[Tuple[str, str]]] = {k: sorted(v) for k, v in self.__done.items()}
+        with stage_timer.stage('json_persist'), open(self.__path, 'w', encoding=UNIFIED_ENCODING) as f:
+            json.dump(content, f)
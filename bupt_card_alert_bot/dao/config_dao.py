@@ -4,13 +4,20 @@
 __all__ = ('ConfigDao',)
 
 import json
-from typing import Optional
+import logging as pym_logging
+import os
+from typing import Optional, Any, Dict, Tuple, Callable, List
 
 import jsonschema
 
 from ..constant import *
 from ..exceptions import AppError
 
+logger = pym_logging.getLogger(__name__)
+
+# 配置变更的差异：键为配置名，值为 (旧值, 新值)；不存在的配置用 None 表示
+ConfigDiff = Dict[str, Tuple[Any, Any]]
+
 
 class ConfigDao:
     """
@@ -21,17 +28,40 @@ class ConfigDao:
     该类并不自带单例模式，且所有方法均不是静态。
     因此，使用该类时，用户应先初始化该类，并全程使用同一个实例。
 
+    配置文件可以在运行时修改：调用 reload_if_changed 方法时，若文件的修改时间变化，
+    则重新读取并验证配置文件，并将差异通知给通过 subscribe 方法注册的回调函数。
+
     TODO: 给别的类注释其使用方法
     """
-    __slots__ = ('__conf',)
+    __slots__ = ('__conf', '__path', '__stat', '__subscribers')
 
     def __init__(self, config_filename: str = DEFAULT_CONFIG_FILE_PATH) -> None:
         """
         构造函数。初始化一个已经读入了配置文件的 ConfigDao 类。
         :param config_filename: 配置文件的路径。默认为 DEFAULT_CONFIG_FILE_PATH。
         """
+        self.__path = config_filename
+        self.__subscribers: List[Callable[[ConfigDiff], None]] = []
+        self.__stat = self.__file_stat()
+        self.__conf = self.__load()
+
+    def __file_stat(self) -> Optional[Tuple[int, int]]:
+        """
+        获取配置文件的 (修改时间, 大小)，用于判断文件是否被修改。文件不存在时返回 None。
+        """
+        try:
+            st = os.stat(self.__path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def __load(self) -> Dict[str, Any]:
+        """
+        读取并验证配置文件。
+        :return: 配置内容
+        """
         try:
-            with open(config_filename, 'r', encoding=UNIFIED_ENCODING) as f:
+            with open(self.__path, 'r', encoding=UNIFIED_ENCODING) as f:
                 conf = json.load(f)
         except:
             raise AppError('配置文件读取失败。')
@@ -43,13 +73,54 @@ class ConfigDao:
             # 如果格式不正确，抛出用户友好的错误信息
             raise AppError('配置文件格式错误。')
 
+        return conf
+
+    def subscribe(self, callback: Callable[[ConfigDiff], None]) -> None:
+        """
+        注册一个回调函数。配置文件被修改并通过验证后，将以差异为参数调用该函数。
+        :param callback: 回调函数，参数为 dict，键为配置名，值为 (旧值, 新值)
+        :return: None
+        """
+        self.__subscribers.append(callback)
+
+    def reload_if_changed(self) -> ConfigDiff:
+        """
+        检查配置文件的修改时间，若已修改则重新读取、验证，并通知订阅者。
+        新的配置文件无法读取或验证失败时，记录警告并继续使用旧配置。
+        :return: 配置的差异；未修改、或修改后内容相同、或新配置无效时为空 dict
+        """
+        stat = self.__file_stat()
+        if stat == self.__stat:
+            return dict()
+
+        # 无论新配置是否有效，都记下本次看到的文件状态，避免对同一个无效文件反复报警
+        self.__stat = stat
+        try:
+            conf = self.__load()
+        except AppError as e:
+            logger.warning(f'Config file changed but is invalid, keep using the old one: {e}')
+            return dict()
+
+        diff = {
+            k: (self.__conf.get(k), conf.get(k))
+            for k in self.__conf.keys() | conf.keys()
+            if self.__conf.get(k) != conf.get(k)
+        }
         self.__conf = conf
 
-    def __getitem__(self, item: str) -> Optional[str]:
+        if len(diff) != 0:
+            # 日志中不记录配置的值，以免泄露密码
+            logger.info(f'Config reloaded. Changed: {", ".join(sorted(diff))}')
+            for callback in self.__subscribers:
+                callback(diff)
+
+        return diff
+
+    def __getitem__(self, item: str) -> Optional[Any]:
         """
         获取某个配置。
         :param item: 配置的名字（str）。
-        :return: 配置内容（str）
+        :return: 配置内容（多为 str，类型以 CONFIG_SCHEMA 为准）
         """
         if item not in CONFIG_VALID_PROPS:
             raise AppError(f'配置名 {item} 不合法。')
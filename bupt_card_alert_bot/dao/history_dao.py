@@ -0,0 +1,292 @@
+"""
+提供 HistoryDao 类。
+"""
+
+__all__ = ('HistoryDao', 'HistoryReader')
+
+import sqlite3
+import threading
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from ..constant import *
+from ..exceptions import AppError
+from ..popo import Transaction
+from ..util import PathStatus, get_path_status
+
+# 列的顺序与 Transaction 的字段顺序一致，account 在最前，tags 在最后
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS history (
+    account      TEXT    NOT NULL,
+    op_datetime  TEXT    NOT NULL,
+    category     TEXT    NOT NULL,
+    trans_amount REAL    NOT NULL,
+    balance      REAL    NOT NULL,
+    location     TEXT    NOT NULL,
+    op_timestamp INTEGER NOT NULL,
+    tags         TEXT    NOT NULL DEFAULT '',
+    UNIQUE (account, op_timestamp, category, location, trans_amount, balance)
+);
+CREATE INDEX IF NOT EXISTS history_account_time ON history (account, op_timestamp);
+CREATE INDEX IF NOT EXISTS history_time ON history (op_timestamp);
+CREATE INDEX IF NOT EXISTS history_category_time ON history (category, op_timestamp);
+CREATE INDEX IF NOT EXISTS history_location_time ON history (location, op_timestamp);
+CREATE TABLE IF NOT EXISTS history_tags (
+    tag          TEXT    NOT NULL,
+    op_timestamp INTEGER NOT NULL,
+    history_id   INTEGER NOT NULL,
+    PRIMARY KEY (tag, op_timestamp, history_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS history_tags_row ON history_tags (history_id);
+CREATE TABLE IF NOT EXISTS history_meta (
+    key   TEXT    PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+TRANSACTION_COLUMNS = ', '.join(Transaction._fields)
+
+# 为旧版本创建的数据库补上 tags 列
+ADD_TAGS_COLUMN = "ALTER TABLE history ADD COLUMN tags TEXT NOT NULL DEFAULT ''"
+
+# history_meta 中的键：retag 修改过记录的次数。查询 API 的版本号由它与最大的 rowid 组成
+TAGS_VERSION_KEY = 'tags_version'
+
+
+class HistoryDao:
+    """
+    负责持久化存储全部的原始消费记录（历史记录）。
+
+    TransactionDao 只保存用于排重的、最近几天的消费记录，每次都整体重写；
+    本类则使用 SQLite，只追加、不删除，重复的记录会被自动忽略。
+    读取时通过游标分批取出，内存占用与历史记录的多少无关。
+
+    每条记录带有标签，写入时由 tagger 计算，因此统计与查询时可以直接按标签分组或筛选，无需再匹配规则。
+    标签以逗号分隔的形式（如 canteen,lunch）存放在 tags 列中用于展示，
+    同时逐个存放在 history_tags 表中，按 (标签, 时间) 建有索引，用于筛选。
+    """
+    __slots__ = ('tagger', '__path', '__conn')
+
+    def __init__(self, file_path: str = DEFAULT_HISTORY_FILE_PATH,
+                 tagger: Optional[Callable[[Transaction], str]] = None) -> None:
+        """
+        :param file_path: 数据库文件的路径
+        :param tagger: 计算消费记录的标签的函数，如 TagEngine.tags_text；为 None 时不加标签
+        """
+        self.tagger = tagger
+        self.__path = file_path
+
+        if get_path_status(file_path) == PathStatus.UNREADABLE:
+            raise AppError(f'{file_path} 不是文件，无法覆盖或读取。')
+
+        try:
+            self.__conn = sqlite3.connect(file_path)
+            # WAL 模式下，HistoryReader 的读取与本类的写入互不阻塞
+            self.__conn.execute('PRAGMA journal_mode=WAL')
+            has_tag_table = self.__conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_tags'").fetchone() is not None
+            self.__conn.executescript(SCHEMA)
+            if 'tags' not in {x[1] for x in self.__conn.execute('PRAGMA table_info(history)')}:
+                self.__conn.execute(ADD_TAGS_COLUMN)
+            if not has_tag_table:
+                self.__rebuild_tag_table()
+        except sqlite3.Error as e:
+            raise AppError(f'无法打开历史记录数据库 {file_path}。') from e
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    def append(self, account: str, trans: Iterable[Transaction]) -> int:
+        """
+        追加消费记录，已存在的记录会被忽略。
+        :param account: 消费记录所属的账号（ecard 用户名）
+        :param trans: Transaction 对象
+        :return: 实际新增的记录条数
+        """
+        tagger = self.tagger
+        count = 0
+        with self.__conn:
+            for x in trans:
+                tags = tagger(x) if tagger is not None else ''
+                cursor = self.__conn.execute(
+                    f'INSERT OR IGNORE INTO history (account, {TRANSACTION_COLUMNS}, tags) '
+                    f'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (account,) + tuple(x) + (tags,))
+                if cursor.rowcount == 1:
+                    count += 1
+                    self.__insert_tags(cursor.lastrowid, x.op_timestamp, tags)
+        return count
+
+    def retag(self) -> int:
+        """
+        用当前的 tagger 重新计算所有记录的标签，用于标签规则变化之后。
+        标签只取决于科目描述与终端名称，因此按两者的组合批量计算，而不是逐条计算。
+        有记录的标签变化时，递增 history_meta 中的版本号，使 HistoryReader.version 随之变化。
+        :return: 标签发生变化的记录条数
+        """
+        tagger = self.tagger
+        count = 0
+        with self.__conn:
+            pairs = self.__conn.execute('SELECT DISTINCT category, location FROM history').fetchall()
+            for category, location in pairs:
+                tags = tagger(Transaction(None, category, None, None, location, None)) if tagger is not None else ''
+                rows = self.__conn.execute(
+                    'SELECT rowid, op_timestamp FROM history WHERE category = ? AND location = ? AND tags != ?',
+                    (category, location, tags)).fetchall()
+                for rowid, op_timestamp in rows:
+                    self.__conn.execute('DELETE FROM history_tags WHERE history_id = ?', (rowid,))
+                    self.__conn.execute('UPDATE history SET tags = ? WHERE rowid = ?', (tags, rowid))
+                    self.__insert_tags(rowid, op_timestamp, tags)
+                count += len(rows)
+
+            if count:
+                self.__conn.execute('INSERT OR IGNORE INTO history_meta (key, value) VALUES (?, 0)',
+                                    (TAGS_VERSION_KEY,))
+                self.__conn.execute('UPDATE history_meta SET value = value + 1 WHERE key = ?', (TAGS_VERSION_KEY,))
+        return count
+
+    def __insert_tags(self, rowid: int, op_timestamp: int, tags: str) -> None:
+        if tags:
+            self.__conn.executemany('INSERT OR IGNORE INTO history_tags (tag, op_timestamp, history_id) '
+                                    'VALUES (?, ?, ?)', ((x, op_timestamp, rowid) for x in tags.split(',')))
+
+    def __rebuild_tag_table(self) -> None:
+        """
+        由 tags 列重建 history_tags 表，用于升级只有 tags 列的数据库。
+        """
+        with self.__conn:
+            rows = self.__conn.execute("SELECT rowid, op_timestamp, tags FROM history WHERE tags != ''").fetchall()
+            for rowid, op_timestamp, tags in rows:
+                self.__insert_tags(rowid, op_timestamp, tags)
+
+    def iter_records(self, account: Optional[str] = None,
+                     since_timestamp: Optional[int] = None,
+                     until_timestamp: Optional[int] = None,
+                     batch_size: int = HISTORY_FETCH_BATCH_SIZE) -> Iterator[Tuple[str, Transaction, str]]:
+        """
+        按时间顺序逐条生成历史记录。
+        :param account: 只生成该账号的记录，None 表示所有账号
+        :param since_timestamp: 只生成该时间戳及之后的记录
+        :param until_timestamp: 只生成该时间戳之前的记录（不含）
+        :param batch_size: 每次从数据库取出多少条
+        :return: 生成器，元素为 (账号, Transaction, 标签)
+        """
+        conditions, params = [], []
+        if account is not None:
+            conditions.append('account = ?')
+            params.append(account)
+        if since_timestamp is not None:
+            conditions.append('op_timestamp >= ?')
+            params.append(since_timestamp)
+        if until_timestamp is not None:
+            conditions.append('op_timestamp < ?')
+            params.append(until_timestamp)
+
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        cursor = self.__conn.execute(
+            f'SELECT account, {TRANSACTION_COLUMNS}, tags FROM history {where} ORDER BY op_timestamp',
+            params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row[0], Transaction._make(row[1:-1]), row[-1]
+        finally:
+            cursor.close()
+
+    def close(self) -> None:
+        self.__conn.close()
+
+
+class HistoryReader:
+    """
+    以只读方式查询历史记录数据库，供查询 API 等在其它线程中使用。
+    每个线程使用各自的只读连接；数据库为 WAL 模式，因此查询不会阻塞 HistoryDao 的写入。
+
+    查询使用键集分页：结果按 (op_timestamp, rowid) 排序，下一页从上一页最后一条记录之后开始，
+    因此翻页的开销与页码无关，翻页期间新增的记录也不会导致重复或遗漏。
+    """
+    __slots__ = ('__path', '__local')
+
+    def __init__(self, file_path: str = DEFAULT_HISTORY_FILE_PATH) -> None:
+        self.__path = file_path
+        self.__local = threading.local()
+
+    def __conn(self) -> sqlite3.Connection:
+        conn = getattr(self.__local, 'conn', None)
+        if conn is None:
+            try:
+                conn = sqlite3.connect(f'file:{self.__path}?mode=ro', uri=True)
+            except sqlite3.Error as e:
+                raise AppError(f'无法打开历史记录数据库 {self.__path}。') from e
+            self.__local.conn = conn
+        return conn
+
+    def version(self) -> str:
+        """
+        返回数据库内容的版本号，形如 1024.3。
+        历史记录只追加、不删除，因此最大的 rowid 变化当且仅当有新记录；
+        已有记录只有标签会被 HistoryDao.retag 修改，retag 修改记录时会递增 history_meta 中的版本号。
+        :return: str
+        """
+        max_rowid, tags_version = self.__conn().execute(
+            'SELECT (SELECT COALESCE(MAX(rowid), 0) FROM history), '
+            '(SELECT COALESCE(MAX(value), 0) FROM history_meta WHERE key = ?)', (TAGS_VERSION_KEY,)).fetchone()
+        return f'{max_rowid}.{tags_version}'
+
+    def query(self, account: Optional[str] = None,
+              since_timestamp: Optional[int] = None, until_timestamp: Optional[int] = None,
+              category: Optional[str] = None, location: Optional[str] = None,
+              tag: Optional[str] = None, min_amount: Optional[float] = None, max_amount: Optional[float] = None,
+              after: Optional[Tuple[int, int]] = None,
+              limit: int = HISTORY_FETCH_BATCH_SIZE) -> List[Tuple[int, str, Transaction, str]]:
+        """
+        按时间顺序查询一页历史记录。所有条件都是可选的，且同时生效。
+        :param account: 账号
+        :param since_timestamp: 该时间戳及之后的记录
+        :param until_timestamp: 该时间戳之前的记录（不含）
+        :param category: 消费类别（完全匹配）
+        :param location: 位置（完全匹配）
+        :param tag: 带有该标签
+        :param min_amount: 交易金额不小于该值
+        :param max_amount: 交易金额不大于该值
+        :param after: 上一页最后一条记录的 (op_timestamp, rowid)，返回其后的记录；None 表示第一页
+        :param limit: 最多返回多少条
+        :return: (rowid, 账号, Transaction, 标签) 的 list
+        """
+        # 按标签筛选时，从 history_tags 的 (标签, 时间, 记录) 索引出发，时间范围与排序都在该索引上进行
+        if tag is not None:
+            tables = 'history_tags t JOIN history h ON h.rowid = t.history_id'
+            ts, rowid = 't.op_timestamp', 't.history_id'
+            conditions, params = ['t.tag = ?'], [tag]
+        else:
+            tables = 'history h'
+            ts, rowid = 'h.op_timestamp', 'h.rowid'
+            conditions, params = [], []
+
+        for column, op, value in (
+                ('h.account', '=', account),
+                (ts, '>=', since_timestamp),
+                (ts, '<', until_timestamp),
+                ('h.category', '=', category),
+                ('h.location', '=', location),
+                ('h.trans_amount', '>=', min_amount),
+                ('h.trans_amount', '<=', max_amount),
+        ):
+            if value is not None:
+                conditions.append(f'{column} {op} ?')
+                params.append(value)
+        if after is not None:
+            # 不使用行值比较 (a, b) > (?, ?)，因为 Python 3.6 附带的 SQLite 可能不支持
+            conditions.append(f'({ts} > ? OR ({ts} = ? AND {rowid} > ?))')
+            params.extend((after[0], after[0], after[1]))
+
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        columns = ', '.join(f'h.{x}' for x in Transaction._fields)
+        rows = self.__conn().execute(
+            f'SELECT {rowid}, h.account, {columns}, h.tags FROM {tables} {where} '
+            f'ORDER BY {ts}, {rowid} LIMIT ?',
+            params + [limit]).fetchall()
+        return [(row[0], row[1], Transaction._make(row[2:-1]), row[-1]) for row in rows]
@@ -0,0 +1,189 @@
+"""
+提供 LeaseDao 类。
+"""
+
+__all__ = ('LeaseDao',)
+
+import json
+import sqlite3
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from ..constant import *
+from ..exceptions import AppError
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id      TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    account    TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS handoff (
+    account    TEXT PRIMARY KEY,
+    state      TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+'''
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+
+def wrap_sqlite_errors(func: F) -> F:
+    """
+    将 sqlite3.Error（如多个节点争用时的 database is locked）转换为 AppError，使调用者可以按可恢复的错误处理。
+    """
+    @wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.Error as e:
+            raise AppError(f'访问租约数据库失败：{e}') from e
+
+    return wrapper
+
+
+class LeaseDao:
+    """
+    多节点部署时，各节点共享的“租约”存储。
+
+    每个账号同一时刻只能被持有其租约的节点登录和轮询；租约有有效期，持有者需在到期前续约。
+    节点宕机后不再续约，租约到期后即可被其它节点接管。
+    接管时所需的 Cookie、排重记录等状态，由原持有者通过 save_handoff 写入，新持有者通过 load_handoff 读出。
+    持有者在发送通知、保存状态之前应通过 renew 确认租约仍归自己所有（fencing），以免与接管者同时工作。
+    数据库的错误均以 AppError 抛出。
+
+    存储使用 SQLite 文件，多个节点（进程）共享同一个文件即可；所有节点的时钟应大致同步。
+    """
+    __slots__ = ('__conn',)
+
+    def __init__(self, file_path: str) -> None:
+        try:
+            # isolation_level=None：由本类显式地控制事务
+            self.__conn = sqlite3.connect(file_path, timeout=LEASE_DB_LOCK_TIMEOUT, isolation_level=None)
+            self.__conn.executescript(SCHEMA)
+        except sqlite3.Error as e:
+            raise AppError(f'无法打开租约数据库 {file_path}。') from e
+
+    def __transaction(self) -> 'sqlite3.Connection':
+        # BEGIN IMMEDIATE 立即获取写锁，使“检查后修改”在多个进程间是原子的
+        self.__conn.execute('BEGIN IMMEDIATE')
+        return self.__conn
+
+    @wrap_sqlite_errors
+    def heartbeat(self, node_id: str) -> None:
+        """
+        记录节点仍然存活。
+        :param node_id: 节点名
+        :return: None
+        """
+        self.__conn.execute('INSERT OR REPLACE INTO nodes (node_id, heartbeat_at) VALUES (?, ?)',
+                            (node_id, time.time()))
+
+    @wrap_sqlite_errors
+    def live_nodes(self, ttl: float) -> List[str]:
+        """
+        返回 ttl 秒内有心跳的节点。
+        :param ttl: 心跳的有效期（秒）
+        :return: 节点名的 list
+        """
+        rows = self.__conn.execute('SELECT node_id FROM nodes WHERE heartbeat_at >= ? ORDER BY node_id',
+                                   (time.time() - ttl,))
+        return [x[0] for x in rows]
+
+    @wrap_sqlite_errors
+    def try_acquire(self, account: str, node_id: str, ttl: float) -> bool:
+        """
+        尝试获取或续约某个账号的租约。
+        只有在租约不存在、已过期，或本就由 node_id 持有时才能成功。
+        :param account: 账号名
+        :param node_id: 节点名
+        :param ttl: 租约的有效期（秒）
+        :return: 是否成功
+        """
+        now = time.time()
+        conn = self.__transaction()
+        try:
+            row = conn.execute('SELECT owner, expires_at FROM leases WHERE account = ?', (account,)).fetchone()
+            if row is not None and row[0] != node_id and row[1] > now:
+                conn.execute('ROLLBACK')
+                return False
+
+            conn.execute('INSERT OR REPLACE INTO leases (account, owner, expires_at) VALUES (?, ?, ?)',
+                         (account, node_id, now + ttl))
+            conn.execute('COMMIT')
+            return True
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    @wrap_sqlite_errors
+    def renew(self, account: str, node_id: str, ttl: float) -> bool:
+        """
+        续约 node_id 持有的某个账号的租约。
+        与 try_acquire 不同，只要租约已被其它节点接管或被释放过，即使其后又无人持有，也不会成功，
+        因为此时本节点内存中的状态可能已经过时，应重新通过 load_handoff 接管。
+        :param account: 账号名
+        :param node_id: 节点名
+        :param ttl: 租约的有效期（秒）
+        :return: 租约是否仍归 node_id 所有
+        """
+        cursor = self.__conn.execute('UPDATE leases SET expires_at = ? WHERE account = ? AND owner = ?',
+                                     (time.time() + ttl, account, node_id))
+        return cursor.rowcount == 1
+
+    @wrap_sqlite_errors
+    def release(self, account: str, node_id: str) -> None:
+        """
+        释放 node_id 持有的某个账号的租约，使其它节点可以立即接管。
+        :return: None
+        """
+        self.__conn.execute('DELETE FROM leases WHERE account = ? AND owner = ?', (account, node_id))
+
+    @wrap_sqlite_errors
+    def owner(self, account: str) -> Optional[str]:
+        """
+        返回某个账号的租约当前的有效持有者；无人持有时返回 None。
+        """
+        row = self.__conn.execute('SELECT owner FROM leases WHERE account = ? AND expires_at > ?',
+                                  (account, time.time())).fetchone()
+        return None if row is None else row[0]
+
+    @wrap_sqlite_errors
+    def save_handoff(self, account: str, state: Dict[str, Any], node_id: str) -> bool:
+        """
+        保存接管某个账号所需的状态（如 Cookie、排重记录）。
+        只有当 node_id 仍持有该账号的租约时才会保存，以免覆盖接管者保存的更新的状态。
+        :param account: 账号名
+        :param state: 可以被 JSON 序列化的 dict
+        :param node_id: 保存者的节点名
+        :return: 是否保存成功
+        """
+        content = json.dumps(state)
+        conn = self.__transaction()
+        try:
+            row = conn.execute('SELECT owner FROM leases WHERE account = ?', (account,)).fetchone()
+            if row is None or row[0] != node_id:
+                conn.execute('ROLLBACK')
+                return False
+
+            conn.execute('INSERT OR REPLACE INTO handoff (account, state, updated_at) VALUES (?, ?, ?)',
+                         (account, content, time.time()))
+            conn.execute('COMMIT')
+            return True
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    @wrap_sqlite_errors
+    def load_handoff(self, account: str) -> Optional[Dict[str, Any]]:
+        """
+        读取某个账号最近一次保存的状态。
+        :return: save_handoff 保存的 dict，或 None
+        """
+        row = self.__conn.execute('SELECT state FROM handoff WHERE account = ?', (account,)).fetchone()
+        return None if row is None else json.loads(row[0])
@@ -0,0 +1,96 @@
+"""
+提供 MessageIndexDao 类。
+"""
+
+__all__ = ('MessageIndexDao',)
+
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from ..constant import *
+from ..exceptions import AppError
+from ..util import PathStatus, get_path_status, stage_timer
+
+
+class MessageIndexDao:
+    """
+    负责持久化读写“最近发送的消息”的索引。
+    索引的键为 (chat_id, 分组名)，值为 (message_id, 附加数据)；附加数据必须可以被 JSON 序列化。
+
+    索引的大小有上限，超出时淘汰最久未使用的条目。修改索引时，修改的内容将会自动持久化。
+    本类的方法是线程安全的。
+    """
+    __slots__ = ('__path', '__max_size', '__index', '__lock')
+
+    def __init__(self, file_path: str = DEFAULT_MSG_INDEX_FILE_PATH,
+                 max_size: int = MSG_INDEX_MAX_SIZE) -> None:
+        if max_size <= 0:
+            raise ValueError('max_size 应该大于 0')
+
+        self.__path = file_path
+        self.__max_size = max_size
+        self.__index = OrderedDict()
+        self.__lock = threading.Lock()
+
+        ps = get_path_status(file_path)
+        if ps == PathStatus.NOT_EXIST:
+            self.__persist()
+        elif ps == PathStatus.READABLE:
+            with open(file_path, 'r', encoding=UNIFIED_ENCODING) as f:
+                content = json.load(f)
+
+            # 文件中的条目按从旧到新排列
+            for chat_id, group, message_id, payload in content:
+                self.__index[(chat_id, group)] = (message_id, payload)
+            self.__evict()
+        else:
+            raise AppError(f'{file_path} 不是文件，无法覆盖或读取。')
+
+    def get(self, chat_id: int, group: str) -> Optional[Tuple[int, Any]]:
+        """
+        查询某个分组最近发送的消息。
+        :param chat_id: Chat 的 chat_id
+        :param group: 分组名
+        :return: (message_id, 附加数据)，或 None
+        """
+        with self.__lock:
+            return self.__index.get((chat_id, group), None)
+
+    def put(self, chat_id: int, group: str, message_id: int, payload: Any = None) -> None:
+        """
+        记录某个分组最近发送的消息，并将其标记为最新使用。
+        :param chat_id: Chat 的 chat_id
+        :param group: 分组名
+        :param message_id: 消息的 message_id
+        :param payload: 附加数据
+        :return: None
+        """
+        key = (chat_id, group)
+        with self.__lock:
+            self.__index[key] = (message_id, payload)
+            self.__index.move_to_end(key)
+            self.__evict()
+            self.__persist()
+
+    def remove(self, chat_id: int, group: str) -> None:
+        """
+        删除某个分组的记录。若不存在则什么也不做。
+        :return: None
+        """
+        with self.__lock:
+            if self.__index.pop((chat_id, group), None) is not None:
+                self.__persist()
+
+    def __evict(self) -> None:
+        while len(self.__index) > self.__max_size:
+            self.__index.popitem(last=False)
+
+    def __persist(self) -> None:
+        content = [[k[0], k[1], v[0], v[1]] for k, v in self.__index.items()]
+        with stage_timer.stage('json_persist'), open(self.__path, 'w', encoding=UNIFIED_ENCODING) as f:
+            json.dump(content, f)
+
+    def __len__(self) -> int:
+        return len(self.__index)
@@ -9,7 +9,7 @@ from typing import Any
 
 from ..constant import *
 from ..exceptions import AppError
-from ..util import get_path_status, PathStatus
+from ..util import get_path_status, PathStatus, stage_timer
 
 STATES_AND_DEFAULTS = {
     # Telegram 机器人是否已部署
@@ -17,6 +17,21 @@ STATES_AND_DEFAULTS = {
 
     # 如果 Telegram 机器人已部署，该变量保存使用者的 ID
     'tg_chat_id': None,
+
+    # StreamingCombiner 中尚未发送的小额消费组，重启后恢复
+    'combine_open_groups': [],
+
+    # HostRateLimiter 中各主机剩余的令牌数，重启后恢复，避免重启后立即突发大量请求
+    'rate_limit_state': {},
+
+    # AlertEngine 的统计值与各规则的待命状态，重启后恢复，避免重复提醒
+    'alert_engine': {},
+
+    # EventStreamServer 最后发布的事件的序号，重启后继续递增，订阅者可以据此续传
+    'event_stream_seq': 0,
+
+    # 历史记录中已存储的标签所依据的标签规则的摘要（TagEngine.digest），规则变化时据此重新计算标签
+    'tag_rules_digest': None,
 }
 
 
@@ -35,7 +50,11 @@ class StateDao:
             self.reset_all()
         elif ps == PathStatus.READABLE:
             with open(path, 'r', encoding=UNIFIED_ENCODING) as f:
-                self.__conf = json.load(f)
+                conf = json.load(f)
+
+            # 旧版本的状态文件可能缺少新增的条目，用默认值补齐
+            self.__conf = deepcopy(STATES_AND_DEFAULTS)
+            self.__conf.update(conf)
         else:
             raise AppError(f'{path} 不是文件，无法覆盖或读取。')
 
@@ -53,7 +72,7 @@ class StateDao:
         将 self.__conf 持久化保存。
         :return: None
         """
-        with open(self.__path, 'w', encoding=UNIFIED_ENCODING) as f:
+        with stage_timer.stage('json_persist'), open(self.__path, 'w', encoding=UNIFIED_ENCODING) as f:
             json.dump(self.__conf, f)
 
     def __getitem__(self, item: str) -> Any:
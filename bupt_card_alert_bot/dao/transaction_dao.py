@@ -9,8 +9,8 @@ from typing import Iterable, Set
 
 from ..constant import *
 from ..exceptions import AppError
-from ..popo import Transaction
-from ..util import PathStatus, get_path_status
+from ..popo import Transaction, TransactionLog
+from ..util import PathStatus, get_path_status, stage_timer
 
 
 class TransactionDao:
@@ -39,8 +39,15 @@ class TransactionDao:
 
         return set(Transaction._make(x) for x in content)
 
+    def load_transaction_log(self) -> TransactionLog:
+        return TransactionLog(self.load_transaction_set())
+
     def store_transactions(self, trans: Iterable[Transaction]) -> None:
         trans_list = list(trans)
 
-        with open(self.__path, 'w', encoding=UNIFIED_ENCODING) as f:
+        with stage_timer.stage('json_persist'), open(self.__path, 'w', encoding=UNIFIED_ENCODING) as f:
             json.dump(trans_list, f)
+
+    def store_transaction_log(self, log: TransactionLog) -> None:
+        # 按时间顺序写入，便于人工查看
+        self.store_transactions(log.snapshot())
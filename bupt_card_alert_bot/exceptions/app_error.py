@@ -2,7 +2,7 @@
 定义：给整个应用使用的异常类
 """
 
-__all__ = ('AppError', 'AppFatalError')
+__all__ = ('AppError', 'AppAuthError', 'AppNetworkError', 'AppVpnSessionError', 'AppParseError', 'AppFatalError')
 
 
 class AppError(Exception):
@@ -13,6 +13,34 @@ class AppError(Exception):
     pass
 
 
+class AppAuthError(AppError):
+    """
+    用户名或密码错误等认证失败。通常需要用户修改配置才能恢复，频繁重试可能导致账号被锁定。
+    """
+    pass
+
+
+class AppNetworkError(AppError):
+    """
+    网络超时、连接失败、服务器返回错误状态码等暂时性的错误，稍后重试通常即可恢复。
+    """
+    pass
+
+
+class AppVpnSessionError(AppNetworkError):
+    """
+    经 WebVPN 访问的请求被重定向到了 VPN 登录页，即 VPN 会话已失效，需要重新登录 VPN。
+    """
+    pass
+
+
+class AppParseError(AppError):
+    """
+    网页结构与解析代码的预期不符，通常意味着学校网站改版，需要更新代码。
+    """
+    pass
+
+
 class AppFatalError(Exception):
     """
     标记由当前应用（而非第三方库）抛出的，无法恢复的致命错误。
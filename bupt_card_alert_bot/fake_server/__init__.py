@@ -0,0 +1,5 @@
+from .fake_http_server import *
+from .fake_data import *
+from .fake_campus_server import *
+from .fake_tg_server import *
+from .fault_injection import *
@@ -0,0 +1,234 @@
+"""
+本文件提供 FakeCampusServer 类，在本地模拟 WebVPN 与经 WebVPN 访问的 ecard 网站。
+"""
+
+__all__ = ('FakeCampusServer',)
+
+import base64
+import html
+import json
+import secrets
+import threading
+from datetime import datetime
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from ..constant import *
+from ..popo import Transaction
+from ..util import date_to_timestamp, tz_beijing
+from .fake_data import FakeTransactionGenerator
+from .fake_http_server import FakeHttpServer, FakeResponse
+
+# ecard 网站经由 WebVPN 访问时的路径前缀
+ECARD_PREFIX = '/http/ecard.bupt.edu.cn/'
+
+# 消费记录表格的排序按钮
+SORT_BUTTON_TARGET = 'ctl00$ContentPlaceHolder1$gridView$ctl01$SortBt'
+
+HTML_TYPE = ('Content-Type', 'text/html; charset=utf-8')
+
+
+class FakeCampusServer(FakeHttpServer):
+    """
+    模拟的 WebVPN 与 ecard 网站，页面结构与真实网站一致到足以让 VpnClient、EcardClient 正常工作：
+        GlobalProtect 登录：设置 PHPSESSID 与 GP_SESSION_CK 两个 Cookie；
+        ecard（ASP.NET）登录：回传表单、登录后跳转到 Index.aspx；
+        ConsumeInfo.aspx：查询与排序按钮的回传，排序状态保存在 __VIEWSTATE 中；
+        baseinfo.aspx：个人信息。
+    消费记录由 FakeTransactionGenerator 生成。
+
+    为模拟真实网站较大的页面，可以用 viewstate_size 与 footer_size 在表格前后填充内容。
+    """
+    __slots__ = ('accounts', 'generator', 'viewstate_size', 'footer_size', 'vpn_logins',
+                 '__vpn_sessions', '__ecard_sessions', '__sessions_lock')
+
+    def __init__(self, listen: Tuple[str, int] = ('127.0.0.1', 0),
+                 latency: float = 0.0, jitter: float = 0.0,
+                 accounts: Optional[Dict[str, str]] = None,
+                 generator: Optional[FakeTransactionGenerator] = None,
+                 viewstate_size: int = 20000, footer_size: int = 20000) -> None:
+        """
+        :param listen: 参见 FakeHttpServer
+        :param latency: 参见 FakeHttpServer
+        :param jitter: 参见 FakeHttpServer
+        :param accounts: 用户名 -> 密码，vpn 与 ecard 共用；为 None 时接受任意用户名和密码
+        :param generator: 消费记录生成器，默认为 FakeTransactionGenerator()
+        :param viewstate_size: __VIEWSTATE 的填充长度（字符）
+        :param footer_size: 消费记录表格之后的填充长度（字符）
+        """
+        super().__init__(listen, latency, jitter)
+        self.accounts = accounts
+        self.generator = generator if generator is not None else FakeTransactionGenerator()
+        self.viewstate_size = viewstate_size
+        self.footer_size = footer_size
+        # 成功登录 WebVPN 的次数
+        self.vpn_logins = 0
+
+        # GP_SESSION_CK -> vpn 用户名；ASP.NET_SessionId -> ecard 用户名
+        self.__vpn_sessions: Dict[str, str] = dict()
+        self.__ecard_sessions: Dict[str, str] = dict()
+        self.__sessions_lock = threading.Lock()
+
+    def __check_password(self, username: str, password: str) -> bool:
+        if not username or not password:
+            return False
+        return self.accounts is None or self.accounts.get(username) == password
+
+    def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> FakeResponse:
+        path = urlsplit(path).path
+        cookie = SimpleCookie(headers.get('Cookie', ''))
+        form = {k: v[0] for k, v in parse_qs(body.decode(UNIFIED_ENCODING), keep_blank_values=True).items()}
+
+        if path == '/global-protect/login.esp':
+            return self.__vpn_login(method, cookie, form)
+
+        if not path.startswith(ECARD_PREFIX):
+            return 404, [HTML_TYPE], b'Not Found'
+
+        # 经 WebVPN 访问校内网站，必须先登录 WebVPN
+        with self.__sessions_lock:
+            vpn_user = self.__vpn_sessions.get(cookie['GP_SESSION_CK'].value) if 'GP_SESSION_CK' in cookie else None
+            ecard_user = (self.__ecard_sessions.get(cookie['ASP.NET_SessionId'].value)
+                          if 'ASP.NET_SessionId' in cookie else None)
+        if vpn_user is None:
+            return 302, [('Location', '/global-protect/login.esp')], b''
+
+        page = path[len(ECARD_PREFIX):]
+        if page == 'Login.aspx':
+            return self.__ecard_login(method, form)
+        if ecard_user is None:
+            return 302, [('Location', ECARD_PREFIX + 'Login.aspx')], b''
+        if page == 'User/Index.aspx':
+            return self.__page('首页', '<p>欢迎使用校园卡服务平台</p>')
+        if page == 'User/baseinfo.aspx':
+            return self.__base_info(ecard_user)
+        if page == 'User/ConsumeInfo.aspx':
+            return self.__consume_info(method, ecard_user, form)
+        return 404, [HTML_TYPE], b'Not Found'
+
+    def __vpn_login(self, method: str, cookie: SimpleCookie, form: Dict[str, str]) -> FakeResponse:
+        headers = [HTML_TYPE]
+        if 'PHPSESSID' not in cookie:
+            headers.append(('Set-Cookie', f'PHPSESSID={secrets.token_hex(16)}; path=/'))
+
+        if method == 'GET':
+            return 200, headers, b'<html><body><form method="post">GlobalProtect Portal</form></body></html>'
+
+        username = form.get('user', '')
+        if not self.__check_password(username, form.get('passwd', '')):
+            return 200, headers, b'<html><body>Authentication failed: Invalid username or password</body></html>'
+
+        token = secrets.token_hex(16)
+        with self.__sessions_lock:
+            self.__vpn_sessions[token] = username
+            self.vpn_logins += 1
+        headers.append(('Set-Cookie', f'GP_SESSION_CK={token}; path=/'))
+        content = f'<html><body>{html.escape(username)}，欢迎使用 WebVPN。<a href="#">客户端下载</a></body></html>'
+        return 200, headers, content.encode(UNIFIED_ENCODING)
+
+    def __ecard_login(self, method: str, form: Dict[str, str]) -> FakeResponse:
+        if method == 'GET':
+            return self.__page('用户登录', '''
+<a href="Login.aspx">用户登录</a>
+<input name="txtUserName" type="text" id="txtUserName" />
+<input name="txtPassword" type="password" id="txtPassword" />
+<input type="submit" name="btnLogin" value="登录" id="btnLogin" />''')
+
+        username = form.get('txtUserName', '')
+        if not self.__check_password(username, form.get('txtPassword', '')):
+            return self.__page('用户登录', '<script>alert("账户或密码错误")</script>')
+
+        token = secrets.token_hex(12)
+        with self.__sessions_lock:
+            self.__ecard_sessions[token] = username
+        return 302, [('Location', ECARD_PREFIX + 'User/Index.aspx'),
+                     ('Set-Cookie', f'ASP.NET_SessionId={token}; path=/')], b''
+
+    def __base_info(self, username: str) -> FakeResponse:
+        return self.__page('个人信息', f'''
+<h2>个 人 基 本 信 息</h2>
+<span id="ContentPlaceHolder1_txtOutID">{html.escape(username)}</span>
+<span id="ContentPlaceHolder1_txtUserName">测试用户</span>
+<span id="ContentPlaceHolder1_txtCardSF">本科生</span>''')
+
+    def __consume_info(self, method: str, username: str, form: Dict[str, str]) -> FakeResponse:
+        state = self.__load_viewstate(form.get('__VIEWSTATE', ''))
+        today = datetime.now(tz_beijing).strftime('%Y-%m-%d')
+        begin = form.get('ctl00$ContentPlaceHolder1$txtStartDate', today)
+        end = form.get('ctl00$ContentPlaceHolder1$txtEndDate', today)
+
+        rows: Optional[List[Transaction]] = None
+        if method == 'POST':
+            if form.get('__EVENTTARGET') == SORT_BUTTON_TARGET:
+                state['desc'] = not state['desc']
+            try:
+                begin_ts = date_to_timestamp(begin)
+                end_ts = date_to_timestamp(end) + 24 * 60 * 60
+            except ValueError:
+                begin_ts = end_ts = 0
+            rows = [x for x in self.generator.transactions(username) if begin_ts <= x.op_timestamp < end_ts]
+            rows.sort(key=lambda x: x.op_timestamp, reverse=state['desc'])
+
+        return self.render_consume_info(rows, state, begin, end)
+
+    def render_consume_info(self, rows: Optional[List[Transaction]], state: Dict[str, bool],
+                            begin: str, end: str) -> FakeResponse:
+        """
+        生成“消费信息查询”页面。也可用于在不启动服务器的情况下生成页面，如解析的性能测试。
+        :param rows: 按顺序显示的消费记录；为 None 表示尚未查询，与没有记录时一样显示“未查询到记录！”
+        :param state: 页面状态，{'desc': 是否降序}
+        :param begin: 页面上的起始日期
+        :param end: 页面上的截止日期
+        :return: (状态码, 响应头, 正文)
+        """
+        sort_class = 'SortBt_Desc' if state['desc'] else 'SortBt_Asc'
+        parts = [f'''
+<input name="ctl00$ContentPlaceHolder1$txtStartDate" type="text" value="{begin}" />
+<input name="ctl00$ContentPlaceHolder1$txtEndDate" type="text" value="{end}" />
+<input type="radio" name="ctl00$ContentPlaceHolder1$rbtnType" value="0" checked="checked" />
+<input type="submit" name="ctl00$ContentPlaceHolder1$btnSearch" value="查  询" />
+<table id="ContentPlaceHolder1_gridView" class="gridView">
+<tr class="HeaderStyle"><th>交易时间<input type="submit" name="{SORT_BUTTON_TARGET}" value="" \
+id="ContentPlaceHolder1_gridView_SortBt" class="{sort_class}" /></th><th>科目描述</th><th>交易额</th>\
+<th>余额</th><th>钱包名称</th><th>次数</th><th>终端名称</th></tr>''']
+        if not rows:
+            parts.append('<tr class="gvNoRecords"><td colspan="7">未查询到记录！</td></tr>')
+        else:
+            for x in rows:
+                parts.append(f'<tr><td>{x.op_datetime}</td><td>{html.escape(x.category)}</td>'
+                             f'<td>{x.trans_amount:.2f}</td><td>{x.balance:.2f}</td><td>电子钱包</td>'
+                             f'<td>1</td><td>{html.escape(x.location)}</td></tr>')
+        parts.append('</table>')
+        parts.append(f'<input type="hidden" name="__EVENTVALIDATION" value="{secrets.token_hex(32)}" />')
+
+        return self.__page('消费信息查询', ''.join(parts), state)
+
+    def __load_viewstate(self, viewstate: str) -> Dict[str, bool]:
+        try:
+            return json.loads(base64.b64decode(viewstate.encode('ascii'))[:-self.viewstate_size or None])
+        except ValueError:
+            return {'desc': False}
+
+    def __dump_viewstate(self, state: Dict[str, bool]) -> str:
+        content = json.dumps(state).encode('ascii') + b'x' * self.viewstate_size
+        return base64.b64encode(content).decode('ascii')
+
+    def __page(self, title: str, content: str, state: Optional[Dict[str, bool]] = None) -> FakeResponse:
+        """
+        生成 ecard 网站的页面：菜单、带隐藏字段的 form1 表单，以及页脚。
+        """
+        if state is None:
+            state = {'desc': False}
+        page = f'''<!DOCTYPE html>
+<html><head><meta charset="utf-8" /><title>{title}</title></head><body>
+<div class="menu"><a href='User/ConsumeInfo.aspx'>消费信息查询</a><a href='User/baseinfo.aspx'>个人信息</a></div>
+<form name="aspnetForm" method="post" id="form1">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{self.__dump_viewstate(state)}" />
+{content}
+</form>
+<div class="footer">{'-' * self.footer_size}</div>
+</body></html>'''
+        return 200, [HTML_TYPE], page.encode(UNIFIED_ENCODING)
@@ -0,0 +1,123 @@
+"""
+本文件提供 FakeTransactionGenerator 类，为模拟的 ecard 网站生成消费记录。
+"""
+
+__all__ = ('FakeTransactionGenerator',)
+
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ..popo import Transaction
+from ..util import tz_beijing
+
+# (消费类别, 位置, 最低金额, 最高金额, 权重)；小额的洗澡、热水消费较多，以便触发合并逻辑
+FAKE_SPENDING_KINDS = (
+    ('持卡人消费', '学一食堂', 3.0, 15.0, 30),
+    ('持卡人消费', '学二食堂', 3.0, 15.0, 20),
+    ('持卡人消费', '综合超市', 2.0, 60.0, 10),
+    ('持卡人消费', '西区浴室', 0.1, 0.9, 30),
+    ('持卡人消费', '开水房', 0.1, 0.5, 10),
+)
+
+# 余额低于该值时，视为已在别处充值到 FAKE_TOP_UP_BALANCE（充值记录不出现在消费记录中）
+FAKE_LOW_BALANCE = 20.0
+FAKE_TOP_UP_BALANCE = 300.0
+
+
+def format_ecard_date(timestamp: float) -> str:
+    """
+    将 Unix 时间戳格式化为 ecard 网站的日期格式（北京时间），如 2019/9/12 22:52:18。
+    """
+    dt = datetime.fromtimestamp(timestamp, tz_beijing)
+    return f'{dt.year}/{dt.month}/{dt.day} {dt:%H:%M:%S}'
+
+
+class _AccountData:
+    __slots__ = ('rnd', 'trans', 'next_at', 'balance')
+
+    def __init__(self, rnd: random.Random, next_at: float) -> None:
+        self.rnd = rnd
+        self.trans: List[Transaction] = []
+        # 下一笔消费的时刻
+        self.next_at = next_at
+        self.balance = FAKE_TOP_UP_BALANCE
+
+
+class FakeTransactionGenerator:
+    """
+    为每个账号按泊松过程生成消费记录：平均每小时 rate_per_hour 笔。
+    同一个 seed 与账号名总是生成相同的记录，因此压力测试的结果可以复现。
+    记录在被查询时才按需生成，只保留最近 keep_days 天的记录。线程安全。
+    """
+    __slots__ = ('rate_per_hour', 'seed', 'keep_days', 'stop_at', '__accounts', '__lock')
+
+    def __init__(self, rate_per_hour: float = 2.0, seed: int = 0, keep_days: int = 7) -> None:
+        """
+        :param rate_per_hour: 每个账号平均每小时的消费笔数
+        :param seed: 随机数种子
+        :param keep_days: 保留最近多少天的记录；首次查询某账号时，也会生成这么多天的历史记录
+        """
+        self.rate_per_hour = rate_per_hour
+        self.seed = seed
+        self.keep_days = keep_days
+        # 不为 None 时，该 Unix 时间戳之后不再产生新的消费记录
+        self.stop_at: Optional[float] = None
+        self.__accounts: Dict[str, _AccountData] = dict()
+        self.__lock = threading.Lock()
+
+    def transactions(self, account: str, now: Optional[float] = None) -> List[Transaction]:
+        """
+        返回某账号截至 now 的最近 keep_days 天的消费记录，按时间升序排列。
+        :param account: 账号名（ecard 用户名）
+        :param now: 当前时间的 Unix 时间戳，默认为现在
+        :return: Transaction 的 list
+        """
+        if now is None:
+            now = time.time()
+
+        with self.__lock:
+            data = self.__accounts.get(account)
+            if data is None:
+                rnd = random.Random(f'{self.seed}:{account}')
+                begin = now - self.keep_days * 24 * 60 * 60
+                data = self.__accounts[account] = _AccountData(rnd, begin + self.__interval(rnd))
+
+            self.__extend(data, now)
+            return list(data.trans)
+
+    def __interval(self, rnd: random.Random) -> float:
+        # 泊松过程中相邻两笔消费的时间间隔服从指数分布
+        return rnd.expovariate(self.rate_per_hour / 3600)
+
+    def __extend(self, data: _AccountData, now: float) -> None:
+        rnd = data.rnd
+        until = now if self.stop_at is None else min(now, self.stop_at)
+        while data.next_at <= until:
+            category, location, low, high, __ = rnd.choices(
+                FAKE_SPENDING_KINDS, weights=[x[4] for x in FAKE_SPENDING_KINDS])[0]
+            amount = round(rnd.uniform(low, high), 2)
+            if data.balance - amount < FAKE_LOW_BALANCE:
+                data.balance = FAKE_TOP_UP_BALANCE
+            data.balance = round(data.balance - amount, 2)
+
+            timestamp = int(data.next_at)
+            data.trans.append(Transaction(
+                op_datetime=format_ecard_date(timestamp),
+                category=category,
+                trans_amount=amount,
+                balance=data.balance,
+                location=location,
+                op_timestamp=timestamp,
+            ))
+            data.next_at += self.__interval(rnd)
+
+        # 丢弃过旧的记录
+        oldest = now - self.keep_days * 24 * 60 * 60
+        drop = 0
+        while drop < len(data.trans) and data.trans[drop].op_timestamp < oldest:
+            drop += 1
+        if drop != 0:
+            del data.trans[:drop]
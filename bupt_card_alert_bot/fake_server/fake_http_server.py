@@ -0,0 +1,114 @@
+"""
+本文件提供 FakeHttpServer 类，是各个模拟服务器的基类。
+"""
+
+__all__ = ('FakeHttpServer', 'FakeResponse')
+
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict, List, Optional, Tuple
+
+# (状态码, 响应头, 正文)；响应头为 list，以便设置多个同名的头（如 Set-Cookie）
+FakeResponse = Tuple[int, List[Tuple[str, str]], bytes]
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # Python 3.6 中没有 http.server.ThreadingHTTPServer
+    daemon_threads = True
+
+
+class FakeHttpServer:
+    """
+    在后台线程中运行的小型 HTTP 服务器，用于在本地模拟学校网站与 Telegram，以便进行测试与压力测试。
+    每个请求在处理前会等待 latency 秒，再加上 [0, jitter) 秒的随机时间，以模拟网络与服务器的延迟。
+
+    子类需实现 handle 方法。
+    """
+    __slots__ = ('listen', 'latency', 'jitter', 'requests', '__server', '__thread', '__lock')
+
+    def __init__(self, listen: Tuple[str, int] = ('127.0.0.1', 0),
+                 latency: float = 0.0, jitter: float = 0.0) -> None:
+        """
+        :param listen: 监听的 (主机, 端口)；端口为 0 时由系统分配
+        :param latency: 每个请求的固定延迟（秒）
+        :param jitter: 每个请求的随机延迟的上限（秒）
+        """
+        self.listen = listen
+        self.latency = latency
+        self.jitter = jitter
+        # 已处理的请求数
+        self.requests = 0
+        self.__server: Optional[_ThreadingHTTPServer] = None
+        self.__thread: Optional[threading.Thread] = None
+        self.__lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """
+        服务器的地址，形如 http://127.0.0.1:12345，结尾不含“/”。只能在 start 之后调用。
+        """
+        host, port = self.__server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> FakeResponse:
+        """
+        处理一个请求。
+        :param method: GET 或 POST
+        :param path: 请求的路径（含查询字符串）
+        :param headers: 请求头
+        :param body: 请求的正文
+        :return: (状态码, 响应头, 正文)
+        """
+        raise NotImplementedError
+
+    def start(self) -> None:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                self.__dispatch('GET')
+
+            def do_POST(self) -> None:
+                self.__dispatch('POST')
+
+            def __dispatch(self, method: str) -> None:
+                length = int(self.headers.get('Content-Length', 0))
+                body = self.rfile.read(length) if length > 0 else b''
+
+                delay = fake.latency + (random.uniform(0, fake.jitter) if fake.jitter > 0 else 0)
+                if delay > 0:
+                    time.sleep(delay)
+
+                status, headers, content = fake.handle(method, self.path, dict(self.headers), body)
+                fake._count_request()
+
+                self.send_response(status)
+                for k, v in headers:
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format: str, *args) -> None:
+                # 压力测试时请求很多，不输出访问日志
+                pass
+
+        self.__server = _ThreadingHTTPServer(self.listen, Handler)
+        self.__thread = threading.Thread(target=self.__server.serve_forever,
+                                         name=type(self).__name__, daemon=True)
+        self.__thread.start()
+
+    def _count_request(self) -> None:
+        with self.__lock:
+            self.requests += 1
+
+    def stop(self) -> None:
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__thread.join()
+            self.__server = None
+            self.__thread = None
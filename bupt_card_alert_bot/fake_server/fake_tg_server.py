@@ -0,0 +1,92 @@
+"""
+本文件提供 FakeTelegramServer 类，在本地模拟 Telegram Bot API。
+"""
+
+__all__ = ('FakeTelegramServer',)
+
+import json
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from ..constant import *
+from .fake_http_server import FakeHttpServer, FakeResponse
+
+JSON_TYPE = ('Content-Type', 'application/json')
+
+
+class FakeTelegramServer(FakeHttpServer):
+    """
+    模拟的 Telegram Bot API，支持 TgBotClient 用到的方法：
+        getMe、sendMessage、editMessageText、getUpdates、setWebhook、deleteWebhook。
+    不检查 token；getUpdates 总是在等待 min(timeout, max_poll_seconds) 秒后返回空列表。
+    按 chat 统计收到的消息数，供压力测试使用；keep_texts 时还记录每条消息的内容，供故障注入测试检查遗漏与重复的通知。
+    """
+    __slots__ = ('max_poll_seconds', 'messages', 'texts', '__next_message_id', '__lock')
+
+    def __init__(self, listen: Tuple[str, int] = ('127.0.0.1', 0),
+                 latency: float = 0.0, jitter: float = 0.0, max_poll_seconds: float = 1.0,
+                 keep_texts: bool = False) -> None:
+        """
+        :param listen: 参见 FakeHttpServer
+        :param latency: 参见 FakeHttpServer
+        :param jitter: 参见 FakeHttpServer
+        :param max_poll_seconds: getUpdates 最多等待多久（秒）
+        :param keep_texts: 是否记录 sendMessage 收到的消息内容
+        """
+        super().__init__(listen, latency, jitter)
+        self.max_poll_seconds = max_poll_seconds
+        # chat_id -> 发送与编辑的消息数
+        self.messages: Counter = Counter()
+        # (chat_id, 消息内容) -> 收到的次数；为 None 表示不记录
+        self.texts: Optional[Counter] = Counter() if keep_texts else None
+        self.__next_message_id = 1
+        self.__lock = threading.Lock()
+
+    def handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> FakeResponse:
+        parts = urlsplit(path).path.split('/')
+        if len(parts) != 3 or not parts[1].startswith('bot'):
+            return self.__reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+        api = parts[2]
+
+        if headers.get('Content-Type', '').startswith('application/json') and body:
+            param: Dict[str, Any] = json.loads(body.decode(UNIFIED_ENCODING))
+        else:
+            param = {k: v[0] for k, v in parse_qs(body.decode(UNIFIED_ENCODING)).items()}
+        param = param or dict()
+
+        if api == 'getMe':
+            return self.__ok({'id': 1, 'is_bot': True, 'first_name': 'Fake Bot', 'username': 'fake_bot'})
+        if api == 'getUpdates':
+            time.sleep(min(float(param.get('timeout', 0)), self.max_poll_seconds))
+            return self.__ok([])
+        if api in ('setWebhook', 'deleteWebhook'):
+            return self.__ok(True)
+        if api in ('sendMessage', 'editMessageText'):
+            chat_id = int(param['chat_id'])
+            with self.__lock:
+                self.messages[chat_id] += 1
+                if api == 'sendMessage':
+                    if self.texts is not None:
+                        self.texts[(chat_id, param.get('text', ''))] += 1
+                    message_id = self.__next_message_id
+                    self.__next_message_id += 1
+                else:
+                    message_id = int(param['message_id'])
+            return self.__ok({
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': param.get('text', ''),
+            })
+
+        return self.__reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'})
+
+    def __ok(self, result: Any) -> FakeResponse:
+        return self.__reply(200, {'ok': True, 'result': result})
+
+    @staticmethod
+    def __reply(status: int, content: Dict[str, Any]) -> FakeResponse:
+        return status, [JSON_TYPE], json.dumps(content, ensure_ascii=False).encode(UNIFIED_ENCODING)
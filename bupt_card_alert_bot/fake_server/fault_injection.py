@@ -0,0 +1,296 @@
+"""
+本文件提供 FaultInjectingSession 类，以及故障场景文件的读取函数。
+FaultInjectingSession 是 requests.Session 的子类，可以交给 RetrySession、AccountClient 与 TgBotClient 使用，
+按场景在请求中注入延迟、错误、残缺的正文等故障，用于测量 Bot 从故障中恢复所需的时间。
+"""
+
+__all__ = ('FAULT_KINDS', 'Fault', 'FaultScenario', 'load_fault_scenarios', 'FaultInjectingSession')
+
+import io
+import json
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+from typing import Any, List, Optional, Set
+
+import jsonschema
+import requests
+
+from ..constant import *
+from ..exceptions import AppError
+
+"""
+故障的种类：
+    latency：请求前等待 seconds 秒，然后正常发送；
+    error：连接被重置（抛出 ConnectionError）；
+    hang：半开的连接，等待 seconds 秒（为 0 时等待请求的读取超时时间）后抛出 ReadTimeout；
+    status：返回状态码为 status 的响应，正文为 body；
+    truncate：只返回正文的前 keep（比例）部分，如连接在传输中途断开；
+    drop_cookies：服务器端的会话失效（如 VPN 重置），删除 Session 中名为 cookies 的 Cookie（为空时删除全部），
+                  每个 Session 只在 at 之后的首个匹配的请求上触发一次，然后正常发送请求。
+"""
+FAULT_KINDS = ('latency', 'error', 'hang', 'status', 'truncate', 'drop_cookies')
+
+"""
+一个故障。请求的 URL 包含 match，且发出时刻（相对于 FaultInjectingSession.start）位于 [at, at + duration) 时，
+以 probability 的概率注入。
+"""
+Fault = namedtuple('Fault', [
+    # FAULT_KINDS 之一
+    'kind',
+
+    # URL 中包含该字符串的请求才会受影响；为空时匹配所有请求
+    'match',
+
+    # 故障开始的时刻（秒）与持续的时间（秒）
+    'at',
+    'duration',
+
+    # 每个匹配的请求受影响的概率
+    'probability',
+
+    # latency、hang 等待的秒数
+    'seconds',
+
+    # status 返回的状态码与正文
+    'status',
+    'body',
+
+    # truncate 保留的正文比例
+    'keep',
+
+    # 为 true 时，请求先正常到达服务器，再丢失或损坏响应（error、hang、status），用于模拟“已送达但未收到回复”
+    'pass_through',
+
+    # drop_cookies 要删除的 Cookie 名
+    'cookies',
+])
+
+FAULT_DEFAULTS = {
+    'match': '',
+    'at': 0.0,
+    'duration': 0.0,
+    'probability': 1.0,
+    'seconds': 0.0,
+    'status': 502,
+    'body': '',
+    'keep': 0.5,
+    'pass_through': False,
+    'cookies': (),
+}
+
+"""
+一个故障场景，由若干个故障组成。
+"""
+FaultScenario = namedtuple('FaultScenario', [
+    # 场景名
+    'name',
+
+    # 场景的说明
+    'description',
+
+    # Fault 的 list
+    'faults',
+
+    # 从场景开始起经过多少秒后不再产生新的消费记录；为 None 时一直产生。用于检查故障期间未发送的通知
+    # 是否会在此后表格不再变化时仍被重发
+    'quiet_after',
+])
+
+FAULT_SCENARIOS_SCHEMA = {
+    'type': 'array',
+    'items': {
+        'type': 'object',
+        'properties': {
+            'name': {'type': 'string', 'minLength': 1},
+            'description': {'type': 'string'},
+            'quiet_after': {'type': 'number', 'minimum': 0},
+            'faults': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'kind': {'enum': list(FAULT_KINDS)},
+                        'match': {'type': 'string'},
+                        'at': {'type': 'number', 'minimum': 0},
+                        'duration': {'type': 'number', 'minimum': 0},
+                        'probability': {'type': 'number', 'minimum': 0, 'maximum': 1},
+                        'seconds': {'type': 'number', 'minimum': 0},
+                        'status': {'type': 'integer', 'minimum': 100, 'maximum': 599},
+                        'body': {'type': 'string'},
+                        'keep': {'type': 'number', 'minimum': 0, 'maximum': 1},
+                        'pass_through': {'type': 'boolean'},
+                        'cookies': {'type': 'array', 'items': {'type': 'string'}},
+                    },
+                    'required': ['kind'],
+                    'additionalProperties': False,
+                },
+            },
+        },
+        'required': ['name', 'faults'],
+        'additionalProperties': False,
+    },
+}
+
+
+def load_fault_scenarios(file_path: str) -> List[FaultScenario]:
+    """
+    读取并验证故障场景文件。文件内容为 JSON 数组，每个元素形如：
+        {"name": "vpn-reset", "description": "...", "faults": [{"kind": "drop_cookies", "at": 10, ...}]}
+    故障中省略的字段取 FAULT_DEFAULTS 中的默认值；场景可另有 quiet_after 字段，参见 FaultScenario。
+    :param file_path: 文件路径
+    :return: FaultScenario 的 list
+    """
+    try:
+        with open(file_path, 'r', encoding=UNIFIED_ENCODING) as f:
+            content = json.load(f)
+    except (OSError, ValueError) as e:
+        raise AppError(f'故障场景文件 {file_path} 读取失败。') from e
+
+    try:
+        jsonschema.validate(content, FAULT_SCENARIOS_SCHEMA)
+    except jsonschema.ValidationError as e:
+        raise AppError(f'故障场景文件 {file_path} 格式错误：{e.message}') from e
+
+    return [
+        FaultScenario(
+            name=x['name'],
+            description=x.get('description', ''),
+            faults=[Fault(**dict(FAULT_DEFAULTS, **y))._replace(cookies=tuple(y.get('cookies', ())))
+                    for y in x['faults']],
+            quiet_after=x.get('quiet_after', None),
+        )
+        for x in content
+    ]
+
+
+def replace_body(resp: requests.Response, body: bytes) -> requests.Response:
+    """
+    生成一个与 resp 相同、但正文为 body 的响应。正文通过 raw 提供，因此 stream=True 的读取方式同样适用。
+    """
+    res = requests.Response()
+    res.status_code = resp.status_code
+    res.reason = resp.reason
+    res.headers = resp.headers
+    res.url = resp.url
+    res.encoding = resp.encoding
+    res.history = resp.history
+    res.cookies = resp.cookies
+    res.elapsed = resp.elapsed
+    res.request = resp.request
+    res.raw = io.BytesIO(body)
+    return res
+
+
+class FaultInjectingSession(requests.Session):
+    """
+    按故障列表在请求中注入故障的 Session。重定向由 requests 在内部处理，因此每个逻辑请求只判断一次。
+    调用 start 之前不注入任何故障，以便先完成登录等准备工作。线程安全。
+    """
+    __slots__ = ('faults', 'started_at', 'requests_sent', 'injected', '__rnd', '__fired', '__lock')
+
+    def __init__(self, faults: List[Fault], seed: Any = None) -> None:
+        """
+        :param faults: 要注入的故障
+        :param seed: 决定是否注入故障的随机数种子，相同的种子得到相同的结果
+        """
+        super().__init__()
+        self.faults = faults
+        # 故障时刻的起点（time.monotonic()）；为 None 时不注入故障
+        self.started_at: Optional[float] = None
+        # 发出的请求数，包括被注入故障的请求
+        self.requests_sent = 0
+        # 故障种类 -> 注入的次数
+        self.injected: Counter = Counter()
+
+        self.__rnd = random.Random(seed)
+        # 已经触发过的一次性故障（drop_cookies）的下标
+        self.__fired: Set[int] = set()
+        self.__lock = threading.Lock()
+
+    def start(self, started_at: Optional[float] = None) -> None:
+        """
+        开始计时，此后按各故障的 at、duration 注入故障。
+        :param started_at: 起点（time.monotonic()），默认为现在；多个 Session 应使用同一个起点
+        :return: None
+        """
+        self.started_at = time.monotonic() if started_at is None else started_at
+
+    def __active_faults(self, url: str) -> List[Fault]:
+        """
+        找出本次请求要注入的故障，并更新计数。
+        """
+        with self.__lock:
+            self.requests_sent += 1
+            if self.started_at is None:
+                return []
+
+            elapsed = time.monotonic() - self.started_at
+            res = []
+            for i, fault in enumerate(self.faults):
+                if fault.match not in url or elapsed < fault.at:
+                    continue
+                if fault.kind == 'drop_cookies':
+                    if i in self.__fired:
+                        continue
+                    self.__fired.add(i)
+                elif elapsed >= fault.at + fault.duration:
+                    continue
+                if self.__rnd.random() < fault.probability:
+                    self.injected[fault.kind] += 1
+                    res.append(fault)
+            return res
+
+    def request(self, method: str, url: str, *args: Any, **kwargs: Any) -> requests.Response:
+        # 在请求之前生效的故障：latency、drop_cookies，以及未设置 pass_through 的 error、hang、status
+        after = []
+        for fault in self.__active_faults(url):
+            if fault.kind == 'latency':
+                time.sleep(fault.seconds)
+            elif fault.kind == 'drop_cookies':
+                for c in list(self.cookies):
+                    if not fault.cookies or c.name in fault.cookies:
+                        self.cookies.clear(c.domain, c.path, c.name)
+            elif fault.kind == 'truncate' or fault.pass_through:
+                after.append(fault)
+            else:
+                return self.__inject(fault, method, url, kwargs.get('timeout'))
+
+        resp = super().request(method, url, *args, **kwargs)
+
+        # 在请求之后生效的故障
+        for fault in after:
+            if fault.kind == 'truncate':
+                content = resp.content
+                resp = replace_body(resp, content[:int(len(content) * fault.keep)])
+            else:
+                resp.close()
+                return self.__inject(fault, method, url, kwargs.get('timeout'))
+        return resp
+
+    @staticmethod
+    def __inject(fault: Fault, method: str, url: str, timeout: Any) -> requests.Response:
+        """
+        注入 error、hang 或 status 故障：前两者抛出异常，status 返回错误的响应。
+        """
+        if fault.kind == 'error':
+            raise requests.ConnectionError(f'{method} {url}: Connection reset by peer (injected)')
+
+        if fault.kind == 'hang':
+            if fault.seconds > 0:
+                seconds = fault.seconds
+            elif isinstance(timeout, tuple):
+                seconds = timeout[1]
+            else:
+                seconds = timeout if timeout is not None else DEFAULT_REQ_TIMEOUT[1]
+            time.sleep(seconds)
+            raise requests.ReadTimeout(f'{method} {url}: Read timed out (injected)')
+
+        resp = requests.Response()
+        resp.status_code = fault.status
+        resp.url = url
+        resp.encoding = UNIFIED_ENCODING
+        resp.headers['Content-Type'] = 'text/html; charset=utf-8'
+        resp.raw = io.BytesIO(fault.body.encode(UNIFIED_ENCODING))
+        return resp
@@ -1,2 +1,3 @@
 from .popos import *
 from .session_keeper import *
+from .transaction_log import *
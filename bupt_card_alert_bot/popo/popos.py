@@ -1,6 +1,10 @@
 __all__ = (
     'EcardUserInfo',
     'Transaction',
+    'AccountConfig',
+    'AlertRule',
+    'ConsumePage',
+    'TagRule',
 )
 from collections import namedtuple
 
@@ -40,3 +44,71 @@ Transaction = namedtuple('Transaction', [
     # 操作时间 - Unix 时间戳,
     'op_timestamp',
 ])
+
+"""
+一个要监控的校园卡账号的配置。
+"""
+AccountConfig = namedtuple('AccountConfig', [
+    # 账号名，用于租约、日志等；默认为 ecard 用户名
+    'name',
+
+    # vpn.bupt.edu.cn 的用户名/密码
+    'vpn_username',
+    'vpn_password',
+
+    # ecard.bupt.edu.cn 的用户名/密码
+    'ecard_username',
+    'ecard_password',
+
+    # 接收该账号消费通知的 chat id 列表；为 None 时使用全局的接收者
+    'chat_ids',
+])
+
+"""
+一条提醒规则，参见 AlertEngine。
+"""
+AlertRule = namedtuple('AlertRule', [
+    # 规则名，用于去重，不能重复
+    'name',
+
+    # 规则类型：daily-spend、weekly-spend 或 low-balance
+    'type',
+
+    # 阈值（元）
+    'threshold',
+
+    # 只统计该位置（终端名称）的消费；为 None 时统计所有消费
+    'location',
+
+    # 只统计带有该标签的消费（参见 TagEngine）；为 None 时统计所有消费。不能与 location 同时使用
+    'tag',
+
+    # 统计值回落到该值后才能再次提醒；为 None 时与 threshold 相同
+    'rearm',
+])
+
+"""
+“消费信息查询”页面的解析结果，参见 parse_consume_page。
+只含解析出的少量数据，不引用 DOM 树，因此可以廉价地在进程之间传递。
+"""
+ConsumePage = namedtuple('ConsumePage', [
+    # 消费记录，Transaction 的 tuple
+    'transactions',
+
+    # “操作时间”上的排序按钮是否处于降序状态；找不到按钮时为 None
+    'sort_desc',
+])
+
+"""
+一条标签规则，参见 TagEngine。
+"""
+TagRule = namedtuple('TagRule', [
+    # 标签名，如 canteen、shower
+    'tag',
+
+    # 正则表达式，在 field 中找到匹配时，为消费记录加上该标签
+    'pattern',
+
+    # 匹配的字段：location（终端名称）、category（科目描述）或 any（两者之一）
+    'field',
+])
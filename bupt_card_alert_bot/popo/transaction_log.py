@@ -0,0 +1,60 @@
+__all__ = ('TransactionLog',)
+
+import heapq
+from typing import Iterable, Iterator, List, Set, Tuple
+
+from .popos import Transaction
+
+
+class TransactionLog:
+    """
+    “已经发送过通知的消费记录”的集合，同时按 op_timestamp 维护一个最小堆。
+    判断某条记录是否存在的时间复杂度为 O(1)；
+    drop_before 只弹出过期的记录，时间复杂度为 O(过期记录数 * log n)，不再需要每次遍历、重建整个集合。
+    """
+    __slots__ = ('__members', '__heap')
+
+    def __init__(self, trans: Iterable[Transaction] = ()) -> None:
+        """
+        :param trans: 初始的消费记录，如 TransactionDao 中持久化的记录
+        """
+        self.__members: Set[Transaction] = set(trans)
+        self.__heap: List[Tuple[int, Transaction]] = [(x.op_timestamp, x) for x in self.__members]
+        heapq.heapify(self.__heap)
+
+    def __contains__(self, trans: Transaction) -> bool:
+        return trans in self.__members
+
+    def __len__(self) -> int:
+        return len(self.__members)
+
+    def __iter__(self) -> Iterator[Transaction]:
+        return iter(self.__members)
+
+    def add(self, trans: Transaction) -> None:
+        if trans not in self.__members:
+            self.__members.add(trans)
+            heapq.heappush(self.__heap, (trans.op_timestamp, trans))
+
+    def update(self, trans: Iterable[Transaction]) -> None:
+        for x in trans:
+            self.add(x)
+
+    def drop_before(self, timestamp: int) -> int:
+        """
+        删除时间戳早于 timestamp 的消费记录。
+        :param timestamp: Unix 时间戳
+        :return: 删除的记录数
+        """
+        heap = self.__heap
+        dropped = 0
+        while heap and heap[0][0] < timestamp:
+            self.__members.discard(heapq.heappop(heap)[1])
+            dropped += 1
+        return dropped
+
+    def snapshot(self) -> List[Transaction]:
+        """
+        按时间顺序导出所有消费记录，用于持久化或交给其他节点。
+        """
+        return [x for __, x in sorted(self.__heap)]
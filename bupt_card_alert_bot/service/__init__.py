@@ -1,2 +1,8 @@
 from .logger_service import *
 from .transaction_service import *
+from .memory_service import *
+from .export_service import *
+from .supervisor_service import *
+from .alert_service import *
+from .backfill_service import *
+from .tag_service import *
@@ -0,0 +1,215 @@
+__all__ = ('ALERT_RULE_TYPES', 'RollingSum', 'AlertEngine')
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from ..constant import *
+from ..popo import AlertRule, Transaction
+
+# 规则类型 -> 统计窗口的天数；low-balance 不需要窗口
+ALERT_RULE_TYPES = {
+    'daily-spend': 1,
+    'weekly-spend': 7,
+    'low-balance': 0,
+}
+
+
+def beijing_day(timestamp: int) -> int:
+    """
+    返回 Unix 时间戳所在的北京时间日期的序号（自 1970-01-01 起的天数）。
+    """
+    return (timestamp + 8 * 60 * 60) // (24 * 60 * 60)
+
+
+def to_cents(amount: float) -> int:
+    # 以分为单位累加整数，避免浮点数的累计误差
+    return int(round(amount * 100))
+
+
+class RollingSum:
+    """
+    按天分桶的环形缓冲区，维护最近 days 天（含当天）中每天以及总共的消费金额。
+    每加入一笔消费的时间复杂度为 O(1)（跨越多天时，最多清空 days 个桶）。
+    """
+    __slots__ = ('days', '__buckets', '__newest_day', '__total')
+
+    def __init__(self, days: int = ALERT_WINDOW_DAYS) -> None:
+        self.days = days
+        self.__buckets = [0] * days
+        self.__newest_day = 0
+        self.__total = 0
+
+    def advance(self, day: int) -> None:
+        """
+        将窗口推进到 day，清空移出窗口的桶。
+        """
+        if day <= self.__newest_day:
+            return
+
+        for d in range(max(self.__newest_day + 1, day - self.days + 1), day + 1):
+            i = d % self.days
+            self.__total -= self.__buckets[i]
+            self.__buckets[i] = 0
+        self.__newest_day = day
+
+    def add(self, day: int, cents: int) -> None:
+        """
+        在 day 当天加入 cents 分。早于窗口的消费将被忽略。
+        """
+        self.advance(day)
+        if day <= self.__newest_day - self.days:
+            return
+        self.__buckets[day % self.days] += cents
+        self.__total += cents
+
+    def sum(self, day: int, days: int) -> int:
+        """
+        返回截至 day 当天、最近 days 天的消费之和（分）。days 只能为 1 或 self.days。
+        """
+        self.advance(day)
+        if days == 1:
+            return self.__buckets[day % self.days] if day == self.__newest_day else 0
+        return self.__total
+
+    def to_json(self) -> List[Any]:
+        return [self.__newest_day, list(self.__buckets)]
+
+    @classmethod
+    def from_json(cls, content: List[Any]) -> 'RollingSum':
+        res = cls(len(content[1]))
+        res.__newest_day = content[0]
+        res.__buckets = list(content[1])
+        res.__total = sum(res.__buckets)
+        return res
+
+
+class AlertEngine:
+    """
+    根据配置文件中的规则，对每一笔新的消费记录增量地维护统计值，并判断是否需要提醒用户：
+        daily-spend：当天（北京时间）的消费之和超过 threshold；
+        weekly-spend：最近 7 天（含当天）的消费之和超过 threshold；
+        low-balance：余额低于 threshold。
+    规则可以用 location 限定只统计某个位置的消费，或用 tag 限定只统计带有某个标签的消费（参见 TagEngine）。
+
+    每条规则提醒一次后即“解除”，直到统计值回落（消费之和不超过 rearm，或余额不低于 rearm，rearm 默认为 threshold）
+    才重新“待命”，因此同一件事不会反复提醒。统计值与待命状态可以通过 dump 持久化，重启后不会重复提醒。
+    """
+    __slots__ = ('rules', '__total', '__by_location', '__by_tag', '__armed')
+
+    def __init__(self, rules: Iterable[AlertRule] = (), state: Optional[Dict[str, Any]] = None) -> None:
+        """
+        :param rules: 规则
+        :param state: dump 的返回值，用于恢复重启前的状态
+        """
+        self.rules: List[AlertRule] = list(rules)
+        self.__total = RollingSum()
+        self.__by_location: Dict[str, RollingSum] = dict()
+        self.__by_tag: Dict[str, RollingSum] = dict()
+        # 规则名 -> 是否待命；不在其中的规则视为待命
+        self.__armed: Dict[str, bool] = dict()
+
+        if state:
+            self.load(state)
+
+    def load(self, state: Dict[str, Any]) -> None:
+        """
+        以 dump 的返回值替换统计值与待命状态，如发送失败后回退到 feed 之前的状态。
+        :param state: dump 的返回值
+        :return: None
+        """
+        self.__total = RollingSum.from_json(state['total'])
+        self.__by_location = {k: RollingSum.from_json(v) for k, v in state['by_location'].items()}
+        self.__by_tag = {k: RollingSum.from_json(v) for k, v in state.get('by_tag', {}).items()}
+        self.__armed = dict(state['armed'])
+
+    def set_rules(self, rules: Iterable[AlertRule]) -> None:
+        """
+        替换规则。同名规则保留其待命状态，已删除的规则的状态将被丢弃。
+        """
+        self.rules = list(rules)
+        names = {x.name for x in self.rules}
+        self.__armed = {k: v for k, v in self.__armed.items() if k in names}
+
+    def __value(self, rule: AlertRule, day: int, balance: Optional[float]) -> float:
+        if rule.type == 'low-balance':
+            return balance
+        if rule.location is not None:
+            agg = self.__by_location.get(rule.location)
+        elif rule.tag is not None:
+            agg = self.__by_tag.get(rule.tag)
+        else:
+            agg = self.__total
+        return 0.0 if agg is None else agg.sum(day, ALERT_RULE_TYPES[rule.type]) / 100
+
+    def feed(self, trans: Transaction, tags: Sequence[str] = ()) -> List[str]:
+        """
+        加入一笔新的消费记录，返回需要发送给用户的提醒。
+        同一笔消费记录只能加入一次；多笔记录应按时间顺序加入。
+        :param trans: Transaction 对象
+        :param tags: 该消费记录的标签，如 TagEngine.tags 的返回值
+        :return: 提醒的文本，可能为空 list
+        """
+        day = beijing_day(trans.op_timestamp)
+        rules = [x for x in self.rules
+                 if (x.location is None or x.location == trans.location) and (x.tag is None or x.tag in tags)]
+
+        # 加入本笔消费之前，统计值已经回落的规则重新待命（如已经过了一天）
+        for rule in rules:
+            if rule.type != 'low-balance':
+                rearm = rule.rearm if rule.rearm is not None else rule.threshold
+                if self.__value(rule, day, None) <= rearm:
+                    self.__armed[rule.name] = True
+
+        cents = to_cents(trans.trans_amount)
+        self.__total.add(day, cents)
+        self.__by_location.setdefault(trans.location, RollingSum()).add(day, cents)
+        for tag in tags:
+            self.__by_tag.setdefault(tag, RollingSum()).add(day, cents)
+
+        res = []
+        for rule in rules:
+            value = self.__value(rule, day, trans.balance)
+            if rule.type == 'low-balance':
+                rearm = rule.rearm if rule.rearm is not None else rule.threshold
+                if value >= rearm:
+                    self.__armed[rule.name] = True
+                    continue
+                fired = value < rule.threshold
+            else:
+                fired = value > rule.threshold
+
+            if fired and self.__armed.get(rule.name, True):
+                self.__armed[rule.name] = False
+                res.append(format_rule_alert(rule, value))
+
+        return res
+
+    def dump(self) -> Dict[str, Any]:
+        """
+        导出统计值与各规则的待命状态。
+        :return: 可以被 JSON 序列化的 dict
+        """
+        return {
+            'total': self.__total.to_json(),
+            'by_location': {k: v.to_json() for k, v in self.__by_location.items()},
+            'by_tag': {k: v.to_json() for k, v in self.__by_tag.items()},
+            'armed': dict(self.__armed),
+        }
+
+
+def format_rule_alert(rule: AlertRule, value: float) -> str:
+    """
+    生成规则被触发时发送给用户的提醒的内容（HTML 格式）。
+    """
+    if rule.location is not None:
+        where = f'在 {rule.location} '
+    elif rule.tag is not None:
+        where = f'在 [{rule.tag}] '
+    else:
+        where = ''
+    if rule.type == 'low-balance':
+        head = f'校园卡余额 {value:.2f} 元，低于 {rule.threshold:.2f} 元'
+    elif rule.type == 'daily-spend':
+        head = f'今天{where}已消费 {value:.2f} 元，超过 {rule.threshold:.2f} 元'
+    else:
+        head = f'最近 7 天{where}已消费 {value:.2f} 元，超过 {rule.threshold:.2f} 元'
+    return f'<b>[提醒] {head}</b>\n（规则：{rule.name}）'
@@ -0,0 +1,113 @@
+__all__ = ('split_date_range', 'Backfiller')
+
+import logging as pym_logging
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Set, Tuple
+
+from ..constant import *
+from ..popo import Transaction
+
+logger = pym_logging.getLogger(__name__)
+
+# (起始日期, 截止日期)，形如 2000-01-01，两端都包含
+DateChunk = Tuple[str, str]
+
+
+def split_date_range(since: str, until: str, chunk_days: int = DEFAULT_BACKFILL_CHUNK_DAYS) -> List[DateChunk]:
+    """
+    将 [since, until] 按 chunk_days 天切分为若干个互不重叠的日期区间，从新到旧排列。
+    :param since: 起始日期（含），形如 2000-01-01
+    :param until: 截止日期（含），形如 2000-01-01
+    :param chunk_days: 每个区间的天数
+    :return: DateChunk 的 list
+    """
+    if chunk_days <= 0:
+        raise ValueError('chunk_days 应该大于 0')
+
+    begin = datetime.strptime(since, '%Y-%m-%d')
+    end = datetime.strptime(until, '%Y-%m-%d')
+    res = []
+    while end >= begin:
+        chunk_begin = max(begin, end - timedelta(days=chunk_days - 1))
+        res.append((chunk_begin.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')))
+        end = chunk_begin - timedelta(days=1)
+    return res
+
+
+class Backfiller:
+    """
+    用多个各自登录的会话并发地查询一段较长时间内的消费记录。
+
+    ecard 网站的查询依赖有状态的 ASP.NET 会话，同一个会话只能串行地查询。
+    本类为每个会话启动一个工作线程，从共享的队列中领取日期区间并查询；
+    各会话应共享同一个 HostRateLimiter，因此总的请求速率仍受全局限流约束。
+    查询结果交回调用 run 的线程处理（如写入 SQLite），因此 on_chunk 不必是线程安全的。
+    """
+    __slots__ = ('fetchers', 'max_attempts')
+
+    def __init__(self, fetchers: List[Callable[[DateChunk], Set[Transaction]]],
+                 max_attempts: int = BACKFILL_MAX_ATTEMPTS) -> None:
+        """
+        :param fetchers: 每个函数对应一个独立的会话，查询某个日期区间内的消费记录，失败时抛出异常；
+                         如 lambda chunk: client.fetch_transactions(lookup_date=chunk)
+        :param max_attempts: 每个日期区间最多尝试的次数
+        """
+        if not fetchers:
+            raise ValueError('fetchers 不能为空')
+
+        self.fetchers = fetchers
+        self.max_attempts = max_attempts
+
+    def run(self, chunks: List[DateChunk],
+            on_chunk: Callable[[DateChunk, Set[Transaction]], None]) -> List[DateChunk]:
+        """
+        查询所有日期区间，每完成一个区间，就在当前线程中调用一次 on_chunk。
+        :param chunks: 要查询的日期区间
+        :param on_chunk: 回调函数，参数为 (日期区间, 该区间内的消费记录)
+        :return: 尝试 max_attempts 次后仍失败的日期区间
+        """
+        todo: 'queue.Queue[Tuple[DateChunk, int]]' = queue.Queue()
+        for chunk in chunks:
+            todo.put((chunk, 1))
+
+        # (日期区间, 消费记录)；消费记录为 None 表示该区间最终失败
+        results: 'queue.Queue[Tuple[DateChunk, Optional[Set[Transaction]]]]' = queue.Queue()
+
+        def work(fetch: Callable[[DateChunk], Set[Transaction]]) -> None:
+            while True:
+                try:
+                    chunk, attempt = todo.get_nowait()
+                except queue.Empty:
+                    return
+
+                try:
+                    trans = fetch(chunk)
+                except Exception as e:
+                    # 失败的区间放回队列，可能由其它会话重试；不能让异常结束工作线程，否则 run 将永远等待其结果
+                    logger.warning(f'补录 {chunk[0]} ~ {chunk[1]} 第 {attempt} 次失败：{e}')
+                    if attempt < self.max_attempts:
+                        todo.put((chunk, attempt + 1))
+                    else:
+                        results.put((chunk, None))
+                    continue
+                results.put((chunk, trans))
+
+        threads = [threading.Thread(target=work, args=(x,), name=f'backfill-{i}', daemon=True)
+                   for i, x in enumerate(self.fetchers)]
+        for t in threads:
+            t.start()
+
+        # 失败的区间会被放回队列，因此每个区间恰好产生一个结果
+        failed = []
+        for __ in range(len(chunks)):
+            chunk, trans = results.get()
+            if trans is None:
+                failed.append(chunk)
+            else:
+                on_chunk(chunk, trans)
+
+        for t in threads:
+            t.join()
+        return failed
@@ -0,0 +1,103 @@
+__all__ = ('EXPORT_FORMATS', 'export_records')
+
+import csv
+import json
+from itertools import islice
+from typing import Iterable, Iterator, Tuple, Dict, Any, Callable, List
+
+from ..constant import *
+from ..exceptions import AppError
+from ..popo import Transaction
+
+# 导出文件的列，account 在最前，tags 在最后，其余与 Transaction 的字段一致
+EXPORT_COLUMNS = ('account',) + Transaction._fields + ('tags',)
+
+
+def records_to_dicts(records: Iterable[Tuple[str, Transaction, str]]) -> Iterator[Dict[str, Any]]:
+    """
+    将 (账号, Transaction, 标签) 逐条转换为 dict。
+    :param records: HistoryDao.iter_records 的返回值
+    :return: 生成器，元素为 dict
+    """
+    for account, trans, tags in records:
+        row = {'account': account}
+        row.update(zip(Transaction._fields, trans))
+        row['tags'] = tags
+        yield row
+
+
+def write_csv(rows: Iterator[Dict[str, Any]], out_path: str) -> int:
+    count = 0
+    with open(out_path, 'w', encoding=UNIFIED_ENCODING, newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_jsonl(rows: Iterator[Dict[str, Any]], out_path: str) -> int:
+    count = 0
+    with open(out_path, 'w', encoding=UNIFIED_ENCODING) as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    return count
+
+
+def write_parquet(rows: Iterator[Dict[str, Any]], out_path: str) -> int:
+    """
+    以列式的 Parquet 格式写出。每 EXPORT_BATCH_SIZE 条写一个 row group，内存占用与记录总数无关。
+    需要安装 pyarrow。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise AppError('导出 Parquet 格式需要安装 pyarrow：pip install pyarrow')
+
+    schema = pa.schema([
+        ('account', pa.string()),
+        ('op_datetime', pa.string()),
+        ('category', pa.string()),
+        ('trans_amount', pa.float64()),
+        ('balance', pa.float64()),
+        ('location', pa.string()),
+        ('op_timestamp', pa.int64()),
+        ('tags', pa.string()),
+    ])
+
+    count = 0
+    with pq.ParquetWriter(out_path, schema) as writer:
+        while True:
+            batch: List[Dict[str, Any]] = list(islice(rows, EXPORT_BATCH_SIZE))
+            if not batch:
+                break
+            columns = {name: [x[name] for x in batch] for name in EXPORT_COLUMNS}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            count += len(batch)
+    return count
+
+
+# 导出格式名 -> 写出函数
+EXPORT_FORMATS: Dict[str, Callable[[Iterator[Dict[str, Any]], str], int]] = {
+    'csv': write_csv,
+    'jsonl': write_jsonl,
+    'parquet': write_parquet,
+}
+
+
+def export_records(records: Iterable[Tuple[str, Transaction, str]], fmt: str, out_path: str) -> int:
+    """
+    将历史记录以流的方式导出到文件：记录逐条（或逐批）从生成器中取出并写出，不会整体载入内存。
+    :param records: 元素为 (账号, Transaction, 标签)，如 HistoryDao.iter_records 的返回值
+    :param fmt: 导出格式，EXPORT_FORMATS 的键之一
+    :param out_path: 导出文件的路径
+    :return: 导出的记录条数
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise AppError(f'不支持的导出格式 {fmt}。')
+
+    return EXPORT_FORMATS[fmt](records_to_dicts(records), out_path)
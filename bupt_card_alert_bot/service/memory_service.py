@@ -0,0 +1,119 @@
+__all__ = ('get_rss_bytes', 'tune_gc_after_startup', 'MemoryMonitor')
+
+import gc
+import logging as pym_logging
+import os
+import tracemalloc
+from typing import Optional
+
+from ..constant import *
+
+logger = pym_logging.getLogger(__name__)
+
+
+def get_rss_bytes() -> Optional[int]:
+    """
+    获取当前进程的常驻内存（RSS）大小。
+    Linux 下读取 /proc/self/statm；其它系统退而使用 resource 模块提供的历史峰值。
+    :return: 字节数；无法获取时返回 None
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # macOS 的单位为字节，Linux 等为 KiB
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+
+def tune_gc_after_startup() -> None:
+    """
+    在启动（登录等）完成后调整 GC：
+    先完整回收一次，再将此时存活的对象移入永久代（gc.freeze，Python 3.7+），
+    使之后的每次 GC 都不再扫描这些长期存活的对象；并调高第 0 代的阈值，减少 GC 次数。
+    :return: None
+    """
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    gc.set_threshold(*GC_THRESHOLD)
+    logger.debug(f'GC 已调整：threshold = {gc.get_threshold()}, '
+                 f'frozen = {gc.get_freeze_count() if hasattr(gc, "get_freeze_count") else "N/A"}')
+
+
+class MemoryMonitor:
+    """
+    长时间运行的服务器的内存统计。
+    每调用 every 次 tick 方法，就在日志中记录一次 RSS；
+    若开启了 trace，还会记录 tracemalloc 统计的前 top_n 个分配最多的代码行，以及与上一次快照相比增长最多的代码行。
+    """
+    __slots__ = ('trace', 'every', 'top_n', '__ticks', '__last_snapshot', '__first_rss')
+
+    def __init__(self, trace: bool = False, every: int = MEMORY_REPORT_EVERY,
+                 top_n: int = MEMORY_REPORT_TOP_N) -> None:
+        """
+        初始化内存统计。trace 为真时立即开始 tracemalloc 追踪（会带来一定的性能开销）。
+        :param trace: 是否使用 tracemalloc 追踪内存分配
+        :param every: 每隔多少次 tick 记录一次
+        :param top_n: 记录前多少个代码行
+        """
+        if every <= 0 or top_n <= 0:
+            raise ValueError('every 与 top_n 都应该大于 0')
+
+        self.trace = trace
+        self.every = every
+        self.top_n = top_n
+        self.__ticks = 0
+        self.__last_snapshot = None
+        self.__first_rss = get_rss_bytes()
+
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def tick(self) -> None:
+        """
+        在主循环每次执行时调用。
+        :return: None
+        """
+        self.__ticks += 1
+        if self.__ticks % self.every == 0:
+            self.report()
+
+    def report(self) -> None:
+        """
+        立即在日志中记录一次内存统计。
+        :return: None
+        """
+        rss = get_rss_bytes()
+        if rss is not None:
+            growth = '' if self.__first_rss is None else f', {(rss - self.__first_rss) / 2 ** 20:+.1f} MiB since start'
+            logger.info(f'Memory: RSS {rss / 2 ** 20:.1f} MiB{growth}, '
+                        f'gc counts {gc.get_count()}, loops {self.__ticks}')
+
+        if not self.trace:
+            return
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+
+        lines = [f'tracemalloc: current {current / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB. Top {self.top_n}:']
+        for stat in snapshot.statistics('lineno')[:self.top_n]:
+            lines.append(f'    {stat}')
+
+        if self.__last_snapshot is not None:
+            lines.append('Top growth since last report:')
+            for stat in snapshot.compare_to(self.__last_snapshot, 'lineno')[:self.top_n]:
+                lines.append(f'    {stat}')
+
+        self.__last_snapshot = snapshot
+        logger.debug('\n'.join(lines))
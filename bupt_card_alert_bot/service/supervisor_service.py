@@ -0,0 +1,108 @@
+__all__ = ('classify_failure', 'Supervisor')
+
+import logging as pym_logging
+import random
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from ..constant import *
+from ..exceptions import AppAuthError, AppNetworkError, AppParseError
+
+logger = pym_logging.getLogger(__name__)
+
+
+def classify_failure(e: BaseException) -> str:
+    """
+    将异常归类，返回 SUPERVISOR_BACKOFF 的键之一。
+    :param e: server 函数抛出的异常
+    :return: 'auth'、'network'、'parse' 或 'unknown'
+    """
+    if isinstance(e, AppAuthError):
+        return 'auth'
+    if isinstance(e, AppNetworkError):
+        return 'network'
+    if isinstance(e, AppParseError):
+        return 'parse'
+    return 'unknown'
+
+
+class Supervisor:
+    """
+    决定 server 函数出错后，隔多久再重新运行它。
+
+    状态机：
+        running：正常运行；
+        backoff：刚出错，按错误的类别指数退避；同类错误发生的次数越多，退避越久；
+        crash_loop：短时间内出错次数过多，改用该类错误的最长退避时间。
+    server 函数正常运行足够久之后才出错，则认为此前已经恢复，回到 running 重新计数。
+
+    认证错误、网页结构错误或陷入崩溃循环时，通过 notify 通知用户；通知有最小间隔，不会刷屏。
+    """
+    __slots__ = ('state', 'notify', '__failures', '__recent', '__last_alert')
+
+    def __init__(self, notify: Optional[Callable[[str], None]] = None) -> None:
+        """
+        :param notify: 发送通知的函数，参数为通知的文本；不提供则只记日志
+        """
+        self.state = 'running'
+        self.notify = notify
+        # 错误类别 -> 自上次恢复以来发生的次数
+        self.__failures: Dict[str, int] = dict()
+        # 最近 CRASH_LOOP_WINDOW 秒内每次出错的时刻
+        self.__recent: Deque[float] = deque()
+        self.__last_alert: Optional[float] = None
+
+    def reset(self) -> None:
+        """
+        回到 running 状态，清空出错计数。通知的间隔不受影响。
+        :return: None
+        """
+        self.state = 'running'
+        self.__failures.clear()
+        self.__recent.clear()
+
+    def on_failure(self, e: BaseException, run_seconds: float) -> float:
+        """
+        记录一次出错，并计算下次运行前应等待的时间。
+        :param e: server 函数抛出的异常
+        :param run_seconds: 本次 server 函数从开始运行到出错经过的时间（秒）
+        :return: 应等待的时间（秒）
+        """
+        now = time.monotonic()
+        if run_seconds >= SUPERVISOR_HEALTHY_SECONDS:
+            self.reset()
+
+        kind = classify_failure(e)
+        count = self.__failures[kind] = self.__failures.get(kind, 0) + 1
+
+        self.__recent.append(now)
+        while self.__recent[0] < now - CRASH_LOOP_WINDOW:
+            self.__recent.popleft()
+
+        base, cap = SUPERVISOR_BACKOFF[kind]
+        if len(self.__recent) >= CRASH_LOOP_THRESHOLD:
+            self.state = 'crash_loop'
+            delay = cap
+        else:
+            self.state = 'backoff'
+            delay = min(cap, base * 2 ** (count - 1))
+        # 加入随机抖动，避免多个实例在同一时刻重试
+        delay *= random.uniform(0.8, 1.2)
+
+        logger.warning(f'Server failed ({kind} failure #{count}, state={self.state}), '
+                       f'retry in {delay:.0f}s: {e}')
+
+        if self.state == 'crash_loop' or kind in ('auth', 'parse'):
+            self.__alert(f'[WARN] 服务器出错（{kind}，第 {count} 次），将在 {delay:.0f} 秒后重试：\n{e}', now)
+
+        return delay
+
+    def __alert(self, text: str, now: float) -> None:
+        if self.notify is None:
+            return
+        if self.__last_alert is not None and now - self.__last_alert < SUPERVISOR_ALERT_INTERVAL:
+            return
+
+        self.__last_alert = now
+        self.notify(text)
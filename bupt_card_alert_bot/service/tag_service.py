@@ -0,0 +1,109 @@
+__all__ = ('TAG_FIELDS', 'compile_tag_rules', 'join_tags', 'split_tags', 'TagEngine')
+
+import hashlib
+import json
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, Pattern, Tuple
+
+from ..constant import *
+from ..exceptions import AppError
+from ..popo import TagRule, Transaction
+
+# 规则可以匹配的字段；any 表示两者之一
+TAG_FIELDS = ('location', 'category')
+
+# 编译后的规则：(标签, 正则, 匹配的字段)
+CompiledTagRule = Tuple[str, Pattern, Tuple[str, ...]]
+
+
+@lru_cache(maxsize=TAG_COMPILE_CACHE_SIZE)
+def compile_tag_rules(rules: Tuple[TagRule, ...]) -> Tuple[CompiledTagRule, ...]:
+    """
+    编译标签规则。结果会被缓存，相同的规则只编译一次。
+    :param rules: TagRule 的 tuple（须可哈希）
+    :return: 按规则的顺序排列的 (标签, 正则, 匹配的字段)
+    """
+    res = []
+    for rule in rules:
+        try:
+            regex = re.compile(rule.pattern)
+        except re.error as e:
+            raise AppError(f'标签 {rule.tag} 的正则表达式有误：{e}') from e
+        res.append((rule.tag, regex, TAG_FIELDS if rule.field == 'any' else (rule.field,)))
+    return tuple(res)
+
+
+def join_tags(tags: Iterable[str]) -> str:
+    """
+    将标签连接为存储在历史记录中的字符串，如 canteen,lunch。
+    """
+    return ','.join(tags)
+
+
+def split_tags(text: str) -> Tuple[str, ...]:
+    """
+    join_tags 的逆操作。
+    """
+    return tuple(text.split(',')) if text else ()
+
+
+class TagEngine:
+    """
+    根据配置文件中的规则，为消费记录加上标签，如“学一食堂”、“学二食堂”都加上 canteen，“西区浴室”加上 shower。
+    标签与消费记录一同存储在历史记录中（参见 HistoryDao），提醒规则也可以按标签统计（参见 AlertEngine）。
+
+    每条规则独立匹配，因此“学一食堂”可以同时匹配 学一食堂（canteen-1）与 食堂（canteen）两条规则，得到两个标签。
+    一条消费记录的标签按规则的顺序排列，且不重复。
+    标签只取决于科目描述与终端名称，而终端的数量有限，因此结果按两者的组合缓存，绝大多数消费记录无需再匹配正则。
+    """
+    __slots__ = ('rules', 'digest', '__compiled', '__memo')
+
+    def __init__(self, rules: Iterable[TagRule] = ()) -> None:
+        """
+        :param rules: 规则
+        """
+        self.set_rules(rules)
+
+    def set_rules(self, rules: Iterable[TagRule]) -> None:
+        """
+        替换规则。
+        :param rules: 规则
+        :return: None
+        """
+        self.rules: Tuple[TagRule, ...] = tuple(rules)
+        # 规则的摘要；摘要变化时，历史记录中已存储的标签需要重新计算
+        self.digest = hashlib.sha1(json.dumps(self.rules, ensure_ascii=False).encode(UNIFIED_ENCODING)).hexdigest()
+        self.__compiled = compile_tag_rules(self.rules)
+        # (科目描述, 终端名称) -> 标签
+        self.__memo: Dict[Tuple[str, str], Tuple[str, ...]] = dict()
+
+    def tags(self, trans: Transaction) -> Tuple[str, ...]:
+        """
+        计算一条消费记录的标签。
+        :param trans: Transaction 对象
+        :return: 标签的 tuple，可能为空
+        """
+        key = (trans.category, trans.location)
+        res = self.__memo.get(key)
+        if res is not None:
+            return res
+
+        found = []
+        for tag, regex, fields in self.__compiled:
+            if tag not in found and any(regex.search(getattr(trans, x)) for x in fields):
+                found.append(tag)
+        res = tuple(found)
+
+        if len(self.__memo) >= TAG_MEMO_SIZE:
+            self.__memo.clear()
+        self.__memo[key] = res
+        return res
+
+    def tags_text(self, trans: Transaction) -> str:
+        """
+        计算一条消费记录的标签，并连接为存储在历史记录中的字符串。
+        :param trans: Transaction 对象
+        :return: 如 canteen,lunch；没有标签时为空字符串
+        """
+        return join_tags(self.tags(trans))
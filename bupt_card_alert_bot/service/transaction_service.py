@@ -1,9 +1,11 @@
-__all__ = ('combine_continuous_small_transactions',)
+__all__ = ('combine_continuous_small_transactions', 'combine_2_transactions',
+           'format_transaction_alert', 'StreamingCombiner')
 from itertools import islice
-from typing import List
+from typing import List, Dict, Tuple, Optional, Any
 
-from ..constant import COMBINE_AMOUNT
+from ..constant import COMBINE_AMOUNT, DEFAULT_COMBINE_HOLD_SECONDS
 from ..popo import Transaction
+from ..util import timestamp_now
 
 
 def is_combinable(a: Transaction, b: Transaction, threshold: float) -> bool:
@@ -22,12 +24,30 @@ def is_combinable(a: Transaction, b: Transaction, threshold: float) -> bool:
 
 
 def combine_2_transactions(a: Transaction, b: Transaction) -> Transaction:
-    a_dict = a._asdict()
-    a_dict['trans_amount'] += b.trans_amount
-    a_dict['balance'] = b.balance
+    """
+    将 b 合并到 a 之后：金额相加，余额取 b 的余额，其余字段取 a 的。
+    :param a: 较早的 Transaction 对象
+    :param b: 较晚的 Transaction 对象
+    :return: 合并后的 Transaction 对象
+    """
+    return a._replace(trans_amount=a.trans_amount + b.trans_amount, balance=b.balance)
 
-    res = Transaction(**a_dict)
-    return res
+
+def format_transaction_alert(trans: Transaction) -> str:
+    """
+    生成发送给用户的消费通知的内容（HTML 格式）。
+    :param trans: Transaction 对象
+    :return: 消息内容
+    """
+    return '\n'.join((
+        f'<b>校园卡支出 {trans.trans_amount:.2f} 元</b>',
+        f'',
+        f'<b>时间：</b>{trans.op_datetime}',
+        f'<b>消费类别：</b>{trans.category}',
+        f'<b>位置：</b>{trans.location}',
+        f'',
+        f'<b>钱包余额：</b>{trans.balance:.2f} 元',
+    ))
 
 
 def combine_continuous_small_transactions(transactions: List[Transaction],
@@ -44,17 +64,178 @@ def combine_continuous_small_transactions(transactions: List[Transaction],
     if len(transactions) == 0:
         return []
 
-    res = [transactions[0]]
+    res = []
+
+    # 当前这一段可合并记录的第一笔，以及这一段的金额之和、最后一笔
+    # 只在一段结束时才构造一次新的 Transaction，避免每次合并都重建 namedtuple
+    first = last = transactions[0]
+    amount = first.trans_amount
 
     # 跳过 list 中第一个元素
     for trans in islice(transactions, 1, None):
-        # 如果不可合并，就直接插入
-        if is_combinable(res[-1], trans, threshold):
-            # namedtuple 是不可变的。
-            # 先移除最后一个，再插入合并后的新 Transaction
-            last = res.pop()
-            res.append(combine_2_transactions(last, trans))
+        if is_combinable(last, trans, threshold):
+            amount += trans.trans_amount
         else:
-            res.append(trans)
+            # 如果不可合并，就结束当前这一段
+            res.append(_build_combined(first, last, amount))
+            first = trans
+            amount = trans.trans_amount
+        last = trans
 
+    res.append(_build_combined(first, last, amount))
     return res
+
+
+def _build_combined(first: Transaction, last: Transaction, amount: float) -> Transaction:
+    """
+    由一段可合并记录的第一笔、最后一笔和金额之和，构造合并后的 Transaction。
+    只有一笔时直接返回原对象。
+    """
+    if first is last:
+        return first
+    return first._replace(trans_amount=amount, balance=last.balance)
+
+
+class _OpenGroup:
+    """
+    StreamingCombiner 中一个尚未发送的小额消费组。
+    """
+    __slots__ = ('first', 'trans_amount', 'balance', 'last_seen')
+
+    def __init__(self, first: Transaction, trans_amount: float, balance: float, last_seen: int) -> None:
+        self.first = first
+        self.trans_amount = trans_amount
+        self.balance = balance
+        self.last_seen = last_seen
+
+    def build(self) -> Transaction:
+        if self.trans_amount == self.first.trans_amount and self.balance == self.first.balance:
+            return self.first
+        return self.first._replace(trans_amount=self.trans_amount, balance=self.balance)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'first': list(self.first),
+            'trans_amount': self.trans_amount,
+            'balance': self.balance,
+            'last_seen': self.last_seen,
+        }
+
+    @staticmethod
+    def from_json(obj: Dict[str, Any]) -> '_OpenGroup':
+        return _OpenGroup(
+            first=Transaction._make(obj['first']),
+            trans_amount=obj['trans_amount'],
+            balance=obj['balance'],
+            last_seen=obj['last_seen'],
+        )
+
+
+class StreamingCombiner:
+    """
+    跨轮询的流式小额消费合并器。
+
+    combine_continuous_small_transactions 只能合并同一次轮询中获取到的记录，
+    一次洗澡若跨越两次轮询，用户就会收到两条通知。
+    本类对每个 (消费类别, 位置) 维护一个“未发送组”：小额消费先被暂扣在组中，
+    直到超过 hold_seconds 没有新的同类小额消费，或到达了一笔不可合并的大额消费时，才合并发送。
+    hold_seconds 只是暂扣的时长，而不限制两笔消费之间的间隔：与 combine_continuous_small_transactions 一样，
+    同一次 feed 中的同类小额消费总会被合并。因此 hold_seconds 为 0 时，各组在 feed 结束时即被发送，
+    退化为只在单次轮询内合并。
+
+    未发送组可以通过 dump 方法导出为 JSON 兼容的对象，并在构造时传回，以便在重启后恢复。
+    """
+    __slots__ = ('threshold', 'hold_seconds', '__groups')
+
+    def __init__(self, threshold: float = COMBINE_AMOUNT,
+                 hold_seconds: int = DEFAULT_COMBINE_HOLD_SECONDS,
+                 groups: Optional[List[Dict[str, Any]]] = None) -> None:
+        """
+        初始化流式合并器。
+        :param threshold: 金额小于该参数的消费记录会被暂扣与合并
+        :param hold_seconds: 一组小额消费在没有新的同类小额消费到达时，最多被暂扣多久（秒）
+        :param groups: dump 方法的返回值，用于恢复重启前的未发送组
+        """
+        if hold_seconds < 0:
+            raise ValueError('hold_seconds 不能小于 0')
+
+        self.threshold = threshold
+        self.hold_seconds = hold_seconds
+        self.__groups: Dict[Tuple[str, str], _OpenGroup] = dict()
+        self.load(groups or [])
+
+    def load(self, groups: List[Dict[str, Any]]) -> None:
+        """
+        以 dump 方法的返回值替换所有未发送组，如发送失败后回退到 feed 之前的状态。
+        :param groups: dump 方法的返回值
+        :return: None
+        """
+        self.__groups.clear()
+        for obj in groups:
+            group = _OpenGroup.from_json(obj)
+            self.__groups[(group.first.category, group.first.location)] = group
+
+    def feed(self, transactions: List[Transaction], now: Optional[int] = None) -> List[Transaction]:
+        """
+        送入新获取到的消费记录，返回此时可以发送给用户的（合并后的）消费记录。
+        :param transactions: list，元素为 Transaction；传入前必须已按时间戳排序
+        :param now: 当前 Unix 时间戳，默认为 timestamp_now()
+        :return: 可以发送的 Transaction list，按时间戳排序
+        """
+        if now is None:
+            now = timestamp_now()
+
+        res = []
+        for trans in transactions:
+            if trans.trans_amount >= self.threshold:
+                # 到达了不可合并的消费：先发送此前暂扣的所有组，再发送该消费
+                res.extend(self.flush_all())
+                res.append(trans)
+                continue
+
+            key = (trans.category, trans.location)
+            group = self.__groups.get(key)
+            if group is None:
+                self.__groups[key] = _OpenGroup(trans, trans.trans_amount, trans.balance, now)
+            else:
+                group.trans_amount += trans.trans_amount
+                group.balance = trans.balance
+                group.last_seen = now
+
+        res.extend(self.flush_expired(now))
+        res.sort(key=lambda x: x.op_timestamp)
+        return res
+
+    def flush_expired(self, now: Optional[int] = None) -> List[Transaction]:
+        """
+        取出已暂扣超过 hold_seconds 的组。
+        :param now: 当前 Unix 时间戳，默认为 timestamp_now()
+        :return: 合并后的 Transaction list，按时间戳排序
+        """
+        if now is None:
+            now = timestamp_now()
+
+        expired = [k for k, v in self.__groups.items() if now - v.last_seen >= self.hold_seconds]
+        res = [self.__groups.pop(k).build() for k in expired]
+        res.sort(key=lambda x: x.op_timestamp)
+        return res
+
+    def flush_all(self) -> List[Transaction]:
+        """
+        取出所有未发送的组。
+        :return: 合并后的 Transaction list，按时间戳排序
+        """
+        res = [x.build() for x in self.__groups.values()]
+        self.__groups.clear()
+        res.sort(key=lambda x: x.op_timestamp)
+        return res
+
+    def dump(self) -> List[Dict[str, Any]]:
+        """
+        将未发送组导出为 JSON 兼容的对象，用于持久化。
+        :return: list，元素为 dict
+        """
+        return [x.to_json() for x in self.__groups.values()]
+
+    def __len__(self) -> int:
+        return len(self.__groups)
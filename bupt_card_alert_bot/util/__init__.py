@@ -2,3 +2,7 @@ from .rnd_util import *
 from .file_util import *
 from .requests_util import *
 from .date_util import *
+from .rate_limit_util import *
+from .hash_ring_util import *
+from .profile_util import *
+from .proxy_pool_util import *
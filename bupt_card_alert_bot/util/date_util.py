@@ -2,7 +2,7 @@
 与 Bot 主要逻辑相关的日期、时间函数。
 """
 
-__all__ = ('get_begin_end_date', 'parse_ecard_date',
+__all__ = ('get_begin_end_date', 'parse_ecard_date', 'date_to_timestamp',
            'timestamp_now', 'tz_beijing', 'get_reasonable_interval')
 import time
 import warnings
@@ -10,6 +10,7 @@ from datetime import datetime, timedelta, timezone
 from typing import Tuple
 
 from ..constant import *
+from .profile_util import stage_timer
 
 tz_beijing = timezone(timedelta(hours=8))
 
@@ -46,11 +47,22 @@ def parse_ecard_date(ecard_date: str) -> int:
     :param ecard_date: 形如：2019/9/12 22:52:18 的日期
     :return: Unix 时间戳，int 类型
     """
-    dt = datetime.strptime(ecard_date, '%Y/%m/%d %H:%M:%S')
+    with stage_timer.stage('strptime'):
+        dt = datetime.strptime(ecard_date, '%Y/%m/%d %H:%M:%S')
     dt = dt.replace(tzinfo=tz_beijing)
     return int(dt.timestamp())
 
 
+def date_to_timestamp(date: str) -> int:
+    """
+    将形如 2000-01-01 的日期解析为北京时间当天 0 点的 Unix 时间戳。
+    :param date: 形如 2000-01-01 的日期
+    :return: Unix 时间戳，int 类型
+    """
+    dt = datetime.strptime(date, '%Y-%m-%d').replace(tzinfo=tz_beijing)
+    return int(dt.timestamp())
+
+
 def timestamp_now() -> int:
     """
     返回当前的 Unix 时间戳（秒，整数）。
@@ -0,0 +1,50 @@
+"""
+一致性哈希。
+"""
+
+__all__ = ('HashRing',)
+import hashlib
+from bisect import bisect
+from typing import Iterable, Optional
+
+from ..constant import *
+
+
+def hash_key(key: str) -> int:
+    """
+    将字符串映射到 64 位整数。不使用内置的 hash，因为它在不同进程间不一致。
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode(UNIFIED_ENCODING), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    一致性哈希环。
+    每个节点在环上放置 replicas 个虚拟节点；节点增减时，只有少量的键会改变归属。
+    """
+    __slots__ = ('__points', '__owners')
+
+    def __init__(self, nodes: Iterable[str], replicas: int = HASH_RING_REPLICAS) -> None:
+        """
+        :param nodes: 节点名
+        :param replicas: 每个节点的虚拟节点数
+        """
+        ring = sorted(
+            (hash_key(f'{node}#{i}'), node)
+            for node in set(nodes)
+            for i in range(replicas)
+        )
+        self.__points = [x[0] for x in ring]
+        self.__owners = [x[1] for x in ring]
+
+    def owner(self, key: str) -> Optional[str]:
+        """
+        返回键所属的节点。环为空时返回 None。
+        :param key: 键
+        :return: 节点名，或 None
+        """
+        if len(self.__points) == 0:
+            return None
+
+        i = bisect(self.__points, hash_key(key))
+        return self.__owners[i % len(self.__owners)]
@@ -0,0 +1,137 @@
+"""
+与性能分析相关的工具类。
+"""
+
+__all__ = ('StageTimer', 'stage_timer', 'StackSampler')
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from ..constant import *
+
+# 当前线程的 CPU 时间；Python 3.6 中没有 time.thread_time，只能退而使用整个进程的 CPU 时间
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+class StageTimer:
+    """
+    按“阶段”（如登录、解析 HTML、发送 Telegram 消息）累计耗时的计时器，线程安全。
+    同时记录墙上时间与 CPU 时间：两者之差大致是等待网络、磁盘或锁的时间。
+
+    默认不启用，此时 stage 几乎没有开销，因此可以常驻在代码中。
+    阶段可以嵌套，每个阶段的耗时都包含其内部的子阶段。
+    """
+    __slots__ = ('enabled', '__totals', '__lock')
+
+    def __init__(self) -> None:
+        self.enabled = False
+        # 阶段名 -> [调用次数, 墙上时间, CPU 时间]
+        self.__totals: Dict[str, List[float]] = dict()
+        self.__lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        用法：with stage_timer.stage('soup'): ...
+        :param name: 阶段名
+        """
+        if not self.enabled:
+            yield
+            return
+
+        wall_begin = time.perf_counter()
+        cpu_begin = thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_begin
+            cpu = thread_time() - cpu_begin
+            with self.__lock:
+                total = self.__totals.setdefault(name, [0, 0.0, 0.0])
+                total[0] += 1
+                total[1] += wall
+                total[2] += cpu
+
+    def reset(self) -> None:
+        with self.__lock:
+            self.__totals.clear()
+
+    def report(self) -> str:
+        """
+        生成按墙上时间降序排列的汇总表。
+        :return: 多行字符串
+        """
+        with self.__lock:
+            rows = sorted(self.__totals.items(), key=lambda x: -x[1][1])
+
+        lines = [f'{"stage":<16}{"calls":>8}{"wall(s)":>12}{"cpu(s)":>12}{"wall/call(ms)":>16}']
+        for name, (calls, wall, cpu) in rows:
+            lines.append(f'{name:<16}{calls:>8}{wall:>12.3f}{cpu:>12.3f}{wall / calls * 1000:>16.2f}')
+        return '\n'.join(lines)
+
+
+# 全局共享的计时器，各模块在关键阶段上调用其 stage 方法；由 --profile 启用
+stage_timer = StageTimer()
+
+
+class StackSampler:
+    """
+    采样式性能分析器。
+    在后台线程中每隔 interval 秒抓取一次目标线程的调用栈，统计各调用栈出现的次数，
+    并输出为 flamegraph.pl / speedscope 等工具可以直接读取的 collapsed stack 格式。
+
+    与 cProfile 不同，采样几乎不拖慢被分析的代码，因此各函数的耗时比例更接近真实情况。
+    """
+    __slots__ = ('interval', 'target_thread_id', '__counts', '__stop', '__thread')
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL,
+                 target_thread_id: Optional[int] = None) -> None:
+        """
+        :param interval: 采样间隔（秒）
+        :param target_thread_id: 被采样的线程，默认为创建本对象的线程
+        """
+        self.interval = interval
+        self.target_thread_id = target_thread_id if target_thread_id is not None else threading.get_ident()
+        self.__counts: Counter = Counter()
+        self.__stop = threading.Event()
+        self.__thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, name='stack-sampler', daemon=True)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __run(self) -> None:
+        while not self.__stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            # collapsed 格式中，调用栈从最外层开始，以分号分隔
+            self.__counts[';'.join(reversed(stack))] += 1
+
+    def write_collapsed(self, path: str) -> int:
+        """
+        将采样结果写入文件，每行形如“外层;...;内层 次数”。
+        :param path: 文件路径
+        :return: 总采样次数
+        """
+        with open(path, 'w', encoding=UNIFIED_ENCODING) as f:
+            for stack, count in self.__counts.most_common():
+                f.write(f'{stack} {count}\n')
+        return sum(self.__counts.values())
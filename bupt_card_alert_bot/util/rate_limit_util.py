@@ -0,0 +1,185 @@
+"""
+与限流相关的工具类。
+"""
+
+__all__ = ('TokenBucket', 'HostRateLimiter', 'rate_limit_key')
+import heapq
+import itertools
+import threading
+import time
+from typing import Optional, Dict, List
+from urllib.parse import urlsplit
+
+from ..constant import *
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶。
+    令牌以 rate 个/秒的速度生成，最多积攒 capacity 个；每次请求消耗若干令牌，令牌不足时等待。
+    """
+    __slots__ = ('rate', 'capacity', '__tokens', '__last', '__lock')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+        初始化令牌桶。初始时桶是满的。
+        :param rate: 持续速率（令牌/秒）
+        :param capacity: 桶的容量，即允许的突发请求数
+        """
+        if rate <= 0 or capacity <= 0:
+            raise ValueError('rate 与 capacity 都应该大于 0')
+
+        self.rate = rate
+        self.capacity = capacity
+        self.__tokens = capacity
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def __refill(self, now: float) -> None:
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__last) * self.rate)
+        self.__last = now
+
+    def peek_tokens(self) -> float:
+        """
+        返回当前桶内的令牌数（不消耗令牌）。
+        """
+        with self.__lock:
+            self.__refill(time.monotonic())
+            return self.__tokens
+
+    def set_tokens(self, tokens: float) -> None:
+        """
+        直接设置桶内的令牌数，用于恢复重启前的状态。
+        """
+        with self.__lock:
+            self.__tokens = max(0.0, min(self.capacity, tokens))
+            self.__last = time.monotonic()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        尝试立即消耗令牌。
+        :param tokens: 要消耗的令牌数
+        :return: 0 表示成功；否则为还需等待多少秒才能有足够的令牌（此时不消耗令牌）
+        """
+        with self.__lock:
+            self.__refill(time.monotonic())
+            if self.__tokens >= tokens:
+                self.__tokens -= tokens
+                return 0
+            return (tokens - self.__tokens) / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        消耗令牌，令牌不足时阻塞等待。
+        :param tokens: 要消耗的令牌数，不能大于 capacity
+        :param timeout: 最长等待时间（秒），None 表示一直等待
+        :return: 是否成功消耗了令牌（仅在超时时为 False）
+        """
+        if tokens > self.capacity:
+            raise ValueError('tokens 不能大于 capacity')
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return True
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+def rate_limit_key(url: str) -> str:
+    """
+    计算 url 所属的限流键。
+    一般为主机名；经 WebVPN 转发的请求（形如 https://vpn.bupt.edu.cn/http/ecard.bupt.edu.cn/...）
+    则为“VPN 主机名/被转发的主机名”，使 vpn 本身与其后的各个网站分别限流。
+    :param url: URL
+    :return: 限流键
+    """
+    parts = urlsplit(url)
+    host = parts.hostname or ''
+    segments = parts.path.split('/', 3)
+    if len(segments) >= 3 and segments[1] in ('http', 'https') and segments[2]:
+        return f'{host}/{segments[2]}'
+    return host
+
+
+class HostRateLimiter:
+    """
+    按主机限流的令牌桶集合，带优先级队列。
+    同一个限流键下的请求按优先级（数字越小越优先）、再按到达顺序排队，依次取得令牌；
+    因此交互式的查询总是排在后台轮询之前。
+    一个进程中的所有账号应共享同一个实例，从而共同遵守学校网站的限速。
+    """
+    __slots__ = ('rate', 'burst', '__buckets', '__queues', '__cond', '__seq')
+
+    def __init__(self, rate: float = DEFAULT_HOST_RATE, burst: float = DEFAULT_HOST_BURST) -> None:
+        """
+        :param rate: 每个限流键的持续速率（请求/秒）
+        :param burst: 每个限流键允许的突发请求数
+        """
+        self.rate = rate
+        self.burst = burst
+        self.__buckets: Dict[str, TokenBucket] = dict()
+        self.__queues: Dict[str, List] = dict()
+        self.__cond = threading.Condition()
+        self.__seq = itertools.count()
+
+    def __bucket(self, key: str) -> TokenBucket:
+        # 调用者需持有 self.__cond
+        bucket = self.__buckets.get(key)
+        if bucket is None:
+            bucket = self.__buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def acquire(self, url: str, priority: int = PRIORITY_BACKGROUND) -> None:
+        """
+        在向 url 发送请求前调用，阻塞直到轮到本请求并取得令牌。
+        :param url: 要请求的 URL
+        :param priority: 优先级，数字越小越优先，参考 PRIORITY_* 常量
+        :return: None
+        """
+        key = rate_limit_key(url)
+        entry = (priority, next(self.__seq))
+
+        with self.__cond:
+            queue = self.__queues.setdefault(key, [])
+            heapq.heappush(queue, entry)
+            try:
+                while True:
+                    if queue[0] == entry:
+                        wait = self.__bucket(key).try_acquire()
+                        if wait == 0:
+                            return
+                        # 排在队首但令牌不足：等待令牌生成，期间若有更高优先级的请求到达，会被唤醒重新比较
+                        self.__cond.wait(wait)
+                    else:
+                        self.__cond.wait()
+            finally:
+                queue.remove(entry)
+                heapq.heapify(queue)
+                self.__cond.notify_all()
+
+    def dump(self) -> Dict[str, List[float]]:
+        """
+        导出各限流键剩余的令牌数，用于在重启后恢复，避免重启后立即以满桶的速度突发请求。
+        :return: dict，键为限流键，值为 [令牌数, Unix 时间戳]
+        """
+        with self.__cond:
+            now = time.time()
+            return {k: [v.peek_tokens(), now] for k, v in self.__buckets.items()}
+
+    def load(self, state: Dict[str, List[float]]) -> None:
+        """
+        恢复 dump 导出的状态，并补上导出后经过的时间内生成的令牌。
+        :param state: dump 的返回值
+        :return: None
+        """
+        with self.__cond:
+            now = time.time()
+            for key, (tokens, timestamp) in state.items():
+                self.__bucket(key).set_tokens(tokens + max(0.0, now - timestamp) * self.rate)
@@ -1,13 +1,15 @@
-__all__ = ('fix_response_encoding', 'RetrySession', 'retry_get', 'retry_post')
+__all__ = ('fix_response_encoding', 'read_text_until', 'RetrySession', 'retry_get', 'retry_post')
+import codecs
 import logging as pym_logging
-from typing import Any
+from typing import Any, Optional, Sequence
 from typing import Tuple
 
 import chardet
 import requests
 
 from ..constant import *
-from ..exceptions import AppError
+from ..exceptions import AppNetworkError
+from .rate_limit_util import HostRateLimiter
 
 DUMMY_OBJ = object()
 logger = pym_logging.getLogger(__name__)
@@ -26,11 +28,63 @@ def fix_response_encoding(resp: requests.Response) -> None:
     resp.encoding = res['encoding']
 
 
+def read_text_until(resp: requests.Response, markers: Sequence[str],
+                    chunk_size: int = STREAM_CHUNK_SIZE) -> Tuple[str, bool]:
+    """
+    以流的方式读取 resp 的正文（请求时需指定 stream=True），边下载边增量地解码，
+    依次找到 markers 中的每一段文字后（后一段须出现在前一段之后），立即停止下载并关闭连接；
+    若读完了整个正文，则不关闭连接，使其回到连接池中供下次请求复用。
+    与 resp.text 相比，不必等待、也不必保存整个正文，且只解码一次。
+
+    编码取自响应头，响应头中没有编码时按 UTF-8 解码。
+    读取后 resp.content 与 resp.text 将不可用。
+
+    :param resp: 以 stream=True 发出的请求的返回值
+    :param markers: 依次要找到的文字
+    :param chunk_size: 每次读取的字节数
+    :return: (已读取的文本, 是否找到了全部 markers)；未全部找到时，文本为完整的正文
+    """
+    decoder = codecs.getincrementaldecoder(resp.encoding or UNIFIED_ENCODING)(errors='replace')
+    # 标记可能跨越两个块，因此每次查找时带上上一块末尾的 keep 个字符
+    keep = max((len(x) for x in markers), default=1) - 1
+    pieces = []
+    tail = ''
+    i = 0
+
+    try:
+        for chunk in resp.iter_content(chunk_size):
+            text = decoder.decode(chunk)
+            pieces.append(text)
+
+            window = tail + text
+            pos = 0
+            while i < len(markers):
+                found = window.find(markers[i], pos)
+                if found == -1:
+                    break
+                pos = found + len(markers[i])
+                i += 1
+
+            if i == len(markers):
+                # 提前停止时，剩余的内容不再下载，连接也不再复用
+                resp.close()
+                return ''.join(pieces), True
+            tail = window[max(pos, len(window) - keep):]
+    except requests.RequestException as e:
+        resp.close()
+        raise AppNetworkError(f'读取 {resp.url} 的内容时出错。') from e
+
+    # 正文已完整读取，urllib3 已将连接放回连接池，不关闭 resp，以便下次请求复用该连接
+    pieces.append(decoder.decode(b'', final=True))
+    return ''.join(pieces), i == len(markers)
+
+
 def retry_http(req_obj: Any, method: str, url: str, retry_times: int,
-               timeout: Tuple[float, float], **kwargs) -> requests.Response:
+               timeout: Tuple[float, float], limiter: Optional[HostRateLimiter] = None,
+               priority: int = PRIORITY_BACKGROUND, **kwargs) -> requests.Response:
     """
     内部函数，外部代码不应使用。将与出错重试相关的代码抽象成了一个函数。
-    该函数重复调用 retry_times 次 requests 的 API，如果成功执行则退出循环，否则抛出 AppError，
+    该函数重复调用 retry_times 次 requests 的 API，如果成功执行则退出循环，否则抛出 AppNetworkError，
     将最后一次循环捕捉到的异常作为其 cause 属性。
 
     :param req_obj: 拥有 request 方法，使用方式类似 requests 的对象（如 Session）
@@ -38,6 +92,8 @@ def retry_http(req_obj: Any, method: str, url: str, retry_times: int,
     :param url: URL
     :param retry_times: 最大重试次数
     :param timeout: 超时时间（使用默认即可，参考 requests 文档）
+    :param limiter: 限流器；不为 None 时，每次尝试前都要先从中取得令牌
+    :param priority: 在限流器中排队时的优先级
     :param kwargs: 其它参数（参考 requests 文档）
     :return: requests.Response
     """
@@ -46,6 +102,9 @@ def retry_http(req_obj: Any, method: str, url: str, retry_times: int,
 
     # 尝试重复运行 requests API
     for retry_count in range(retry_times):
+        if limiter is not None:
+            limiter.acquire(url, priority)
+
         try:
             # 如果成功运行，就退出循环，否则继续循环
             res = req_obj.request(method, url, timeout=timeout, **kwargs)
@@ -59,7 +118,7 @@ def retry_http(req_obj: Any, method: str, url: str, retry_times: int,
 
     # 如果未成功执行，就将记录的最后一个 err 抛出去
     if res is DUMMY_OBJ:
-        raise AppError(f'向 {url} 发送 {method} 请求已尝试 {retry_times} 次且均未成功。') from err
+        raise AppNetworkError(f'向 {url} 发送 {method} 请求已尝试 {retry_times} 次且均未成功。') from err
     return res
 
 
@@ -96,17 +155,20 @@ def retry_post(url: str, retry_times=RETRY_TIMES,
 class RetrySession:
     """
     requests.Session 的包装类，用于使其 get 和 post 方法支持重试功能。
+    如果提供了限流器，每个请求（包括每次重试）发出前都会先在限流器中排队。
     """
-    __slots__ = ('sess',)
+    __slots__ = ('sess', 'limiter')
 
-    def __init__(self, sess: requests.Session):
+    def __init__(self, sess: requests.Session, limiter: Optional[HostRateLimiter] = None):
         if sess is None or not isinstance(sess, requests.Session):
             raise ValueError('sess 不能为 None，且必须为 Session 类型的对象')
 
         self.sess = sess
+        self.limiter = limiter
 
     def get(self, url: str, retry_times=RETRY_TIMES,
-            timeout: Tuple[float, float] = DEFAULT_REQ_TIMEOUT, **kwargs) -> requests.Response:
+            timeout: Tuple[float, float] = DEFAULT_REQ_TIMEOUT,
+            priority: int = PRIORITY_BACKGROUND, **kwargs) -> requests.Response:
         """
         有重试地调用 requests 的 get 方法。
         当出错时，抛出 IOError。
@@ -114,14 +176,16 @@ class RetrySession:
         :param url: URL
         :param retry_times: 最大重试次数
         :param timeout: 超时时间（使用默认即可，参考 requests 文档）
+        :param priority: 在限流器中排队时的优先级，参考 PRIORITY_* 常量
         :param kwargs: 其它参数（参考 requests 文档）
         :return: requests.Response
         """
         return retry_http(self.sess, 'get', url, retry_times=retry_times,
-                          timeout=timeout, **kwargs)
+                          timeout=timeout, limiter=self.limiter, priority=priority, **kwargs)
 
     def post(self, url: str, retry_times=RETRY_TIMES,
-             timeout: Tuple[float, float] = DEFAULT_REQ_TIMEOUT, **kwargs) -> requests.Response:
+             timeout: Tuple[float, float] = DEFAULT_REQ_TIMEOUT,
+             priority: int = PRIORITY_BACKGROUND, **kwargs) -> requests.Response:
         """
         有重试地调用 requests 的 post 方法。
         当出错时，抛出 IOError。
@@ -129,11 +193,12 @@ class RetrySession:
         :param url: URL
         :param retry_times: 最大重试次数
         :param timeout: 超时时间（使用默认即可，参考 requests 文档）
+        :param priority: 在限流器中排队时的优先级，参考 PRIORITY_* 常量
         :param kwargs: 其它参数（参考 requests 文档）
         :return: requests.Response
         """
         return retry_http(self.sess, 'post', url, retry_times=retry_times,
-                          timeout=timeout, **kwargs)
+                          timeout=timeout, limiter=self.limiter, priority=priority, **kwargs)
 
     def cookies(self) -> Any:
         """
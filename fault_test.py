@@ -0,0 +1,248 @@
+"""
+故障注入测试：在本地启动模拟的 WebVPN、ecard 与 Telegram 服务器，按场景文件（参见 load_fault_scenarios）
+在请求中注入故障，如 VPN 会话被重置、半开的连接、残缺的 ASPX 页面、Telegram 返回 502 等，
+测量 Bot 的重试（RetrySession、TgBotClient.fan_out）、重新登录（AccountClient）与重发（TransactionNotifier）逻辑的表现：
+    恢复时间：从故障结束到各账号首次完整成功的轮询结束，包括等待下次轮询的时间。完整成功指查询与通知都未出错，
+        且该轮询开始前产生的消费记录都已发送通知：表格未变化而跳过的轮询不能说明此前的通知都已发送；
+    浪费的请求：失败的轮询发出的全部请求，以及成功的轮询中被注入了错误的请求；
+    遗漏与重复的通知：与模拟数据中实际产生的消费记录逐条比对。
+通知由 main.py 所用的 TransactionNotifier 发送，各账号的消息索引与历史记录存放在临时目录中。
+为使每条通知都对应一条消费记录，本测试不合并小额消费（合并器的 threshold 为 0）。
+
+用法示例：
+    python fault_test.py --scenarios fault_scenarios.json --accounts 3 --interval 2 --duration 40
+"""
+
+import argparse
+import logging as pym_logging
+import os
+import statistics
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from bupt_card_alert_bot import *
+
+argp = argparse.ArgumentParser(description='Measure how the bot recovers from faults injected into its HTTP requests.')
+argp.add_argument('--scenarios', default='fault_scenarios.json',
+                  help='Scenario file. Default: %(default)s')
+argp.add_argument('--only', nargs='*', default=None, metavar='NAME', help='Only run these scenarios.')
+argp.add_argument('--accounts', type=int, default=3, help='Number of accounts to poll. Default: %(default)s')
+argp.add_argument('--interval', type=float, default=2.0,
+                  help='Poll interval of each account in seconds. Default: %(default)s')
+argp.add_argument('--duration', type=float, default=40.0,
+                  help='How long each scenario runs in seconds; fault times are relative to its start. '
+                       'Default: %(default)s')
+argp.add_argument('--settle', type=float, default=60.0,
+                  help='After the duration, how long to wait at most for every account to recover. '
+                       'Default: %(default)s')
+argp.add_argument('--latency', type=float, default=0.01,
+                  help='Fixed latency of each fake request in seconds. Default: %(default)s')
+argp.add_argument('--rate-per-hour', type=float, default=720.0,
+                  help='Average transactions per account per hour. Default: %(default)s')
+argp.add_argument('--seed', type=int, default=0, help='Seed of the fake data and of the faults. Default: %(default)s')
+argp.add_argument('--verbose', action='store_true', help='Show the log of the bot.')
+
+# 这些故障会使请求失败或得到错误的内容；latency 与 drop_cookies 本身不算浪费的请求
+FAILING_FAULT_KINDS = ('error', 'hang', 'status', 'truncate')
+
+# 模拟数据只保留最近一小时的消费记录：消费频率较高时，若保留多天的记录，页面会大到解析本身就要数秒
+HISTORY_DAYS = 1 / 24
+
+
+class FaultTestAccount:
+    __slots__ = ('client', 'tgbot', 'notifier', 'combiner', 'alert_engine', 'chat_id', 'sessions', 'known',
+                 'polls', 'wasted')
+
+    def __init__(self, name: str, chat_id: int, campus_url: str, tg_url: str,
+                 faults: List[Fault], seed: int, data_dir: str) -> None:
+        campus_sess = FaultInjectingSession(faults, f'{seed}:{name}:campus')
+        tg_sess = FaultInjectingSession(faults, f'{seed}:{name}:telegram')
+        self.sessions = (campus_sess, tg_sess)
+        self.client = AccountClient(
+            AccountConfig(name=name, vpn_username=name, vpn_password='pass',
+                          ecard_username=name, ecard_password='pass', chat_ids=None),
+            sess=campus_sess, vpn_base=campus_url,
+        )
+        self.tgbot = TgBotClient('fault-test', api_base=tg_url, sess=RetrySession(tg_sess),
+                                 msg_index=MessageIndexDao(os.path.join(data_dir, f'{name}.msg_index.json')))
+        # HistoryDao 的连接只能在创建它的线程中使用，因此由 open_notifier 在该账号的轮询线程中创建
+        self.notifier: Optional[TransactionNotifier] = None
+        self.combiner = StreamingCombiner(threshold=0)
+        self.alert_engine = AlertEngine()
+        self.chat_id = chat_id
+        self.known = TransactionLog()
+        # (开始时刻, 结束时刻, 是否未出错, 是否完整成功)，时刻相对于故障的起点
+        self.polls: List[Tuple[float, float, bool, bool]] = []
+        self.wasted = 0
+
+    def open_notifier(self, data_dir: str) -> None:
+        history_dao = HistoryDao(os.path.join(data_dir, f'{self.client.account.name}.history.sqlite3'))
+        self.notifier = TransactionNotifier(self.tgbot, TagEngine(), history_dao)
+
+    def counters(self) -> Tuple[int, int]:
+        """
+        :return: (发出的请求数, 被注入了错误的请求数)
+        """
+        return (sum(x.requests_sent for x in self.sessions),
+                sum(x.injected[k] for x in self.sessions for k in FAILING_FAULT_KINDS))
+
+
+def poll_once(acc: FaultTestAccount) -> bool:
+    """
+    轮询一个账号一次，与 main.py 一样由 TransactionNotifier.deliver 发送新消费记录的通知；
+    通知发送失败时，deliver 不修改 known 并抛出 AppError，本次的通知会在下次轮询时重发。
+    :return: 查询与通知是否都未出错；表格未变化而跳过时也为 True，是否还有未发送的通知由 undelivered 判断
+    """
+    try:
+        current = acc.client.fetch_transactions(skip_if_unchanged=True)
+        if current is not None:
+            acc.notifier.deliver(acc.client.account.name, current, acc.known, acc.combiner, acc.alert_engine,
+                                 [acc.chat_id])
+            acc.client.commit_digest()
+    except AppError:
+        return False
+    return True
+
+
+def undelivered(acc: FaultTestAccount, generator: FakeTransactionGenerator, until: float) -> int:
+    """
+    :return: until（Unix 时间戳）之前已产生、但尚未成功发送通知的消费记录数
+    """
+    # 消费记录的时间戳只精确到秒，减去 1 秒，使这些记录确实已出现在 until 之后查询到的表格中
+    return sum(1 for x in generator.transactions(acc.client.account.ecard_username)
+               if x.op_timestamp <= until - 1 and x not in acc.known)
+
+
+def fault_window_end(scenario: FaultScenario) -> float:
+    """
+    场景中最后一个故障结束的时刻；一次性的故障（drop_cookies）在 at 时刻结束。
+    """
+    return max((x.at + (0.0 if x.kind == 'drop_cookies' else x.duration) for x in scenario.faults), default=0.0)
+
+
+def run_scenario(args: argparse.Namespace, scenario: FaultScenario) -> Dict[str, Any]:
+    generator = FakeTransactionGenerator(args.rate_per_hour, args.seed, HISTORY_DAYS)
+    campus = FakeCampusServer(latency=args.latency, generator=generator)
+    tg = FakeTelegramServer(latency=args.latency, keep_texts=True)
+    campus.start()
+    tg.start()
+
+    data_dir = tempfile.TemporaryDirectory(prefix='fault_test_')
+    accounts = [FaultTestAccount(f'fault{i:04d}', 1000 + i, campus.url, tg.url, scenario.faults, args.seed,
+                                 data_dir.name)
+                for i in range(args.accounts)]
+
+    # 首次轮询：登录并记下已有的消费记录，不发送通知，也不注入故障
+    baseline_at = time.time()
+    for acc in accounts:
+        acc.known.update(acc.client.fetch_transactions())
+    baseline = [set(acc.known) for acc in accounts]
+
+    window_end = fault_window_end(scenario)
+    started_at = time.monotonic()
+    cutoff = time.time() + args.duration
+    if scenario.quiet_after is not None:
+        generator.stop_at = time.time() + scenario.quiet_after
+    for acc in accounts:
+        for sess in acc.sessions:
+            sess.start(started_at)
+
+    def account_loop(i: int, acc: FaultTestAccount) -> None:
+        acc.open_notifier(data_dir.name)
+        # 各账号的轮询时刻均匀地错开；轮询超时时，跳过已经错过的轮询时刻
+        next_at = args.interval * i / len(accounts)
+        while True:
+            time.sleep(max(0.0, next_at - (time.monotonic() - started_at)))
+            sent, failed = acc.counters()
+            begin_at = time.time()
+            begin = time.monotonic() - started_at
+            ok = poll_once(acc)
+            end = time.monotonic() - started_at
+            sent2, failed2 = acc.counters()
+            caught_up = ok and undelivered(acc, generator, begin_at) == 0
+            acc.polls.append((begin, end, ok, caught_up))
+            acc.wasted += sent2 - sent if not ok else failed2 - failed
+
+            # 到达 duration 后，再等到一次完整成功的轮询，以确保此前产生的消费记录都已发送通知
+            if begin >= args.duration and caught_up or end >= args.duration + args.settle:
+                return
+            while next_at <= end:
+                next_at += args.interval
+
+    with ThreadPoolExecutor(len(accounts)) as executor:
+        list(executor.map(account_loop, range(len(accounts)), accounts))
+
+    campus.stop()
+    tg.stop()
+    data_dir.cleanup()
+
+    recoveries: List[Optional[float]] = []
+    expected = missed = duplicates = 0
+    for acc, known in zip(accounts, baseline):
+        recoveries.append(next((end - window_end for __, end, __, caught_up in acc.polls
+                                if caught_up and end >= window_end), None))
+
+        # 首次轮询之后、cutoff 之前产生的消费记录，都应恰好收到一条通知
+        texts = [format_transaction_alert(x) for x in generator.transactions(acc.client.account.ecard_username)
+                 if x not in known and baseline_at - 1 <= x.op_timestamp <= cutoff - 1]
+        expected += len(texts)
+        missed += sum(1 for x in texts if tg.texts[(acc.chat_id, x)] == 0)
+        duplicates += sum(v - 1 for (chat_id, __), v in tg.texts.items() if chat_id == acc.chat_id and v > 1)
+
+    injected = Counter()
+    for acc in accounts:
+        for sess in acc.sessions:
+            injected.update(sess.injected)
+    return {
+        'window_end': window_end,
+        'recoveries': recoveries,
+        'polls': sum(len(acc.polls) for acc in accounts),
+        'failed_polls': sum(1 for acc in accounts for x in acc.polls if not x[2]),
+        'requests': sum(acc.counters()[0] for acc in accounts),
+        'wasted': sum(acc.wasted for acc in accounts),
+        'injected': injected,
+        'expected': expected,
+        'missed': missed,
+        'duplicates': duplicates,
+    }
+
+
+def print_report(scenario: FaultScenario, stats: Dict[str, Any]) -> None:
+    print(f'== {scenario.name}: {scenario.description}')
+    print(f'Injected faults: {sum(stats["injected"].values())} '
+          f'({", ".join(f"{k}: {v}" for k, v in sorted(stats["injected"].items())) or "none"})')
+    print(f'Polls: {stats["polls"]}, failed: {stats["failed_polls"]}')
+
+    recovered = [x for x in stats['recoveries'] if x is not None]
+    text = f'Recovery after the faults ended (t={stats["window_end"]:.1f}s): '
+    text += f'{len(recovered)}/{len(stats["recoveries"])} accounts recovered'
+    if recovered:
+        text += f', median {statistics.median(recovered):.1f}s, max {max(recovered):.1f}s'
+    print(text)
+    print(f'Requests: {stats["requests"]}, wasted: {stats["wasted"]}')
+    print(f'Alerts: {stats["expected"]} expected, {stats["missed"]} missed, {stats["duplicates"]} duplicate')
+    print()
+
+
+def main() -> None:
+    args = argp.parse_args()
+    pym_logging.basicConfig(level=pym_logging.DEBUG if args.verbose else pym_logging.CRITICAL)
+
+    scenarios = load_fault_scenarios(args.scenarios)
+    if args.only:
+        unknown = set(args.only) - {x.name for x in scenarios}
+        if unknown:
+            argp.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+        scenarios = [x for x in scenarios if x.name in args.only]
+
+    for scenario in scenarios:
+        if fault_window_end(scenario) > args.duration:
+            print(f'Warning: faults of {scenario.name} last beyond --duration {args.duration}s.')
+        print_report(scenario, run_scenario(args, scenario))
+
+
+if __name__ == '__main__':
+    main()
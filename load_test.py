@@ -0,0 +1,194 @@
+"""
+压力测试：在本地启动模拟的 WebVPN、ecard 与 Telegram 服务器，按给定的轮询间隔同时轮询多个账号，
+测量每次轮询的耗时与 CPU 时间，估算单个 CPU 核心能支撑多少个账号。
+
+模拟服务器运行在子进程中，因此本进程统计的 CPU 时间只包含 Bot 自身（请求、解析、合并、发送）的开销。
+使用 --parse-processes 时，解析在进程池中进行，其 CPU 时间不计入本进程。
+
+用法示例：
+    python load_test.py --accounts 50 --interval 10 --duration 120 --latency 0.05
+"""
+
+import argparse
+import multiprocessing
+import statistics
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from bupt_card_alert_bot import *
+
+argp = argparse.ArgumentParser(description='Load-test the bot against local fake WebVPN/ecard/Telegram servers.')
+argp.add_argument('--accounts', type=int, default=20, help='Number of accounts to poll. Default: %(default)s')
+argp.add_argument('--interval', type=float, default=10.0,
+                  help='Poll interval of each account in seconds. Default: %(default)s')
+argp.add_argument('--duration', type=float, default=60.0, help='How long to run in seconds. Default: %(default)s')
+argp.add_argument('--latency', type=float, default=0.05,
+                  help='Fixed latency of each fake request in seconds. Default: %(default)s')
+argp.add_argument('--jitter', type=float, default=0.05,
+                  help='Upper bound of the random extra latency in seconds. Default: %(default)s')
+argp.add_argument('--rate-per-hour', type=float, default=6.0,
+                  help='Average transactions per account per hour. Default: %(default)s')
+argp.add_argument('--workers', type=int, default=8, help='Concurrent polls. Default: %(default)s')
+argp.add_argument('--host-rate', type=float, default=1000.0,
+                  help='Token rate of the shared host limiter (requests/second). Default: %(default)s')
+argp.add_argument('--parse-processes', type=int, default=0,
+                  help='Parse pages in a process pool of this size; 0 parses in-process. Default: %(default)s')
+argp.add_argument('--shared-vpn', action='store_true',
+                  help='Let all accounts share one WebVPN login and connection pool (vpn.shared).')
+argp.add_argument('--seed', type=int, default=0, help='Seed of the fake transaction generator. Default: %(default)s')
+
+
+def run_fake_servers(args: argparse.Namespace, conn: Any) -> None:
+    """
+    子进程入口：启动模拟服务器，将地址发送给父进程，等待父进程通知后停止，并回传统计数据。
+    """
+    campus = FakeCampusServer(latency=args.latency, jitter=args.jitter,
+                              generator=FakeTransactionGenerator(args.rate_per_hour, args.seed))
+    tg = FakeTelegramServer(latency=args.latency, jitter=args.jitter)
+    campus.start()
+    tg.start()
+    conn.send((campus.url, tg.url))
+
+    conn.recv()
+    conn.send({
+        'campus_requests': campus.requests,
+        'vpn_logins': campus.vpn_logins,
+        'tg_requests': tg.requests,
+        'messages': sum(tg.messages.values()),
+    })
+    campus.stop()
+    tg.stop()
+
+
+class LoadTestAccount:
+    __slots__ = ('client', 'chat_id', 'known', 'combiner')
+
+    def __init__(self, client: AccountClient, chat_id: int) -> None:
+        self.client = client
+        self.chat_id = chat_id
+        # 为 None 时表示尚未进行首次轮询；首次轮询只记录已有的消费记录，与 main.py 一致
+        self.known: Optional[Set[Transaction]] = None
+        self.combiner = StreamingCombiner()
+
+
+def poll_once(acc: LoadTestAccount, tgbot: TgBotClient) -> int:
+    """
+    轮询一个账号一次，并发送新消费记录的通知。
+    :return: 发送的通知数
+    """
+    current = acc.client.fetch_transactions(skip_if_unchanged=acc.known is not None)
+    if acc.known is None:
+        acc.known = current or set()
+        acc.client.commit_digest()
+        return 0
+
+    new_trans = sorted((current or set()) - acc.known, key=lambda x: (x.op_timestamp, -x.balance))
+    if current is not None:
+        acc.known.update(current)
+
+    sent = 0
+    for trans in acc.combiner.feed(new_trans):
+        tgbot.send_message(acc.chat_id, format_transaction_alert(trans))
+        sent += 1
+    acc.client.commit_digest()
+    return sent
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main() -> None:
+    args = argp.parse_args()
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    server_proc = multiprocessing.Process(target=run_fake_servers, args=(args, child_conn), daemon=True)
+    server_proc.start()
+    campus_url, tg_url = parent_conn.recv()
+    print(f'Fake campus server: {campus_url}, fake Telegram server: {tg_url}')
+
+    limiter = HostRateLimiter(args.host_rate, max(1, int(args.host_rate)))
+    parser_pool = ProcessPoolExecutor(args.parse_processes) if args.parse_processes > 0 else None
+    shared_vpn = SharedVpnSession('load-vpn', 'pass', limiter, campus_url) if args.shared_vpn else None
+    tgbot = TgBotClient('load-test', api_base=tg_url)
+    accounts = [
+        LoadTestAccount(AccountClient(
+            AccountConfig(name=f'load{i:04d}', vpn_username=f'load{i:04d}', vpn_password='pass',
+                          ecard_username=f'load{i:04d}', ecard_password='pass', chat_ids=None),
+            limiter=limiter, vpn_base=campus_url, parser_pool=parser_pool, shared_vpn=shared_vpn,
+        ), 1000 + i)
+        for i in range(args.accounts)
+    ]
+
+    # (耗时, 计划时刻的延误)；轮询失败数
+    results: List[Tuple[float, float]] = []
+    failures = 0
+    messages = 0
+    lock = threading.Lock()
+
+    def run(acc: LoadTestAccount, scheduled_at: float) -> None:
+        nonlocal failures, messages
+        begin = time.perf_counter()
+        try:
+            sent = poll_once(acc, tgbot)
+        except AppError:
+            with lock:
+                failures += 1
+            return
+        elapsed = time.perf_counter() - begin
+        with lock:
+            results.append((elapsed, begin - scheduled_at))
+            messages += sent
+
+    # 首次轮询（登录与读取已有记录）不计入统计
+    with ThreadPoolExecutor(args.workers) as executor:
+        list(executor.map(lambda acc: poll_once(acc, tgbot), accounts))
+
+    cpu_begin = time.process_time()
+    wall_begin = time.perf_counter()
+    with ThreadPoolExecutor(args.workers) as executor:
+        # 各账号的轮询时刻均匀地错开
+        schedule = [wall_begin + args.interval * i / len(accounts) for i in range(len(accounts))]
+        end_at = wall_begin + args.duration
+        while True:
+            i = min(range(len(accounts)), key=schedule.__getitem__)
+            if schedule[i] >= end_at:
+                break
+            time.sleep(max(0.0, schedule[i] - time.perf_counter()))
+            executor.submit(run, accounts[i], schedule[i])
+            schedule[i] += args.interval
+    wall = time.perf_counter() - wall_begin
+    cpu = time.process_time() - cpu_begin
+
+    if parser_pool is not None:
+        parser_pool.shutdown()
+    parent_conn.send(None)
+    server_stats: Dict[str, int] = parent_conn.recv()
+    server_proc.join()
+
+    latencies = [x[0] for x in results]
+    lags = [x[1] for x in results]
+    polls = len(results)
+    cpu_per_poll = cpu / polls if polls else 0.0
+    print(f'Accounts: {args.accounts}, interval: {args.interval}s, wall time: {wall:.1f}s, workers: {args.workers}')
+    print(f'Polls: {polls}, failures: {failures}, '
+          f'overruns (started > 1 interval late): {sum(1 for x in lags if x > args.interval)}')
+    if polls:
+        print(f'Poll latency: p50 {percentile(latencies, 0.5) * 1000:.1f} ms, '
+              f'p95 {percentile(latencies, 0.95) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms')
+        print(f'Schedule lag: mean {statistics.mean(lags) * 1000:.1f} ms, '
+              f'p95 {percentile(lags, 0.95) * 1000:.1f} ms')
+    print(f'CPU: {cpu:.2f}s total, {cpu_per_poll * 1000:.2f} ms per poll')
+    if cpu_per_poll > 0:
+        print(f'Estimated accounts per core at {args.interval}s interval: {args.interval / cpu_per_poll:.0f}')
+    print(f'Messages sent: {messages} (received by fake Telegram: {server_stats["messages"]}), '
+          f'campus requests: {server_stats["campus_requests"]}, VPN logins: {server_stats["vpn_logins"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,12 @@
 import argparse
-import gc
+import cProfile
 import logging as pym_logging
+import secrets
 import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from traceback import format_exc
-from typing import Set
+from typing import Set, Optional, List, Dict, Tuple, Any, Callable
 
 import requests
 
@@ -16,42 +19,143 @@ argp = argparse.ArgumentParser(description='Send alert with Telegram Bot when ne
 argp.add_argument('--deploy', action='store_true', help='Deploy telegram bot')
 argp.add_argument('--debug', action='store_true',
                   help='Turn on debug mode for development. Some behavior changes.')
+argp.add_argument('--trace-memory', action='store_true',
+                  help='Log tracemalloc top allocations periodically (slower).')
+argp.add_argument('--export', choices=sorted(EXPORT_FORMATS),
+                  help='Export the stored transaction history to a file, then exit.')
+argp.add_argument('--output', help='Output file of --export. Default: transactions.<format>')
+argp.add_argument('--backfill', action='store_true',
+                  help='Fetch the transactions between --since and --until (default: today) into the history '
+                       'database, using several sessions in parallel, then exit. Resumes from `__backfill.json`.')
+argp.add_argument('--since', help='With --export/--backfill: only records on or after this date, e.g. 2019-09-01')
+argp.add_argument('--until', help='With --export/--backfill: only records on or before this date, e.g. 2019-09-30')
+argp.add_argument('--account', help='With --export/--backfill: only records of this account')
+argp.add_argument('--sessions', type=int, default=DEFAULT_BACKFILL_SESSIONS,
+                  help='With --backfill: number of sessions logged in in parallel. Default: %(default)s')
+argp.add_argument('--chunk-days', type=int, default=DEFAULT_BACKFILL_CHUNK_DAYS,
+                  help='With --backfill: days queried by each request. Default: %(default)s')
+argp.add_argument('--cluster', metavar='NODE_ID',
+                  help='Run as one node of a multi-node deployment sharing `cluster.store`.')
+argp.add_argument('--profile', type=int, metavar='N',
+                  help='Run N poll iterations under the profilers, write the results, then exit.')
+argp.add_argument('--profile-output', default=DEFAULT_PROFILE_OUTPUT_PREFIX, metavar='PREFIX',
+                  help='With --profile: prefix of the output files. Default: %(default)s')
 sess = requests.Session()
 
 # 初始化当前应用中的类
-retry_sess = RetrySession(sess)
-sess_keep = SessionKeeper(retry_sess)
 config_dao = ConfigDao()
-trans_dao = TransactionDao()
-vpc = VpnClient(sess_keep)
-ecc = EcardClient(sess_keep)
 state_dao = StateDao()
+
+# 所有访问学校网站的请求共享同一个限流器，并恢复重启前的令牌数
+host_limiter = HostRateLimiter(
+    rate=config_dao['ratelimit.rate'] or DEFAULT_HOST_RATE,
+    burst=config_dao['ratelimit.burst'] or DEFAULT_HOST_BURST,
+)
+host_limiter.load(state_dao['rate_limit_state'])
+retry_sess = RetrySession(sess, host_limiter)
+sess_keep = SessionKeeper(retry_sess)
+trans_dao = TransactionDao()
+# 标签规则在 server 函数开始时由 sync_tag_rules 从配置文件读取；历史记录写入时用它计算标签
+tag_engine = TagEngine()
+history_dao = HistoryDao(tagger=tag_engine.tags_text)
+vpc = VpnClient(sess_keep, config_dao['vpn.base-url'] or DEFAULT_VPN_BASE)
+ecc = EcardClient(sess_keep, config_dao['vpn.base-url'] or DEFAULT_VPN_BASE)
+
+# 以下部件会启动子进程或后台线程，只在需要它们的 server、cluster_server、backfill_history 中创建，
+# 参见 start_parser_pool 与 start_local_servers；--export、--deploy 等不会创建它们
+# 监控很多账号时，在进程池中解析消费记录页面，使解析不再持有主进程的 GIL；修改 parse.processes 后需重启
+parser_pool: Optional[ProcessPoolExecutor] = None
+# 向本地的其它程序推送新的消费记录；未配置 events.socket 时为 None
+event_stream: Optional[EventStreamServer] = None
+# 只读的历史记录查询 API；未配置 api.listen 时为 None
+query_api: Optional[QueryApiServer] = None
+
+# 多账号时，所有账号可以共用一个 VPN 登录，修改 vpn.shared 后需重启
+shared_vpn = SharedVpnSession(
+    vpn_username=config_dao['vpn.username'],
+    vpn_password=config_dao['vpn.password'],
+    limiter=host_limiter,
+    vpn_base=config_dao['vpn.base-url'] or DEFAULT_VPN_BASE,
+) if config_dao['vpn.shared'] else None
 tgbot = TgBotClient(
     bot_token=config_dao['bot.api-token'],
     proxy_url=config_dao['proxy.url'],
+    msg_index=MessageIndexDao(),
+    api_base=config_dao['bot.api-base'] or DEFAULT_TG_API_BASE,
 )
+notifier = TransactionNotifier(tgbot, tag_engine, history_dao, state_dao)
 
 # 记录已经发送过通知的 Transaction（消费记录），初始为 None
-trans_log: Set[Transaction] = trans_dao.load_transaction_set()
-logger.debug(f'初始消费记录：{trans_log}')
+trans_log = trans_dao.load_transaction_log()
+logger.debug(f'初始消费记录：{trans_log.snapshot()}')
+
+# 跨轮询合并小额消费，并恢复重启前尚未发送的小额消费组
+combiner = StreamingCombiner(
+    hold_seconds=(config_dao['combine.hold-seconds']
+                  if config_dao['combine.hold-seconds'] is not None else DEFAULT_COMBINE_HOLD_SECONDS),
+    groups=state_dao['combine_open_groups'],
+)
+
+# 提醒规则的统计值与待命状态从状态文件中恢复；规则本身在 server 函数开始时从配置文件读取
+alert_engine = AlertEngine(state=state_dao['alert_engine'])
 
 
 # --- 以下定义各工具函数
+def start_parser_pool() -> None:
+    """
+    若配置了 parse.processes，则创建解析消费记录页面的进程池，并立即创建其子进程。
+    子进程由 fork 创建，而 fork 时其它线程持有的锁会以锁住的状态被复制到子进程中，
+    因此应在启动任何后台线程（代理探测、事件流、查询 API、Webhook）之前调用。重复调用时不做任何事。
+    :return: None
+    """
+    global parser_pool
+    processes = config_dao['parse.processes']
+    if parser_pool is not None or not processes:
+        return
+
+    parser_pool = ProcessPoolExecutor(processes)
+    # 较新的 Python 在提交任务时才按需创建子进程；一次提交与进程数相同的任务，使子进程在此时就被创建
+    for future in [parser_pool.submit(int) for __ in range(processes)]:
+        future.result()
+    ecc.parser_pool = parser_pool
+
+
+def start_local_servers() -> None:
+    """
+    创建并启动已配置的事件流服务器与查询 API，以及 Telegram 代理的后台探测。
+    修改 events.socket、api.listen 后需重启。重复调用时不做任何事。
+    :return: None
+    """
+    global event_stream, query_api
+    if event_stream is None and config_dao['events.socket']:
+        event_stream = EventStreamServer(path=config_dao['events.socket'], seq=state_dao['event_stream_seq'])
+        event_stream.start()
+        notifier.event_stream = event_stream
+
+    if query_api is None and config_dao['api.listen']:
+        host, port = config_dao['api.listen'].rsplit(':', 1)
+        query_api = QueryApiServer(listen=(host, int(port)), reader=HistoryReader(history_dao.path))
+        query_api.start()
+
+    tgbot.start_proxy_probe()
+
+
 def vpn_ecard_login() -> None:
     """
     调用 VpnClient 与 EcardClient 类的 login 方法，使其处于已登录状态。
     :return: None
     """
-    vpc.login(
-        username=config_dao['vpn.username'],
-        password=config_dao['vpn.password'],
-    )
+    with stage_timer.stage('login'):
+        vpc.login(
+            username=config_dao['vpn.username'],
+            password=config_dao['vpn.password'],
+        )
 
-    ecc.goto_login_page()
-    ecc.login(
-        username=config_dao['ecard.username'],
-        password=config_dao['ecard.password'],
-    )
+        ecc.goto_login_page()
+        ecc.login(
+            username=config_dao['ecard.username'],
+            password=config_dao['ecard.password'],
+        )
 
 
 def print_user_info() -> None:
@@ -72,6 +176,8 @@ def print_user_info() -> None:
         logger.info(f'Bot username: @{tgbot.get_bot_name()}')
     except:
         raise AppFatalError('获取个人信息失败')
+    finally:
+        ecc.release_page()
 
 
 def gc_trans_log(lookup_timedelta_days: int = DEFAULT_ECARD_TIMEDELTA) -> None:
@@ -81,8 +187,17 @@ def gc_trans_log(lookup_timedelta_days: int = DEFAULT_ECARD_TIMEDELTA) -> None:
     :param lookup_timedelta_days: 在 ecard 网站上查询时，最大的“起始时间”距离今天的天数
     :return: None
     """
-    global trans_log
+    drop_old_transactions(trans_log, lookup_timedelta_days)
+
 
+def drop_old_transactions(trans: TransactionLog, lookup_timedelta_days: int = DEFAULT_ECARD_TIMEDELTA) -> None:
+    """
+    原地删除 trans 中的旧消费记录。详见 gc_trans_log 的文档。
+    只会弹出过期的记录，开销与过期记录数成正比，而不是与 trans 的大小成正比。
+    :param trans: 消费记录
+    :param lookup_timedelta_days: 在 ecard 网站上查询时，最大的“起始时间”距离今天的天数
+    :return: None
+    """
     # 应删掉 del_days_before 天（24 小时）之前的消费记录
     # 这样保证删除的消费记录一定查不到
     del_days_before = lookup_timedelta_days + 1
@@ -90,19 +205,348 @@ def gc_trans_log(lookup_timedelta_days: int = DEFAULT_ECARD_TIMEDELTA) -> None:
     # 应删掉时间戳在 del_timestamp_before 之前的消费记录
     del_timestamp_before = timestamp_now() - del_days_before * 24 * 60 * 60
 
-    # 只保留在 del_timestamp_before 之后的消费记录
-    new_trans_log = set(
-        x for x in trans_log if x.op_timestamp >= del_timestamp_before
+    dropped = trans.drop_before(del_timestamp_before)
+    logger.debug(f'GC：删除了时间戳 {del_timestamp_before} 之前的 {dropped} 条记录，余 {len(trans)} 条')
+
+
+def get_alert_chat_ids() -> List[int]:
+    """
+    返回应当接收消费通知的所有 chat id：部署时绑定的 chat，以及配置文件中额外指定的 chat。
+    :return: chat id 的 list
+    """
+    return [state_dao['tg_chat_id']] + (config_dao['bot.extra-chat-ids'] or [])
+
+
+def deliver_or_defer(current_trans: Set[Transaction]) -> bool:
+    """
+    单账号模式下，调用 notifier.deliver 发送本次的通知。
+    发送失败只说明 Telegram 一侧出了问题，学校网站的登录状态并无问题，因此不抛出异常使 server 重启并重新登录，
+    而是记录日志后返回 False：deliver 已回退了所有状态，下次轮询会重新解析表格并重发。
+    :param current_trans: 本次获取到的消费记录，参见 TransactionNotifier.deliver
+    :return: 是否发送成功
+    """
+    try:
+        notifier.deliver(config_dao['ecard.username'], current_trans, trans_log,
+                         combiner, alert_engine, get_alert_chat_ids())
+    except AppNetworkError as e:
+        logger.warning(f'{e}')
+        return False
+    return True
+
+
+def make_webhook_server() -> Optional[TgWebhookServer]:
+    """
+    根据配置文件生成 Webhook 服务器。如果未配置 bot.webhook-url，则返回 None，表示使用长轮询。
+    :return: 尚未启动的 TgWebhookServer，或 None
+    """
+    if config_dao['bot.webhook-url'] is None:
+        return None
+
+    host, port = config_dao['bot.webhook-listen'].rsplit(':', 1)
+    return TgWebhookServer(
+        listen=(host, int(port)),
+        # 未配置密钥时随机生成一个，setWebhook 时会一并告诉 Telegram
+        secret_token=config_dao['bot.webhook-secret'] or secrets.token_urlsafe(32),
     )
-    logger.debug(f'GC：原有 {len(trans_log)} 条记录，'
-                 f'保留时间戳 {del_timestamp_before} 之后的记录，余 {len(new_trans_log)} 条')
-    trans_log = new_trans_log
 
-    # 释放内存
-    gc.collect()
+
+def on_config_changed(diff: Dict[str, Tuple[Any, Any]]) -> None:
+    """
+    配置文件在运行时被修改后，只重建受影响的部件，保留已登录的会话与内存中的 trans_log。
+        Telegram 的 token、代理或 API 地址变化：只替换 Telegram 客户端的传输设置；
+        vpn 的账号或地址变化：重新登录 vpn 和 ecard（ecard 的会话依附于 vpn 会话）；
+        仅 ecard 的账号变化：只重新登录 ecard。
+    :param diff: 配置的差异，键为配置名，值为 (旧值, 新值)
+    :return: None
+    """
+    if diff.keys() & {'bot.api-token', 'proxy.url', 'bot.api-base'}:
+        logger.info('Telegram settings changed, rebuilding Telegram transport.')
+        tgbot.update_transport(
+            bot_token=config_dao['bot.api-token'],
+            proxy_url=config_dao['proxy.url'],
+            api_base=config_dao['bot.api-base'] or DEFAULT_TG_API_BASE,
+        )
+
+    if 'alerts.rules' in diff:
+        alert_engine.set_rules(get_alert_rules())
+
+    if 'tags.rules' in diff:
+        sync_tag_rules()
+
+    if 'combine.hold-seconds' in diff:
+        hold_seconds = config_dao['combine.hold-seconds']
+        combiner.hold_seconds = hold_seconds if hold_seconds is not None else DEFAULT_COMBINE_HOLD_SECONDS
+
+    if diff.keys() & {'vpn.username', 'vpn.password', 'vpn.base-url'}:
+        logger.info('VPN settings changed, logging in again.')
+        vpc.vpn_base = ecc.vpn_base = config_dao['vpn.base-url'] or DEFAULT_VPN_BASE
+        if shared_vpn is not None:
+            # 各账号在下次查询时会换用新的 VPN Cookie
+            shared_vpn.vpn_username = config_dao['vpn.username']
+            shared_vpn.vpn_password = config_dao['vpn.password']
+            shared_vpn.vpn_base = vpc.vpn_base
+            shared_vpn.ensure_login(shared_vpn.generation)
+        vpn_ecard_login()
+    elif diff.keys() & {'ecard.username', 'ecard.password'}:
+        logger.info('Ecard credentials changed, logging in to ecard again.')
+        ecc.goto_login_page()
+        ecc.login(
+            username=config_dao['ecard.username'],
+            password=config_dao['ecard.password'],
+        )
+
+
+def sleep_and_watch_config(seconds: float, stop_on_change: bool = False) -> bool:
+    """
+    休眠 seconds 秒，期间每隔 CONFIG_WATCH_INTERVAL 秒检查一次配置文件是否被修改。
+    :param seconds: 休眠时间（秒）
+    :param stop_on_change: 配置文件被修改时是否立即结束休眠
+    :return: 休眠期间配置文件是否被修改
+    """
+    changed = False
+    deadline = time.monotonic() + seconds
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return changed
+        time.sleep(min(remaining, CONFIG_WATCH_INTERVAL))
+        if len(config_dao.reload_if_changed()) != 0:
+            changed = True
+            if stop_on_change:
+                return changed
+
+
+def get_alert_rules() -> List[AlertRule]:
+    """
+    从配置文件中读取提醒规则。
+    :return: AlertRule 的 list
+    """
+    return [
+        AlertRule(
+            name=x['name'],
+            type=x['type'],
+            threshold=x['threshold'],
+            location=x.get('location', None),
+            rearm=x.get('rearm', None),
+        )
+        for x in config_dao['alerts.rules'] or []
+    ]
+
+
+def get_tag_rules() -> List[TagRule]:
+    """
+    从配置文件中读取标签规则。
+    :return: TagRule 的 list
+    """
+    return [
+        TagRule(
+            tag=x['tag'],
+            pattern=x['pattern'],
+            field=x.get('field', 'location'),
+        )
+        for x in config_dao['tags.rules'] or []
+    ]
+
+
+def sync_tag_rules() -> None:
+    """
+    从配置文件中读取标签规则；规则与上次不同时，重新计算历史记录中已存储的标签。
+    :return: None
+    """
+    tag_engine.set_rules(get_tag_rules())
+    if state_dao['tag_rules_digest'] != tag_engine.digest:
+        count = history_dao.retag()
+        state_dao['tag_rules_digest'] = tag_engine.digest
+        logger.info(f'Tag rules changed, retagged {count} history records.')
+
+
+def get_accounts() -> List[AccountConfig]:
+    """
+    从配置文件中读取所有要监控的账号。
+    未配置 accounts 时，只有一个由顶层 vpn/ecard 配置组成的账号。
+    :return: AccountConfig 的 list
+    """
+    accounts = config_dao['accounts']
+    if accounts is None:
+        accounts = [{
+            'ecard.username': config_dao['ecard.username'],
+            'ecard.password': config_dao['ecard.password'],
+        }]
+
+    return [
+        AccountConfig(
+            name=x.get('name', x['ecard.username']),
+            vpn_username=x.get('vpn.username', config_dao['vpn.username']),
+            vpn_password=x.get('vpn.password', config_dao['vpn.password']),
+            ecard_username=x['ecard.username'],
+            ecard_password=x['ecard.password'],
+            chat_ids=x.get('chat-ids', None),
+        )
+        for x in accounts
+    ]
+
+
+class ClusterAccount:
+    """
+    多节点部署时，本节点持有的一个账号及其运行时状态。
+    """
+    __slots__ = ('client', 'trans_log', 'combiner', 'alert_engine', 'next_poll_at')
+
+    def __init__(self, account: AccountConfig, handoff: Optional[Dict[str, Any]]) -> None:
+        """
+        :param account: 账号配置
+        :param handoff: 上一个持有者通过 LeaseDao.save_handoff 留下的状态，没有则为 None
+        """
+        if handoff is None:
+            handoff = dict()
+
+        self.client = AccountClient(account, limiter=host_limiter, parser_pool=parser_pool, shared_vpn=shared_vpn,
+                                    vpn_base=config_dao['vpn.base-url'] or DEFAULT_VPN_BASE)
+        self.client.import_cookies(handoff.get('cookies', []))
+        self.trans_log = TransactionLog(Transaction._make(x) for x in handoff.get('trans_log', []))
+        self.combiner = StreamingCombiner(
+            hold_seconds=(config_dao['combine.hold-seconds']
+                          if config_dao['combine.hold-seconds'] is not None else DEFAULT_COMBINE_HOLD_SECONDS),
+            groups=handoff.get('combine_open_groups', None),
+        )
+        self.alert_engine = AlertEngine(get_alert_rules(), handoff.get('alert_engine', None))
+        self.next_poll_at = 0.0
+
+    def handoff_state(self) -> Dict[str, Any]:
+        """
+        生成交给下一个持有者的状态：Cookie、排重记录、暂扣中的小额消费组和提醒规则的状态。
+        :return: 可以被 JSON 序列化的 dict
+        """
+        return {
+            'cookies': self.client.export_cookies(),
+            'trans_log': [list(x) for x in self.trans_log.snapshot()],
+            'combine_open_groups': self.combiner.dump(),
+            'alert_engine': self.alert_engine.dump(),
+        }
+
+
+def poll_cluster_account(acc: ClusterAccount, debug_mode: bool, renew_lease: Callable[[], bool]) -> bool:
+    """
+    多节点部署时，轮询本节点持有的一个账号，并将新消费记录发给该账号的接收者。
+    :param acc: 本节点持有的账号
+    :param debug_mode: 参见 server 函数的文档
+    :param renew_lease: 确认并续约该账号的租约的函数，参见 LeaseDao.renew
+    :return: 是否仍持有租约；为 False 时未发送任何通知，调用者应放弃该账号
+    """
+    account = acc.client.account
+    current_trans = acc.client.fetch_transactions(skip_if_unchanged=len(acc.trans_log) != 0)
+    if current_trans is None:
+        # 消费记录未变化，只需发出暂扣到期的小额消费组
+        current_trans = set()
+
+    # 与 server 函数相同：首次获取到的消费记录直接存起来，不发送
+    if not debug_mode and len(acc.trans_log) == 0:
+        acc.trans_log.update(current_trans)
+
+    # 查询可能因重试而耗时较久，期间租约可能已经过期并被其它节点接管；发送通知前再次确认并续约
+    if not renew_lease():
+        return False
+
+    notifier.deliver(account.name, current_trans, acc.trans_log, acc.combiner, acc.alert_engine,
+                     account.chat_ids or get_alert_chat_ids())
+    # 通知都已发送，此后相同的表格才可以跳过
+    acc.client.commit_digest()
+    drop_old_transactions(acc.trans_log)
+    return True
 
 
 # --- 以下为主程序的不同部分
+def export_history(fmt: str, out_path: Optional[str], since: Optional[str],
+                   until: Optional[str], account: Optional[str]) -> None:
+    """
+    将历史记录数据库中的消费记录以流的方式导出到文件。
+    :param fmt: 导出格式，EXPORT_FORMATS 的键之一
+    :param out_path: 导出文件的路径，None 表示 transactions.<fmt>
+    :param since: 起始日期（含），形如 2000-01-01
+    :param until: 截止日期（含），形如 2000-01-01
+    :param account: 只导出该 ecard 账号的记录
+    :return: None
+    """
+    if out_path is None:
+        out_path = f'transactions.{fmt}'
+
+    try:
+        since_ts = date_to_timestamp(since) if since is not None else None
+        # 截止日期当天的记录也要导出，因此取第二天 0 点
+        until_ts = date_to_timestamp(until) + 24 * 60 * 60 if until is not None else None
+    except ValueError:
+        raise AppFatalError('日期格式错误，应形如 2000-01-01。')
+
+    sync_tag_rules()
+    records = history_dao.iter_records(account=account, since_timestamp=since_ts, until_timestamp=until_ts)
+    count = export_records(records, fmt, out_path)
+    logger.info(f'Exported {count} transactions to {out_path}')
+
+
+def backfill_history(since: Optional[str], until: Optional[str], account_name: Optional[str],
+                     sessions: int, chunk_days: int) -> None:
+    """
+    补录较长时间内的历史记录：将日期范围切分为 chunk_days 天的区间，由 sessions 个各自登录的会话并发查询，
+    结果写入历史记录数据库（已存在的记录会被忽略）。
+    每完成一个区间就记入进度文件，中断后再次运行时只查询剩余的区间。
+    所有会话共享 host_limiter，不会因为并发而超出对学校网站的限流。
+    :param since: 起始日期（含），形如 2000-01-01
+    :param until: 截止日期（含），默认为今天
+    :param account_name: 只补录该账号，None 表示配置文件中的所有账号
+    :param sessions: 每个账号同时登录的会话数
+    :param chunk_days: 每个区间的天数
+    :return: None
+    """
+    if since is None:
+        raise AppFatalError('--backfill 需要 --since 参数。')
+    if sessions <= 0 or chunk_days <= 0:
+        raise AppFatalError('--sessions 与 --chunk-days 的参数必须为正整数。')
+    if until is None:
+        until = get_begin_end_date()[1]
+
+    try:
+        all_chunks = split_date_range(since, until, chunk_days)
+    except ValueError:
+        raise AppFatalError('日期格式错误，应形如 2000-01-01。')
+
+    accounts = [x for x in get_accounts() if account_name is None or x.name == account_name]
+    if not accounts:
+        raise AppFatalError(f'配置文件中没有名为 {account_name} 的账号。')
+
+    sync_tag_rules()
+    start_parser_pool()
+    checkpoint = BackfillCheckpointDao()
+    vpn_base = config_dao['vpn.base-url'] or DEFAULT_VPN_BASE
+    for account in accounts:
+        chunks = [x for x in all_chunks if not checkpoint.is_done(account.name, x)]
+        logger.info(f'Backfilling {account.name}: {len(chunks)} of {len(all_chunks)} chunks left')
+        if not chunks:
+            continue
+
+        clients = [AccountClient(account, limiter=host_limiter, vpn_base=vpn_base, parser_pool=parser_pool,
+                                 shared_vpn=shared_vpn)
+                   for __ in range(min(sessions, len(chunks)))]
+        done = 0
+        added = 0
+
+        def on_chunk(chunk: Tuple[str, str], trans: Set[Transaction]) -> None:
+            nonlocal done, added
+            # 先写入历史记录，再记入进度；中途退出时至多重复查询一个区间，重复的记录会被忽略
+            added += history_dao.append(account.name, trans)
+            checkpoint.mark_done(account.name, chunk)
+            done += 1
+            logger.info(f'[{done}/{len(chunks)}] {chunk[0]} ~ {chunk[1]}: {len(trans)} records')
+
+        def fetcher(client: AccountClient) -> Callable[[Tuple[str, str]], Set[Transaction]]:
+            return lambda chunk: client.fetch_transactions(lookup_date=chunk)
+
+        failed = Backfiller([fetcher(x) for x in clients]).run(chunks, on_chunk)
+        logger.info(f'Backfilled {account.name}: {added} new records')
+        if failed:
+            logger.warning(f'{len(failed)} chunks of {account.name} failed and will be retried next time: '
+                           f'{", ".join(f"{x[0]} ~ {x[1]}" for x in failed)}')
+
+
 def deploy_bot() -> None:
     """
     部署 Telegram Bot。
@@ -126,7 +570,16 @@ def deploy_bot() -> None:
     print(trigger_cmd + '\n\n')
     print(f'Please send the text within {DEFAULT_TG_POLL_TIMEOUT} seconds.')
 
-    chat_id = tgbot.wait_for_specific_message(trigger_cmd)
+    # 如果配置了 Webhook，则通过内嵌的 HTTP 服务器接收消息，而不是长轮询
+    webhook = make_webhook_server()
+    try:
+        if webhook is not None:
+            tgbot.enable_webhook(webhook, config_dao['bot.webhook-url'])
+        chat_id = tgbot.wait_for_specific_message(trigger_cmd)
+    finally:
+        # 部署结束后删除 Webhook，以免影响之后使用 getUpdates；enable_webhook 失败时已自行停止服务器
+        if tgbot.webhook is not None:
+            tgbot.disable_webhook()
     if chat_id is not None:
         # 收到了用户发送的消息，于是持久化 chat_id
         state_dao['tg_deployed'] = True
@@ -141,7 +594,8 @@ def deploy_bot() -> None:
         print('''2) Double-check whether your api token corresponds to your bot's name.''')
 
 
-def server(debug_mode: bool, startup_notify: bool) -> None:
+def server(debug_mode: bool, startup_notify: bool, mem_monitor: MemoryMonitor,
+           max_iterations: Optional[int] = None) -> None:
     """
     实现该服务器 App 主要逻辑的函数。
     该函数首先登录 vpn 和 ecard 网站，然后循环进行如下操作：
@@ -153,12 +607,12 @@ def server(debug_mode: bool, startup_notify: bool) -> None:
 
     :param debug_mode: 是否进入调试模式（可能改变部分行为）
     :param startup_notify: 服务器启动时是否通知用户
+    :param mem_monitor: 内存统计，主循环每执行一次调用一次其 tick 方法
+    :param max_iterations: 主循环最多执行的次数，None 表示永久执行。
+                           用于 --profile，此时循环之间不休眠，请求之间的间隔仅由 host_limiter 保证
     :return: None
     """
 
-    # trans_log 的值需要被修改
-    global trans_log
-
     logger.debug(f'服务器开始运行：server(debug_mode={debug_mode}, startup_notify={startup_notify})')
 
     # 如果 Telegram Bot 没有部署则退出
@@ -168,7 +622,13 @@ def server(debug_mode: bool, startup_notify: bool) -> None:
         exit(1)
 
     # 登录 vpn 和 ecard
+    # 在登录前检查一次配置文件，之后的修改由 on_config_changed 处理
+    config_dao.reload_if_changed()
+    alert_engine.set_rules(get_alert_rules())
+    sync_tag_rules()
+    start_parser_pool()
     vpn_ecard_login()
+    start_local_servers()
 
     # 通过获取个人信息，验证 vpn、ecard、tgbot 等配置是否正确
     # 如果配置错误，将无法正确获取个人信息
@@ -178,86 +638,245 @@ def server(debug_mode: bool, startup_notify: bool) -> None:
     if startup_notify:
         tgbot.send_message(state_dao['tg_chat_id'], '[INFO] 服务器开始运行', silent=True)
 
+        # 启动时创建的对象大多长期存活，将其冻结，使主循环中的 GC 不再扫描它们
+        tune_gc_after_startup()
+
     # 循环获取消费记录，并通过 Bot 发送给用户
     logger.info('Begin main loop...')
+    iterations = 0
     while True:
         logger.debug('开始一次新循环')
+        iterations += 1
 
         # 发送请求，查询消费记录
         ecc.goto_consume_info_page()
-        ecc.lookup_consume_info(
+        changed = ecc.lookup_consume_info(
             lookup_date=get_begin_end_date(),
-            with_sort_button=not ecc.is_sort_button_desc(),
+            skip_if_unchanged=len(trans_log) != 0,
         )
-        current_trans = ecc.parse_consume_info()
-
-        # 如果该循环第一次运行，就将获取到的消费记录直接存起来
-        # 在调试模式下则不进行此操作（因此初次部署时可以查看最初的 10 条记录）
-        if not debug_mode and len(trans_log) == 0:
-            trans_log = current_trans.copy()
-
-        # 计算哪些是新产生的消费记录
-        new_trans = sorted(
-            # 使用集合操作，过滤掉已经发送过通知的消费记录
-            current_trans - trans_log,
-
-            # 按照消费时间排序，如果一样，则余额大的在前
-            key=lambda x: (x.op_timestamp, -x.balance))
-        logger.debug(f'获得了 {len(current_trans)} 条消费记录, 其中 {len(new_trans)} 条为新记录')
-
-        # 为了防止洗澡等小额记录过多，合并细小的消费记录
-        # 为了不影响排重逻辑，应在服务器端存储原始消费记录，但是将合并的消费记录发送给用户
-        combined_trans = combine_continuous_small_transactions(new_trans)
-
-        # 将多条新的消费记录发送给用户
-        for trans in combined_trans:
-            logger.debug(f'发送 {trans.op_datetime} 的消费记录')
-            tgbot.send_message(state_dao['tg_chat_id'], '\n'.join((
-                f'<b>校园卡支出 {trans.trans_amount:.2f} 元</b>',
-                f'',
-                f'<b>时间：</b>{trans.op_datetime}',
-                f'<b>消费类别：</b>{trans.category}',
-                f'<b>位置：</b>{trans.location}',
-                f'',
-                f'<b>钱包余额：</b>{trans.balance:.2f} 元',
-            )))
-
-        # 将新获取的、合并后的 Transaction 记入 trans_log 中
-        trans_log.update(current_trans)
-
-        # 清理旧的消费记录缓存，然后持久化 trans_log
-        gc_trans_log()
-        trans_dao.store_transactions(trans_log)
-        logger.debug(f'成功持久化 trans_log。trans_log 元素个数: {len(trans_log)}')
+        if changed:
+            current_trans = ecc.parse_consume_info()
+
+            # 解析结果已与 DOM 树分离，立即释放整棵树，而不是让它在休眠期间一直占用内存
+            ecc.release_page()
+
+            # 如果该循环第一次运行，就将获取到的消费记录直接存起来
+            # 在调试模式下则不进行此操作（因此初次部署时可以查看最初的 10 条记录）
+            if not debug_mode and len(trans_log) == 0:
+                trans_log.update(current_trans)
+
+            # 排除重复的消费记录，合并后发给用户，并记入 trans_log 和历史记录
+            if deliver_or_defer(current_trans):
+                # 通知都已发送，此后相同的表格才可以跳过；deliver 失败时不记下摘要，下次轮询会重新解析并重发
+                ecc.commit_digest()
+
+                # 清理旧的消费记录缓存，然后持久化 trans_log 和暂扣中的小额消费组
+                gc_trans_log()
+                trans_dao.store_transaction_log(trans_log)
+                state_dao['combine_open_groups'] = combiner.dump()
+                state_dao['alert_engine'] = alert_engine.dump()
+                state_dao['rate_limit_state'] = host_limiter.dump()
+                logger.debug(f'成功持久化 trans_log。trans_log 元素个数: {len(trans_log)}，'
+                             f'暂扣中的小额消费组: {len(combiner)}')
+        elif len(combiner) != 0:
+            # 消费记录表格与上次完全相同：跳过解析、排重与持久化，只发出暂扣到期的小额消费组
+            if deliver_or_defer(set()):
+                state_dao['combine_open_groups'] = combiner.dump()
+
+        mem_monitor.tick()
+
+        # 性能分析模式下执行指定次数后返回，且循环之间不休眠
+        if max_iterations is not None:
+            if iterations >= max_iterations:
+                return
+            continue
 
         # 循环不能高速执行，否则会遭到学校反爬
-        time.sleep(get_reasonable_interval())
+        # 休眠期间若配置文件被修改，会通过 on_config_changed 只重建受影响的部件
+        sleep_and_watch_config(get_reasonable_interval())
+
+
+def cluster_server(node_id: str, debug_mode: bool) -> None:
+    """
+    以多节点部署中的一个节点的身份运行。
+    各节点通过共享的租约数据库（cluster.store）协调：每个账号由一致性哈希选出的存活节点持有租约并轮询；
+    节点宕机后不再续约与心跳，其账号在租约到期后由新选出的节点接管，
+    接管时沿用原节点最近一次保存的 Cookie 与排重记录，因此无需重新登录，也不会重复通知。
+    每个账号在轮询前、发送通知前都会续约，保存状态时也会确认租约仍归本节点所有，
+    因此失去租约的节点不会与接管者同时发送通知，也不会覆盖接管者保存的状态。
+    cluster.lease-seconds 应明显长于一次轮询中查询与发送通知所需的时间。
+
+    单节点部署请使用 run_server_forever，该函数不影响其行为。
+    :param node_id: 本节点的名字，各节点之间不能重复
+    :param debug_mode: 参见 server 函数的文档
+    :return: None
+    """
+    if config_dao['cluster.store'] is None:
+        raise AppFatalError('多节点部署需要在配置文件中指定 cluster.store。')
+    if not state_dao['tg_deployed']:
+        raise AppFatalError('Telegram Bot 尚未部署，请先使用 --deploy 选项部署。')
+
+    lease_dao = LeaseDao(config_dao['cluster.store'])
+    lease_seconds = config_dao['cluster.lease-seconds'] or DEFAULT_LEASE_SECONDS
+    accounts = {x.name: x for x in get_accounts()}
+    owned: Dict[str, ClusterAccount] = dict()
+    sync_tag_rules()
+
+    def hand_off(name: str) -> None:
+        # 保存状态并立即释放租约，使新的持有者可以马上接管
+        lease_dao.save_handoff(name, owned.pop(name).handoff_state(), node_id)
+        lease_dao.release(name, node_id)
+
+    def lose(name: str) -> None:
+        # 租约已过期并被其它节点接管，本节点的状态可能已经过时，直接丢弃
+        logger.warning(f'Lost the lease of account {name}')
+        owned.pop(name)
+
+    start_parser_pool()
+    start_local_servers()
+    logger.info(f'Node {node_id} joined the cluster. Accounts: {len(accounts)}')
+    try:
+        while True:
+            try:
+                # 心跳，并根据当前存活的节点重新计算每个账号应归属的节点
+                lease_dao.heartbeat(node_id)
+                ring = HashRing(lease_dao.live_nodes(lease_seconds))
+
+                for name, account in accounts.items():
+                    mine = ring.owner(name) == node_id
+                    if name in owned:
+                        if not mine:
+                            logger.info(f'Handing account {name} over to node {ring.owner(name)}')
+                            hand_off(name)
+                        elif not lease_dao.renew(name, node_id, lease_seconds):
+                            lose(name)
+                    elif mine and lease_dao.try_acquire(name, node_id, lease_seconds):
+                        logger.info(f'Took over account {name}')
+                        owned[name] = ClusterAccount(account, lease_dao.load_handoff(name))
+
+                # 轮询到期的账号；每个账号轮询完毕后保存一次状态，以便本节点宕机后其它节点接管
+                for name, acc in list(owned.items()):
+                    if acc.next_poll_at > time.monotonic():
+                        continue
+                    # 轮询前续约，使本次轮询拥有完整的租约有效期
+                    if not lease_dao.renew(name, node_id, lease_seconds):
+                        lose(name)
+                        continue
+
+                    try:
+                        held = poll_cluster_account(acc, debug_mode,
+                                                    partial(lease_dao.renew, name, node_id, lease_seconds))
+                    except AppError:
+                        logger.debug(f'轮询账号 {name} 时产生了可恢复的异常：{format_exc()}')
+                        held = True
+                    acc.next_poll_at = time.monotonic() + get_reasonable_interval()
+                    if not held or not lease_dao.save_handoff(name, acc.handoff_state(), node_id):
+                        lose(name)
+            except AppError:
+                # 如多个节点争用租约数据库时的 database is locked；下一轮再试
+                logger.warning(f'Cluster loop failed, retrying: {format_exc()}')
+
+            # 续约间隔为租约有效期的 1/3，保证在租约到期前至少有两次续约机会
+            time.sleep(lease_seconds / 3)
+    finally:
+        # 正常退出时主动交出所有账号，使其它节点无需等待租约过期
+        for name in list(owned):
+            hand_off(name)
 
 
 # --- 以下为主函数
 
-def run_server_forever(debug_mode: bool) -> None:
+def notify_supervisor_alert(text: str) -> None:
+    """
+    将 Supervisor 的通知发给用户。网络故障时通知本身也可能失败，此时只记日志。
+    :param text: 通知的文本
+    :return: None
+    """
+    try:
+        tgbot.send_message(state_dao['tg_chat_id'], text, html=False, silent=True)
+    except AppError:
+        logger.warning(f'Failed to send supervisor alert: {format_exc()}')
+
+
+def run_server_forever(debug_mode: bool, trace_memory: bool = False) -> None:
     """
     运行 server 函数，并捕捉其抛出的每一个 AppError。
     该函数只拦截 AppError。AppError 以外的错误将被抛出。
+    每次出错后，由 Supervisor 按错误的类别决定退避多久再重新运行，以免密码错误或网站故障时陷入紧密的登录循环；
+    退避期间若配置文件被修改（如改正了密码），则立即重新运行。
 
     :param debug_mode: 参见 server 函数的文档
+    :param trace_memory: 是否使用 tracemalloc 定期记录内存分配最多的代码行
     :return: None
     """
     # 该变量值第一次运行时为真，之后全为假
     startup_notify = True
 
+    # 内存统计在多次调用 server 之间保持，以便观察长期的内存增长
+    mem_monitor = MemoryMonitor(trace=trace_memory)
+
+    # 配置文件在运行时被修改时，只重建受影响的部件
+    config_dao.subscribe(on_config_changed)
+
+    supervisor = Supervisor(notify=notify_supervisor_alert)
+
     # 若发生 AppError 以外的异常，则直接抛出
     while True:
+        started = time.monotonic()
         try:
             # 永久循环，持续调用 server 函数
-            server(debug_mode, startup_notify)
-        except AppError:
+            server(debug_mode, startup_notify, mem_monitor)
+        except AppError as e:
             logger.debug(f'产生了可恢复的异常：{format_exc()}')
 
             # 从第二次执行前开始，将启动通知设为假
             startup_notify = False
 
+            delay = supervisor.on_failure(e, time.monotonic() - started)
+            try:
+                if sleep_and_watch_config(delay, stop_on_change=True):
+                    logger.info('Config changed during backoff, restarting server now.')
+                    supervisor.reset()
+            except AppError:
+                # on_config_changed 中的重新登录失败；server 函数会重新登录，其错误将再次交给 supervisor
+                logger.debug(f'退避期间应用新配置失败：{format_exc()}')
+
+
+def profile_server(iterations: int, debug_mode: bool, out_prefix: str) -> None:
+    """
+    在性能分析器下运行 iterations 次主循环，然后输出：
+        <out_prefix>.pstats：cProfile 的结果，可用 python -m pstats 或 snakeviz 查看；
+        <out_prefix>.collapsed：采样得到的 collapsed stack，可直接交给 flamegraph.pl 或 speedscope 生成火焰图；
+        以及日志中各阶段（登录、BeautifulSoup、正则、strptime、JSON 持久化、Telegram）的墙上时间与 CPU 时间汇总。
+
+    为了不让休眠淹没分析结果，循环之间不休眠，请求之间的间隔仅由 host_limiter 保证。
+    :param iterations: 主循环的执行次数
+    :param debug_mode: 参见 server 函数的文档
+    :param out_prefix: 输出文件的前缀
+    :return: None
+    """
+    if iterations <= 0:
+        raise AppFatalError('--profile 的参数必须为正整数。')
+
+    mem_monitor = MemoryMonitor(trace=False)
+    profiler = cProfile.Profile()
+    sampler = StackSampler()
+
+    stage_timer.enabled = True
+    sampler.start()
+    profiler.enable()
+    try:
+        server(debug_mode, startup_notify=False, mem_monitor=mem_monitor, max_iterations=iterations)
+    finally:
+        profiler.disable()
+        sampler.stop()
+        stage_timer.enabled = False
+
+        profiler.dump_stats(f'{out_prefix}.pstats')
+        samples = sampler.write_collapsed(f'{out_prefix}.collapsed')
+        logger.info(f'Wrote {out_prefix}.pstats and {out_prefix}.collapsed ({samples} samples)')
+        logger.info(f'Per-stage summary of {iterations} iterations:\n{stage_timer.report()}')
+
 
 def main() -> None:
     """
@@ -269,9 +888,21 @@ def main() -> None:
         if args.deploy:
             # Telegram Bot 部署模式
             deploy_bot()
+        elif args.export is not None:
+            # 导出历史记录
+            export_history(args.export, args.output, args.since, args.until, args.account)
+        elif args.backfill:
+            # 补录历史记录
+            backfill_history(args.since, args.until, args.account, args.sessions, args.chunk_days)
+        elif args.cluster is not None:
+            # 多节点部署模式
+            cluster_server(args.cluster, debug_mode=args.debug)
+        elif args.profile is not None:
+            # 性能分析模式
+            profile_server(args.profile, debug_mode=args.debug, out_prefix=args.profile_output)
         else:
             # 服务器模式
-            run_server_forever(debug_mode=args.debug)
+            run_server_forever(debug_mode=args.debug, trace_memory=args.trace_memory)
     except KeyboardInterrupt:
         logger.debug('run_server_forever 运行时发生了 KeyboardInterrupt')
     except Exception as e: